@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import abc
+import asyncio
+from typing import *
+
+from .Io import HardPWM
+from .Io import SoftPWM
+from . import Waveform
+
+
+class Keyframe(NamedTuple):
+    """An animation keyframe: the channel value to reach at a time (in seconds from the animation start).
+    """
+    time: float
+    value: Any
+
+
+class _AnimationChannel(abc.ABC):
+    max_duration = 4294967295
+    def __init__(self, target) -> None:
+        self.target = target
+    def _to_tuple(self, value) -> Tuple[float, ...]:
+        return (float(value),)
+    def _from_tuple(self, value: Tuple[float, ...]):
+        return value[0]
+    def _check(self, value) -> None:
+        pass
+    @abc.abstractmethod
+    def _control(self, value, duration: int):
+        pass
+    async def _write(self, ops: List[Tuple[_AnimationChannel, Any, int]], shorten: int) -> None:
+        # pins getting the same control share a bitmask
+        controls = {}
+        for channel, value, duration in ops:
+            key = (value, max(duration-shorten, 0) if duration > 0 else 0)
+            controls[key] = controls.get(key, 0)|(1<<channel.pin)
+        await self.target.control_pins([(mask, self._control(*key)) for key, mask in controls.items()])
+
+
+class HardPWMChannel(_AnimationChannel):
+    """A Hardware PWM pin animated by duty cycle, in %.
+    """
+    def __init__(self, hardpwm, pin: int) -> None:
+        """Constructor.
+
+        Args:
+            hardpwm: The Hardware PWM interface (``io.hardpwm``).
+            pin (int): The Hardware PWM pin number.
+
+        Raises:
+            ValueError: The pin number is out of range.
+        """
+        if pin < 0 or pin >= HardPWM.KONASHI_HARDPWM_COUNT:
+            raise ValueError(f"The pin number should be in the range [0,{HardPWM.KONASHI_HARDPWM_COUNT-1}]")
+        super().__init__(hardpwm)
+        self.pin = pin
+    def __repr__(self):
+        return f'HardPWMChannel(pin={self.pin})'
+    def _check(self, value) -> None:
+        if not 0 <= value <= 100:
+            raise ValueError("The duty needs to be in the range [0,100]")
+    def _control(self, value, duration: int):
+        return HardPWM.HardPWMPinControl(self.target.calc_control_value_for_duty(value), duration)
+
+
+class SoftPWMChannel(_AnimationChannel):
+    """A Software PWM pin animated by control value (duty cycle in 0.1% or period in ms, depending on the pin configuration).
+    """
+    def __init__(self, softpwm, pin: int) -> None:
+        """Constructor.
+
+        Args:
+            softpwm: The Software PWM interface (``io.softpwm``).
+            pin (int): The Software PWM pin number.
+
+        Raises:
+            ValueError: The pin number is out of range.
+        """
+        if pin < 0 or pin >= SoftPWM.KONASHI_SOFTPWM_COUNT:
+            raise ValueError(f"The pin number should be in the range [0,{SoftPWM.KONASHI_SOFTPWM_COUNT-1}]")
+        super().__init__(softpwm)
+        self.pin = pin
+    def __repr__(self):
+        return f'SoftPWMChannel(pin={self.pin})'
+    def _check(self, value) -> None:
+        if not 0 <= value <= 65535:
+            raise ValueError("The valid range for the control value is [0,65535]")
+    def _control(self, value, duration: int):
+        return SoftPWM.SoftPWMPinControl(int(round(value)), duration)
+
+
+class RGBLedChannel(_AnimationChannel):
+    """The builtin RGB LED animated by color, as (red,green,blue,alpha) tuples.
+    """
+    max_duration = 65535
+    def __init__(self, rgbled) -> None:
+        """Constructor.
+
+        Args:
+            rgbled: The RGB LED interface (``builtin.rgbled``).
+        """
+        super().__init__(rgbled)
+        self.pin = None
+    def __repr__(self):
+        return f'RGBLedChannel()'
+    def _to_tuple(self, value) -> Tuple[float, ...]:
+        return tuple(float(v) for v in value)
+    def _from_tuple(self, value: Tuple[float, ...]):
+        return tuple(int(round(v)) for v in value)
+    def _check(self, value) -> None:
+        if len(value) != 4 or not all(0 <= v <= 255 for v in value):
+            raise ValueError("The color should be a (red,green,blue,alpha) tuple with components in the range [0,255]")
+    def _control(self, value, duration: int):
+        return (*value, duration)
+    async def _write(self, ops: List[Tuple[_AnimationChannel, Any, int]], shorten: int) -> None:
+        # the LED is a single channel, set with its own command
+        channel, value, duration = ops[0]
+        await self.target.set(*self._control(value, max(duration-shorten, 0)))
+
+
+def _simplify(times: List[int], values: List[Tuple[float, ...]], tolerance: float) -> List[int]:
+    # keep the fewest keyframes such that the ramps between them pass within the tolerance of the dropped ones
+    kept = [0]
+    anchor = 0
+    for k in range(1, len(times)-1):
+        nxt = k+1
+        ok = times[nxt] > times[anchor]
+        for j in range(anchor+1, nxt):
+            if not ok:
+                break
+            f = (times[j]-times[anchor])/(times[nxt]-times[anchor])
+            for c in range(len(values[j])):
+                if abs(values[anchor][c]+(values[nxt][c]-values[anchor][c])*f-values[j][c]) > tolerance+1e-9:
+                    ok = False
+                    break
+        if not ok:
+            kept.append(k)
+            anchor = k
+    if len(times) > 1:
+        kept.append(len(times)-1)
+    return kept
+
+
+class Animation:
+    """Keyframe animation of PWM pins and RGB LEDs, played with the firmware transitions.
+    Each timeline is compiled into one control write per ramp: the firmware interpolates between the keyframes.
+    Writes of the same interface due at the same millisecond are packed into one command, and all the channels
+    (of one or several devices) are played on the same clock.
+    """
+    def __init__(self, tolerance: float=0.0) -> None:
+        """Constructor.
+
+        Args:
+            tolerance (float, optional): The maximum deviation allowed when merging keyframes lying on the same ramp, in channel value units. Defaults to 0.0.
+        """
+        if tolerance < 0:
+            raise ValueError("The tolerance cannot be negative")
+        self._tolerance = tolerance
+        self._tracks = []
+        self._frames = None
+
+    def __str__(self):
+        return f'KonashiAnimation(tracks={len(self._tracks)})'
+
+    def __repr__(self):
+        return f'KonashiAnimation(tolerance={self._tolerance})'
+
+
+    def add_track(self, channel: _AnimationChannel, keyframes: Sequence[Tuple[float, Any]]) -> None:
+        """Add a channel timeline.
+        The channel output jumps to the first keyframe value at its time, then ramps from keyframe to keyframe.
+
+        Args:
+            channel (HardPWMChannel | SoftPWMChannel | RGBLedChannel): The channel to animate.
+            keyframes (Sequence[Tuple[float, Any]]): The keyframes as (time in seconds, value), in time order.
+
+        Raises:
+            ValueError: There is no keyframe, the keyframes are not in time order, a value is out of range, or the channel already has a track.
+        """
+        if len(keyframes) == 0:
+            raise ValueError("The track has no keyframe")
+        for track in self._tracks:
+            if track[0].target is channel.target and track[0].pin == channel.pin:
+                raise ValueError(f"{channel!r} already has a track")
+        times = []
+        values = []
+        for keyframe in keyframes:
+            keyframe = Keyframe(*keyframe)
+            if keyframe.time < 0:
+                raise ValueError("The keyframe times cannot be negative")
+            channel._check(keyframe.value)
+            t = int(round(keyframe.time*1000))
+            if len(times) > 0 and t < times[-1]:
+                raise ValueError("The keyframes should be in time order")
+            times.append(t)
+            values.append(channel._to_tuple(keyframe.value))
+        self._tracks.append((channel, times, values))
+        self._frames = None
+
+    def _compile_track(self, channel: _AnimationChannel, times: List[int], values: List[Tuple[float, ...]]) -> Iterator[Tuple[int, Any, int]]:
+        kept = _simplify(times, values, self._tolerance)
+        yield (times[0], channel._from_tuple(values[0]), 0)
+        for a, b in zip(kept, kept[1:]):
+            t = times[a]
+            v0 = values[a]
+            duration = times[b]-times[a]
+            # split the ramps longer than the channel allows
+            steps = max(1, -(-duration//channel.max_duration))
+            for s in range(1, steps+1):
+                end = times[a]+duration*s//steps
+                f = (end-times[a])/duration if duration > 0 else 1.0
+                v = tuple(v0[c]+(values[b][c]-v0[c])*f for c in range(len(v0)))
+                yield (t, channel._from_tuple(v), end-t)
+                t = end
+
+    def compile(self) -> List[Tuple[int, List[Dict[Any, List[Tuple[_AnimationChannel, Any, int]]]]]]:
+        """Compile the tracks into timed write batches.
+        The result is cached until a track is added.
+
+        Returns:
+            List[Tuple[int, List[Dict[Any, List[Tuple[Any, Any, int]]]]]]: The frames, in time order.
+                For each Tuple:
+                int: The frame time in milliseconds.
+                List: The write batches, sent in order. Each batch maps an interface to its (channel, value, duration in ms) operations, packed into one write.
+        """
+        if self._frames is not None:
+            return self._frames
+        slots = {}
+        for channel, times, values in self._tracks:
+            for t, value, duration in self._compile_track(channel, times, values):
+                batches = slots.setdefault(t, [])
+                for batch in batches:
+                    ops = batch.setdefault(channel.target, [])
+                    # the same channel twice in a frame (jump then ramp) needs a second write
+                    if all(op[0] is not channel for op in ops):
+                        ops.append((channel, value, duration))
+                        break
+                else:
+                    batches.append({channel.target: [(channel, value, duration)]})
+        self._frames = sorted(slots.items(), key=lambda x: x[0])
+        return self._frames
+
+    @property
+    def writes(self) -> int:
+        """The number of writes needed to play the animation.
+        """
+        return sum(len(batch) for t, batches in self.compile() for batch in batches)
+
+    @property
+    def duration(self) -> float:
+        """The animation duration in seconds.
+        """
+        return max((times[-1] for channel, times, values in self._tracks), default=0)/1000
+
+
+    async def play(self, start: Optional[float]=None) -> Waveform.PlayStats:
+        """Play the animation.
+        The frames are written on absolute deadlines from the start time, so the write latency does not accumulate.
+        When a frame is late, its ramps are shortened to keep the following deadlines.
+
+        Args:
+            start (Optional[float], optional): The start time on the event loop clock (``loop.time()``).
+                Pass the same value to several animations to play them in sync. Defaults to None (now).
+
+        Returns:
+            PlayStats: The number of writes, the number of late frames and the maximum lateness in seconds.
+        """
+        def step(batches: List[Dict[Any, List[Tuple[_AnimationChannel, Any, int]]]]) -> Callable[[int], Awaitable[int]]:
+            async def write_frame(shorten: int) -> int:
+                writes = 0
+                for batch in batches:
+                    await asyncio.gather(*(ops[0][0]._write(ops, shorten) for ops in batch.values()))
+                    writes += len(batch)
+                return writes
+            return write_frame
+        return await Waveform.play_timed([(t, step(batches)) for t, batches in self.compile()], start)
@@ -17,11 +17,43 @@ from ..Errors import *
 KONASHI_UUID_BUILTIN_RGB_SET = "064d0403-8251-49d9-b6f3-f7ba35e5d0a1"
 KONASHI_UUID_BUILTIN_RGB_GET = "064d0404-8251-49d9-b6f3-f7ba35e5d0a1"
 
+_RGB_STRUCT = struct.Struct("<BBBBH")
+# extra time allowed for the transition end notification
+_RGB_TIMEOUT_MARGIN = 2.0
+
+
+def _follow(future: asyncio.Future, replaced: asyncio.Future) -> None:
+    # a command replaced before it was written ends with the command it was merged into
+    def done_cb(f):
+        if replaced.done():
+            return
+        if f.cancelled():
+            replaced.cancel()
+        elif f.exception() is not None:
+            replaced.set_exception(f.exception())
+        else:
+            replaced.set_result(f.result())
+    future.add_done_callback(done_cb)
+
+
+class _RGBCommand:
+    def __init__(self, frame: bytes, color: Tuple[int,int,int,int], duration: int, future: asyncio.Future, written: asyncio.Future) -> None:
+        self.frame = frame
+        self.color = color
+        self.duration = duration
+        self.future = future
+        self.written = written
+
 
 class _RGBLed(KonashiElementBase._KonashiElementBase):
     def __init__(self, konashi) -> None:
         super().__init__(konashi)
-        self._cb = None
+        self._observers = []
+        self._color = None
+        self._pending = None
+        self._transitions = KonashiElementBase._TransitionTracker()
+        self._guard = None
+        self._writer = None
 
     def __str__(self):
         return f'KonashiRGBLed'
@@ -35,15 +67,51 @@ class _RGBLed(KonashiElementBase._KonashiElementBase):
 
 
     def _ntf_cb(self, sender, data):
-        d = struct.unpack("<ccccH", data)
-        color = (d[0],d[1],d[2],d[3])
-        if self._cb is not None:
-            self._cb(color)
-            self._cb = None
-
-
-    async def set(self, r: int, g: int, b: int, a: int, duration: int, callback: Callable[[Tuple[int,int,int,int]], None] = None) -> None:
+        d = _RGB_STRUCT.unpack(data)
+        color = d[0:4]
+        self._color = color
+        future = self._transitions.end(0, color)
+        if future is not None:
+            if not future.done():
+                future.set_result(color)
+            self._cancel_guard()
+        for observer in list(self._observers):
+            observer(color)
+
+    def _cancel_guard(self) -> None:
+        if self._guard is not None:
+            self._guard.cancel()
+            self._guard = None
+
+    def _on_timeout(self, future: asyncio.Future) -> None:
+        self._guard = None
+        self._transitions.forget(0, future)
+        if not future.done():
+            future.set_exception(asyncio.TimeoutError("The RGB LED transition end was not notified"))
+
+    async def _write_loop(self) -> None:
+        loop = asyncio.get_event_loop()
+        while self._pending is not None:
+            command = self._pending
+            self._pending = None
+            self._cancel_guard()
+            self._transitions.register(0, command.color, command.future)
+            try:
+                await self._write(KONASHI_UUID_BUILTIN_RGB_SET, command.frame)
+            except Exception as e:
+                self._transitions.cancel({0: command.future})
+                command.written.set_exception(e)
+                continue
+            if not command.future.done():
+                self._guard = loop.call_later(command.duration/1000+_RGB_TIMEOUT_MARGIN, self._on_timeout, command.future)
+            command.written.set_result(None)
+
+
+    async def set(self, r: int, g: int, b: int, a: int, duration: int, callback: Callable[[Tuple[int,int,int,int]], None] = None) -> asyncio.Future:
         """Set the color of the LED, transitioning during the specified duration.
+        The commands are queued: a command still waiting to be written when a new one is set is superseded and merged into the new one,
+        its future ends with the future of the new command. Setting a new color also supersedes the transition in progress, whose future is cancelled.
+        The transition has finished when the commanded color is notified.
         If a callback is provided, it will be called when the color transition has finished.
 
         Args:
@@ -55,8 +123,55 @@ class _RGBLed(KonashiElementBase._KonashiElementBase):
             callback (Callable[[Tuple[int,int,int,int]], None], optional): The callback. Defaults to None.
                 The function takes 1 parameter and returns nothing:
                 Tuple[int,int,int,int]: The current LED color in the form (red,green,blue,alpha).
+
+        Returns:
+            asyncio.Future: A future resolved with the LED color (red,green,blue,alpha) when the transition has finished.
+                It fails with ``asyncio.TimeoutError`` if the end of the transition is not notified in time.
         """
-        b = bytearray([r&0xFF, g&0xFF, b&0xFF, a&0xFF, (duration&0x00FF), ((duration&0xFF00)>>8)])
-        await self._write(KONASHI_UUID_BUILTIN_RGB_SET, b)
+        loop = asyncio.get_event_loop()
+        duration &= 0xFFFF
+        color = (r&0xFF, g&0xFF, b&0xFF, a&0xFF)
+        frame = _RGB_STRUCT.pack(*color, duration)
+        command = _RGBCommand(frame, color, duration, loop.create_future(), loop.create_future())
+        # the callers often drop the future, its timeout is not an unhandled error
+        command.future.add_done_callback(KonashiElementBase._retrieve_exception)
         if callback is not None:
-            self._cb = callback
+            def done_cb(future):
+                if not future.cancelled() and future.exception() is None:
+                    callback(future.result())
+            command.future.add_done_callback(done_cb)
+        if self._pending is not None:
+            _follow(command.future, self._pending.future)
+            self._pending.written.set_result(None)
+        self._pending = command
+        if self._writer is None or self._writer.done():
+            self._writer = loop.create_task(self._write_loop())
+        await command.written
+        return command.future
+
+    def add_observer(self, observer: Callable[[Tuple[int,int,int,int]], None]) -> None:
+        """Add a color change observer, called each time the LED color is notified.
+
+        Args:
+            observer (Callable[[Tuple[int,int,int,int]], None]): The observer function.
+                The function takes 1 parameter and returns nothing:
+                Tuple[int,int,int,int]: The current LED color in the form (red,green,blue,alpha).
+        """
+        self._observers.append(observer)
+
+    def remove_observer(self, observer: Callable[[Tuple[int,int,int,int]], None]) -> None:
+        """Remove a color change observer.
+
+        Args:
+            observer (Callable[[Tuple[int,int,int,int]], None]): The observer function.
+
+        Raises:
+            ValueError: The observer was not added.
+        """
+        self._observers.remove(observer)
+
+    @property
+    def color(self) -> Optional[Tuple[int,int,int,int]]:
+        """The last notified LED color in the form (red,green,blue,alpha), None if not notified yet.
+        """
+        return self._color
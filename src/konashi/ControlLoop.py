@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import *
+
+from .Errors import *
+from .Stats import Histogram
+from .Io import AIO
+from .Io import HardPWM
+
+
+logger = logging.getLogger(__name__)
+
+
+class PIDController:
+    """PID controller with output clamping and integrator anti-windup.
+    """
+    def __init__(self, kp: float, ki: float=0.0, kd: float=0.0, setpoint: float=0.0, output_limits: Tuple[float, float]=(0.0, 100.0)) -> None:
+        """Constructor.
+
+        Args:
+            kp (float): The proportional gain.
+            ki (float, optional): The integral gain (per second). Defaults to 0.0.
+            kd (float, optional): The derivative gain (in seconds). Defaults to 0.0.
+            setpoint (float, optional): The setpoint. Defaults to 0.0.
+            output_limits (Tuple[float, float], optional): The output range. Defaults to (0.0, 100.0).
+
+        Raises:
+            ValueError: The output limits are invalid.
+        """
+        if output_limits[0] >= output_limits[1]:
+            raise ValueError("The output limits should be in the form (low, high) with low < high")
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.setpoint = setpoint
+        self.output_limits = output_limits
+        self.reset()
+
+    def __repr__(self):
+        return f'PIDController(kp={self.kp}, ki={self.ki}, kd={self.kd}, setpoint={self.setpoint})'
+
+
+    def reset(self) -> None:
+        """Reset the integral and derivative states.
+        """
+        self._integral = 0.0
+        self._last_measurement = None
+
+    def update(self, measurement: float, dt: float) -> float:
+        """Compute the controller output.
+
+        Args:
+            measurement (float): The measured process value.
+            dt (float): The time since the previous update in seconds.
+
+        Returns:
+            float: The output, clamped to the output limits.
+        """
+        low, high = self.output_limits
+        error = self.setpoint-measurement
+        derivative = 0.0
+        # derivative on the measurement, so setpoint changes do not kick the output
+        if self._last_measurement is not None and dt > 0:
+            derivative = -(measurement-self._last_measurement)/dt
+        self._last_measurement = measurement
+        integral = self._integral+self.ki*error*dt
+        output = self.kp*error+integral+self.kd*derivative
+        if output > high:
+            output = high
+            integral = min(integral, self._integral)
+        elif output < low:
+            output = low
+            integral = max(integral, self._integral)
+        self._integral = min(max(integral, low), high)
+        return output
+
+
+class ControlLoop:
+    """Fixed-rate control loop from an analog input to a Hardware PWM output.
+    The input is taken from the analog input notifications (the latest sample is used at each period, there is no polling).
+    The controller runs on absolute deadlines of a monotonic clock, and writes its output only when the encoded control value changes.
+    The controller is not updated on periods without a new input sample, the output is held until the next one.
+    The loop latency (from the input notification to the end of the output write), the wake-up jitter and the overrun of missed
+    deadlines are recorded as histograms.
+    """
+    def __init__(self, controller: PIDController, rate: float, analog, input_pin: int, hardpwm, output_pin: int) -> None:
+        """Constructor.
+
+        Args:
+            controller (PIDController): The controller. Any object with an ``update(measurement, dt)`` method returning the duty in % can be used.
+            rate (float): The loop rate in Hz.
+            analog: The analog interface (``io.analog``) providing the input.
+            input_pin (int): The analog input pin number, the measurement is in Volts.
+            hardpwm: The Hardware PWM interface (``io.hardpwm``) driving the output.
+            output_pin (int): The Hardware PWM pin number, the output is the duty in %.
+
+        Raises:
+            ValueError: The rate or a pin number is out of range.
+        """
+        if rate <= 0:
+            raise ValueError("The loop rate should be positive")
+        if input_pin < 0 or input_pin >= AIO.KONASHI_AIO_COUNT:
+            raise ValueError(f"The input pin number should be in the range [0,{AIO.KONASHI_AIO_COUNT-1}]")
+        if output_pin < 0 or output_pin >= HardPWM.KONASHI_HARDPWM_COUNT:
+            raise ValueError(f"The output pin number should be in the range [0,{HardPWM.KONASHI_HARDPWM_COUNT-1}]")
+        self._controller = controller
+        self._period = 1/rate
+        self._analog = analog
+        self._input_pin = input_pin
+        self._hardpwm = hardpwm
+        self._output_pin = output_pin
+        self._measurement = None
+        self._measurement_time = None
+        self._last_value = None
+        self._task = None
+        self._error = None
+        self._latency = Histogram()
+        self._jitter = Histogram()
+        self._overrun = Histogram()
+        self._ticks = 0
+        self._missed = 0
+        self._writes = 0
+        self._suppressed = 0
+        self._stale = 0
+
+    def __str__(self):
+        return f'KonashiControlLoop(ticks={self._ticks}, missed={self._missed}, writes={self._writes}, suppressed={self._suppressed})'
+
+    def __repr__(self):
+        return f'KonashiControlLoop(rate={1/self._period}, input_pin={self._input_pin}, output_pin={self._output_pin})'
+
+
+    def _on_input(self, pins_in, timestamp: float) -> None:
+        pin = pins_in.pin[self._input_pin]
+        if not pin.valid:
+            return
+        voltage = self._analog._calc_voltage_for_value(pin.value)
+        if voltage is None:
+            return
+        self._measurement = voltage
+        self._measurement_time = timestamp
+
+    async def _run(self) -> None:
+        try:
+            await self._loop()
+        except Exception as e:
+            logger.error("Control loop stopped: {}".format(repr(e)))
+            self._error = e
+            if self._on_input in self._analog._input_listeners:
+                self._analog._input_listeners.remove(self._on_input)
+            raise
+
+    async def _loop(self) -> None:
+        origin = time.monotonic()
+        tick = 0
+        last_time = None
+        last_sample = None
+        while True:
+            deadline = origin+tick*self._period
+            delay = deadline-time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            now = time.monotonic()
+            lateness = now-deadline
+            if lateness >= self._period:
+                # skip the periods already over instead of running them back to back
+                skipped = int(lateness/self._period)
+                self._missed += skipped
+                self._overrun.record(lateness)
+                tick += skipped
+                deadline = origin+tick*self._period
+            self._jitter.record(max(now-deadline, 0))
+            tick += 1
+            self._ticks += 1
+            if self._measurement is None:
+                continue
+            if self._measurement_time == last_sample:
+                # hold the output, updating on the same sample would wind up the integral
+                self._stale += 1
+                continue
+            last_sample = self._measurement_time
+            dt = self._period if last_time is None else now-last_time
+            last_time = now
+            duty = min(max(self._controller.update(self._measurement, dt), 0.0), 100.0)
+            value = self._hardpwm.calc_control_value_for_duty(duty)
+            if value == self._last_value:
+                self._suppressed += 1
+                continue
+            try:
+                await self._hardpwm.control_pins([(1<<self._output_pin, HardPWM.HardPWMPinControl(value))])
+            except (KonashiError, KonashiConnectionError) as e:
+                logger.warning("Control loop output write failed: {}".format(e))
+                continue
+            self._last_value = value
+            self._writes += 1
+            self._latency.record(time.monotonic()-last_sample)
+
+
+    def start(self) -> None:
+        """Start the control loop.
+        """
+        if self._task is not None and not self._task.done():
+            return
+        if self._on_input not in self._analog._input_listeners:
+            self._analog._input_listeners.append(self._on_input)
+        self._last_value = None
+        self._error = None
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the control loop. The output is left as is.
+
+        Raises:
+            Exception: The exception that stopped the loop, raised by the controller or by the output write.
+        """
+        if self._task is None:
+            return
+        if self._on_input in self._analog._input_listeners:
+            self._analog._input_listeners.remove(self._on_input)
+        task = self._task
+        self._task = None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    @property
+    def is_running(self) -> bool:
+        """True if the control loop is running.
+        """
+        return self._task is not None and not self._task.done()
+
+    @property
+    def error(self) -> Optional[Exception]:
+        """The exception that stopped the loop, or None.
+        """
+        return self._error
+
+    @property
+    def latency(self) -> Histogram:
+        """The latency from the input notification to the end of the output write, in seconds.
+        """
+        return self._latency
+
+    @property
+    def jitter(self) -> Histogram:
+        """The delay between the deadline and the actual start of each period, in seconds.
+        """
+        return self._jitter
+
+    @property
+    def overrun(self) -> Histogram:
+        """How late the loop was when it missed deadlines, in seconds.
+        """
+        return self._overrun
+
+    @property
+    def ticks(self) -> int:
+        """The number of periods run.
+        """
+        return self._ticks
+
+    @property
+    def missed(self) -> int:
+        """The number of periods skipped because the loop could not keep up.
+        """
+        return self._missed
+
+    @property
+    def writes(self) -> int:
+        """The number of output writes.
+        """
+        return self._writes
+
+    @property
+    def suppressed(self) -> int:
+        """The number of output writes suppressed because the control value did not change.
+        """
+        return self._suppressed
+
+    @property
+    def stale(self) -> int:
+        """The number of periods run without a new input sample since the previous one, the output was held.
+        """
+        return self._stale
@@ -25,3 +25,12 @@ class PinInvalidError(Exception):
 class PinUnavailableError(Exception):
     pass
 
+class ValuesOutOfRangeError(ValueError):
+    def __init__(self, message: str, indices) -> None:
+        super().__init__(message)
+        self.indices = indices
+
+class TransferInterruptedError(KonashiError):
+    def __init__(self, message: str, offset: int) -> None:
+        super().__init__(message)
+        self.offset = offset
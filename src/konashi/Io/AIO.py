@@ -5,13 +5,21 @@ from __future__ import annotations
 import asyncio
 import struct
 import logging
+import math
+import time
+import warnings
 from ctypes import *
 from typing import *
 from enum import *
 
 from bleak import *
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from .. import KonashiElementBase
+from .. import Waveform
 from ..Errors import *
 
 
@@ -34,6 +42,8 @@ class ADCRef(IntEnum):
     REF_1V25 = 0x0+1
     REF_2V5 = 0x1+1
     REF_VDD = 0x2+1
+_ADC_REF_MAX_VOLTAGE = {ADCRef.REF_1V25: 1.25, ADCRef.REF_2V5: 2.5, ADCRef.REF_VDD: 3.3}
+KONASHI_ADC_MAX_VALUE = 65535
 class VDACRef(IntEnum):
     DISABLE = 0
     REF_1V25LN = 0x0+1
@@ -41,12 +51,16 @@ class VDACRef(IntEnum):
     REF_1V25 = 0x2+1
     REF_2V5 = 0x3+1
     REF_VDD = 0x4+1
+_VDAC_REF_MAX_VOLTAGE = {VDACRef.REF_1V25LN: 1.25, VDACRef.REF_2V5LN: 2.5, VDACRef.REF_1V25: 1.25, VDACRef.REF_2V5: 2.5, VDACRef.REF_VDD: 3.3}
+KONASHI_VDAC_MAX_VALUE = 4095
 class IDACRange(IntEnum):
     DISABLE = 0
     RANGE0 = 0x0+1  # 0.05~1.6uA range, 50nA step
     RANGE1 = 0x1+1  # 1.6~4.7uA range, 100nA step
     RANGE2 = 0x2+1  # 0.5~16uA range, 500nA step
     RANGE3 = 0x3+1  # 2~64uA range, 2000nA step
+_IDAC_RANGE_LIMITS = {IDACRange.RANGE0: (0.05, 1.6), IDACRange.RANGE1: (1.6, 4.7), IDACRange.RANGE2: (0.5, 16), IDACRange.RANGE3: (2, 64)}
+KONASHI_IDAC_MAX_VALUE = 31
 class AIOPinDirection(IntEnum):
     INPUT = 0
     OUTPUT = 1
@@ -142,6 +156,382 @@ class _AIOPinsIn(LittleEndianStructure):
         ('', c_uint8, 4),
         ('pin', _AIOPinIn*KONASHI_AIO_COUNT)
     ]
+if np is not None:
+    # the same layout as _AIOPinsIn, the reference is in the low nibble of the first byte
+    _AIO_PINS_IN_DTYPE = np.dtype([
+        ('adc_voltage_reference', np.uint8),
+        ('pin', [('valid', np.uint8), ('value', '<u2')], (KONASHI_AIO_COUNT,))
+    ])
+
+
+class _ThresholdCrossing:
+    """Threshold crossing detection on the analog input values, with hysteresis.
+    The input reaching the threshold while armed is a crossing. The detection is then disarmed until the input is back
+    on the other side of the threshold by more than the hysteresis, so noise around the threshold is not a new crossing.
+    """
+    def __init__(self, threshold: float, above: bool, hysteresis: float, armed: bool) -> None:
+        self.threshold = threshold
+        self.above = above
+        self.hysteresis = hysteresis
+        self.armed = armed
+    def update(self, voltage: float) -> bool:
+        """Feed a new input value, returns True on a crossing."""
+        if self.above:
+            reached = voltage >= self.threshold
+            back = voltage < self.threshold-self.hysteresis
+        else:
+            reached = voltage <= self.threshold
+            back = voltage > self.threshold+self.hysteresis
+        if self.armed and reached:
+            self.armed = False
+            return True
+        if back:
+            self.armed = True
+        return False
+
+
+class _AIOThresholdWaiter(_ThresholdCrossing):
+    def __init__(self, pin: int, threshold: float, above: bool, hysteresis: float, future: asyncio.Future) -> None:
+        # without hysteresis, reaching the threshold ends the wait
+        super().__init__(threshold, above, hysteresis, hysteresis == 0)
+        self.pin = pin
+        self.future = future
+
+
+class AIOAcquisitionStats(NamedTuple):
+    """Windowed statistics of an analog acquisition.
+    Each attribute is an array with one value per analog pin, NaN for pins without a valid sample in the window.
+
+    Attributes:
+        samples (numpy.ndarray): The number of valid samples.
+        mean (numpy.ndarray): The mean value in Volts.
+        rms (numpy.ndarray): The RMS value in Volts.
+        min (numpy.ndarray): The minimum value in Volts.
+        max (numpy.ndarray): The maximum value in Volts.
+    """
+    samples: Any
+    mean: Any
+    rms: Any
+    min: Any
+    max: Any
+class AIOAcquisition:
+    """Analog input acquisition into preallocated ring buffers.
+    Each input notification appends the raw ADC values of all the analog pins, the ADC reference they were taken with and the host timestamp.
+    When the buffers are full, the oldest samples are overwritten. Values are converted to Volts when read out.
+    Use ``start_acquisition`` of the analog interface to create one. Requires NumPy.
+    """
+    def __init__(self, analog, capacity: int) -> None:
+        """Constructor.
+
+        Args:
+            analog: The analog interface to acquire from.
+            capacity (int): The number of samples the buffers can hold.
+
+        Raises:
+            ImportError: NumPy is not installed.
+            ValueError: The capacity is not positive.
+        """
+        if np is None:
+            raise ImportError("NumPy is required for the analog acquisition (pip install konashi[numpy])")
+        if capacity <= 0:
+            raise ValueError("The capacity should be positive")
+        self._analog = analog
+        self._capacity = capacity
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._values = np.zeros((capacity, KONASHI_AIO_COUNT), dtype=np.uint16)
+        self._valid = np.zeros((capacity, KONASHI_AIO_COUNT), dtype=np.bool_)
+        self._refs = np.zeros(capacity, dtype=np.uint8)
+        self._scale = np.full(16, np.nan)
+        for ref, max_ref in _ADC_REF_MAX_VOLTAGE.items():
+            self._scale[ref] = max_ref/KONASHI_ADC_MAX_VALUE
+        self._head = 0
+        self._size = 0
+        self._total = 0
+        self._running = False
+
+    def __str__(self):
+        return f'KonashiAIOAcquisition({self._size}/{self._capacity} samples)'
+
+    def __repr__(self):
+        return f'KonashiAIOAcquisition(capacity={self._capacity})'
+
+
+    def _on_input(self, pins_in, timestamp: float) -> None:
+        i = self._head
+        # the reference the samples were taken with, not the one configured since
+        sample = np.frombuffer(pins_in, dtype=_AIO_PINS_IN_DTYPE)[0]
+        self._times[i] = timestamp
+        self._refs[i] = sample['adc_voltage_reference']&0x0f
+        self._values[i] = sample['pin']['value']
+        self._valid[i] = sample['pin']['valid'] != 0
+        self._head = (i+1)%self._capacity
+        if self._size < self._capacity:
+            self._size += 1
+        self._total += 1
+
+    def _indices(self, count: Optional[int], duration: Optional[float]):
+        n = self._size if count is None else min(count, self._size)
+        idx = np.arange(self._head-n, self._head)%self._capacity
+        if duration is not None and n > 0:
+            idx = idx[self._times[idx] >= self._times[idx[-1]]-duration]
+        return idx
+
+
+    def start(self) -> None:
+        """Start appending the input notifications to the buffers.
+        """
+        if not self._running:
+            self._analog._input_listeners.append(self._on_input)
+            self._running = True
+
+    def stop(self) -> None:
+        """Stop appending the input notifications to the buffers. The recorded samples are kept.
+        """
+        if self._running:
+            self._analog._input_listeners.remove(self._on_input)
+            self._running = False
+
+    def clear(self) -> None:
+        """Discard all the recorded samples.
+        """
+        self._head = 0
+        self._size = 0
+        self._total = 0
+
+    def get_raw(self, count: Optional[int]=None, duration: Optional[float]=None) -> Tuple[Any, Any, Any]:
+        """Get the most recent raw samples, oldest first.
+
+        Args:
+            count (Optional[int], optional): The maximum number of samples, None for all. Defaults to None.
+            duration (Optional[float], optional): Only return samples received within this many seconds of the last one, None for no limit. Defaults to None.
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: timestamps, values, valid.
+                numpy.ndarray: The host timestamps in seconds (``time.monotonic()`` clock), shape (n,).
+                numpy.ndarray: The raw ADC values, shape (n, 3).
+                numpy.ndarray: True where the value is valid, shape (n, 3).
+        """
+        idx = self._indices(count, duration)
+        return (self._times[idx], self._values[idx], self._valid[idx])
+
+    def get_samples(self, count: Optional[int]=None, duration: Optional[float]=None) -> Tuple[Any, Any]:
+        """Get the most recent samples in Volts, oldest first.
+
+        Args:
+            count (Optional[int], optional): The maximum number of samples, None for all. Defaults to None.
+            duration (Optional[float], optional): Only return samples received within this many seconds of the last one, None for no limit. Defaults to None.
+
+        Returns:
+            Tuple[numpy.ndarray, numpy.ndarray]: timestamps, voltages.
+                numpy.ndarray: The host timestamps in seconds (``time.monotonic()`` clock), shape (n,).
+                numpy.ndarray: The input values in Volts, NaN where invalid or where the ADC was disabled, shape (n, 3).
+        """
+        idx = self._indices(count, duration)
+        volts = self._values[idx]*self._scale[self._refs[idx]][:,np.newaxis]
+        volts[~self._valid[idx]] = np.nan
+        return (self._times[idx], volts)
+
+    def get_stats(self, count: Optional[int]=None, duration: Optional[float]=None) -> AIOAcquisitionStats:
+        """Compute the statistics of the most recent samples.
+
+        Args:
+            count (Optional[int], optional): The maximum number of samples, None for all. Defaults to None.
+            duration (Optional[float], optional): Only use samples received within this many seconds of the last one, None for no limit. Defaults to None.
+
+        Returns:
+            AIOAcquisitionStats: The statistics for each analog pin, NaN with a sample count of 0 when the window is empty.
+        """
+        _, volts = self.get_samples(count, duration)
+        if volts.shape[0] == 0:
+            # the nan reductions fail on an empty window
+            nan = np.full(KONASHI_AIO_COUNT, np.nan)
+            return AIOAcquisitionStats(np.zeros(KONASHI_AIO_COUNT, dtype=np.int64), nan, nan.copy(), nan.copy(), nan.copy())
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            return AIOAcquisitionStats(
+                np.count_nonzero(~np.isnan(volts), axis=0),
+                np.nanmean(volts, axis=0),
+                np.sqrt(np.nanmean(volts**2, axis=0)),
+                np.nanmin(volts, axis=0),
+                np.nanmax(volts, axis=0),
+            )
+
+    @property
+    def capacity(self) -> int:
+        """The number of samples the buffers can hold.
+        """
+        return self._capacity
+
+    @property
+    def size(self) -> int:
+        """The number of samples currently held in the buffers.
+        """
+        return self._size
+
+    @property
+    def total(self) -> int:
+        """The number of samples recorded since the acquisition was created or cleared, including overwritten ones.
+        """
+        return self._total
+
+    @property
+    def is_running(self) -> bool:
+        """Indicates if the acquisition is currently recording.
+        """
+        return self._running
+
+
+class AIOAdaptivePeriod:
+    """Adaptive ADC update period controller.
+    The controller watches how much the analog inputs change between input notifications and reconfigures the ADC update period:
+    the period is halved while the inputs are active and doubled while they are quiet, within the configured bounds.
+    The activity is a smoothed maximum of the absolute input change between two samples, over all the valid pins.
+    Two thresholds and a minimum number of samples between changes provide the hysteresis.
+    Use ``start_adaptive_period`` of the analog interface to create one.
+    """
+    def __init__(self, analog, min_period: float=0.1, max_period: float=25.6, max_rate: Optional[float]=None, low_threshold: float=0.005, high_threshold: float=0.02, hold: int=5, smoothing: float=0.3) -> None:
+        """Constructor.
+
+        Args:
+            analog: The analog interface to control.
+            min_period (float, optional): The minimum ADC update period in seconds. Defaults to 0.1.
+            max_period (float, optional): The maximum ADC update period in seconds. Defaults to 25.6.
+            max_rate (Optional[float], optional): The notification budget in input notifications per second, None for no budget.
+                The period never goes below the inverse of this rate, rounded up to the 0.1 second step of the ADC. Defaults to None.
+            low_threshold (float, optional): The activity in Volts below which the period is increased. Defaults to 0.005.
+            high_threshold (float, optional): The activity in Volts above which the period is decreased. Defaults to 0.02.
+            hold (int, optional): The minimum number of samples between two period changes. Defaults to 5.
+            smoothing (float, optional): The smoothing factor of the activity, in the range (0,1]. Defaults to 0.3.
+
+        Raises:
+            ValueError: A parameter is out of range.
+        """
+        if not 0.1 <= min_period <= max_period <= 25.6:
+            raise ValueError("The periods should satisfy 0.1 <= min_period <= max_period <= 25.6 seconds")
+        if max_rate is not None:
+            if max_rate <= 0:
+                raise ValueError("The notification budget should be positive")
+            min_period = max(min_period, 1/max_rate)
+        # the periods are handled in the 0.1 second steps of the ADC, so the budget is never exceeded after rounding
+        min_steps = math.ceil(round(min_period*10, 6))
+        max_steps = math.floor(round(max_period*10, 6))
+        if min_steps > max_steps:
+            raise ValueError("The notification budget does not allow the maximum period")
+        if not 0 <= low_threshold < high_threshold:
+            raise ValueError("The thresholds should satisfy 0 <= low_threshold < high_threshold")
+        if hold < 1:
+            raise ValueError("The hold should be at least 1 sample")
+        if not 0 < smoothing <= 1:
+            raise ValueError("The smoothing factor should be in the range (0,1]")
+        self._analog = analog
+        self._min_steps = min_steps
+        self._max_steps = max_steps
+        self._low_threshold = low_threshold
+        self._high_threshold = high_threshold
+        self._hold = hold
+        self._smoothing = smoothing
+        self._previous = [None]*KONASHI_AIO_COUNT
+        self._last_time = None
+        self._interval = None
+        self._activity = None
+        self._since_change = 0
+        self._period_changes = 0
+        self._change_task = None
+        self._running = False
+
+    def __str__(self):
+        return f'KonashiAIOAdaptivePeriod(period={self.period}s, changes={self._period_changes})'
+
+    def __repr__(self):
+        return f'KonashiAIOAdaptivePeriod(min_period={self._min_steps/10}, max_period={self._max_steps/10})'
+
+
+    def _on_input(self, pins_in, timestamp: float) -> None:
+        if self._last_time is not None:
+            interval = timestamp-self._last_time
+            self._interval = interval if self._interval is None else self._interval+self._smoothing*(interval-self._interval)
+        self._last_time = timestamp
+        activity = None
+        for i in range(KONASHI_AIO_COUNT):
+            if not pins_in.pin[i].valid:
+                self._previous[i] = None
+                continue
+            voltage = self._analog._calc_voltage_for_value(pins_in.pin[i].value)
+            if voltage is None:
+                continue
+            if self._previous[i] is not None:
+                activity = max(activity or 0.0, abs(voltage-self._previous[i]))
+            self._previous[i] = voltage
+        if activity is None:
+            # no change can be measured on the first sample
+            return
+        if self._activity is None:
+            self._activity = activity
+        else:
+            self._activity += self._smoothing*(activity-self._activity)
+        self._since_change += 1
+        if self._since_change < self._hold or (self._change_task is not None and not self._change_task.done()):
+            return
+        steps = self._analog._config.analog.adc_update_period+1
+        if self._activity > self._high_threshold:
+            new_steps = (steps+1)//2
+        elif self._activity < self._low_threshold:
+            new_steps = steps*2
+        else:
+            return
+        new_steps = min(max(new_steps, self._min_steps), self._max_steps)
+        if new_steps != steps:
+            self._since_change = 0
+            self._period_changes += 1
+            self._interval = None
+            self._change_task = asyncio.get_event_loop().create_task(self._change_period(new_steps/10))
+
+    async def _change_period(self, period: float) -> None:
+        try:
+            await self._analog.config_adc_period(period)
+        except (KonashiError, KonashiConnectionError) as e:
+            logger.warning("Could not change the ADC period: {}".format(e))
+
+
+    def start(self) -> None:
+        """Start controlling the ADC update period.
+        """
+        if not self._running:
+            self._analog._input_listeners.append(self._on_input)
+            self._running = True
+
+    def stop(self) -> None:
+        """Stop controlling the ADC update period. The period is left as is.
+        """
+        if self._running:
+            self._analog._input_listeners.remove(self._on_input)
+            self._running = False
+
+    @property
+    def period(self) -> float:
+        """The current ADC update period in seconds, as reported by the configuration.
+        """
+        return (self._analog._config.analog.adc_update_period+1)/10
+
+    @property
+    def sample_rate(self) -> Optional[float]:
+        """The measured input notification rate in Hz, None until measured.
+        """
+        if self._interval is None or self._interval <= 0:
+            return None
+        return 1/self._interval
+
+    @property
+    def activity(self) -> Optional[float]:
+        """The current smoothed input activity in Volts, None until two samples were received.
+        """
+        return self._activity
+
+    @property
+    def period_changes(self) -> int:
+        """The number of period changes requested by the controller.
+        """
+        return self._period_changes
 
 
 class _AIO(KonashiElementBase._KonashiElementBase):
@@ -151,6 +541,9 @@ class _AIO(KonashiElementBase._KonashiElementBase):
         self._output = _AIOPinsOut()
         self._input = _AIOPinsIn()
         self._input_cb = None
+        self._threshold_waiters = []
+        self._input_listeners = []
+        self._update_scales()
 
     def __str__(self):
         return f'KonashiAIO'
@@ -171,12 +564,14 @@ class _AIO(KonashiElementBase._KonashiElementBase):
     def _ntf_cb_config(self, sender, data):
         logger.debug("Received config data: {}".format("".join("{:02x}".format(x) for x in data)))
         self._config = _AIOAllConfig.from_buffer_copy(data)
+        self._update_scales()
 
     def _ntf_cb_output(self, sender, data):
         logger.debug("Received output data: {}".format("".join("{:02x}".format(x) for x in data)))
         self._output = _AIOPinsOut.from_buffer_copy(data)
 
     def _ntf_cb_input(self, sender, data):
+        timestamp = time.monotonic()
         logger.debug("Received input data: {}".format("".join("{:02x}".format(x) for x in data)))
         _new_input = _AIOPinsIn.from_buffer_copy(data)
         for i in range(KONASHI_AIO_COUNT):
@@ -185,21 +580,82 @@ class _AIO(KonashiElementBase._KonashiElementBase):
                     if self._input_cb is not None:
                         self._input_cb(i, self._calc_voltage_for_value(_new_input.pin[i].value))
         self._input = _new_input
+        for listener in self._input_listeners:
+            listener(_new_input, timestamp)
+        if len(self._threshold_waiters) > 0:
+            self._check_threshold_waiters()
+
+    def _check_threshold_waiters(self) -> None:
+        waiters = []
+        for waiter in self._threshold_waiters:
+            if waiter.future.done():
+                continue
+            if self._input.pin[waiter.pin].valid:
+                voltage = self._calc_voltage_for_value(self._input.pin[waiter.pin].value)
+                if voltage is not None and waiter.update(voltage):
+                    waiter.future.set_result(voltage)
+                    continue
+            waiters.append(waiter)
+        self._threshold_waiters = waiters
+
+
+    def _update_scales(self) -> None:
+        # conversion factors for the current configuration, None if disabled or invalid
+        adc_max_ref = _ADC_REF_MAX_VOLTAGE.get(self._config.analog.adc_voltage_reference)
+        self._adc_scale = None if adc_max_ref is None else adc_max_ref/KONASHI_ADC_MAX_VALUE
+        self._vdac_max_ref = _VDAC_REF_MAX_VOLTAGE.get(self._config.analog.vdac_voltage_reference)
+        self._idac_limits = _IDAC_RANGE_LIMITS.get(self._config.analog.idac_current_step)
+
+    def _get_vdac_max_ref(self) -> float:
+        if self._vdac_max_ref is None:
+            if self._config.analog.vdac_voltage_reference == VDACRef.DISABLE:
+                raise KonashiDisabledError("The VDAC is not enabled")
+            raise KonashiInvalidError("The VDAC configuration is not valid")
+        return self._vdac_max_ref
 
+    def _get_idac_limits(self) -> Tuple[float, float]:
+        if self._idac_limits is None:
+            if self._config.analog.idac_current_step == IDACRange.DISABLE:
+                raise KonashiDisabledError("The IDAC is not enabled")
+            raise KonashiInvalidError("The IDAC configuration is not valid")
+        return self._idac_limits
 
     def _calc_voltage_for_value(self, value: int) -> float:
-        max_ref = None
-        if self._config.analog.adc_voltage_reference == ADCRef.DISABLE:
-            return None
-        elif self._config.analog.adc_voltage_reference == ADCRef.REF_1V25:
-            max_ref = 1.25
-        elif self._config.analog.adc_voltage_reference == ADCRef.REF_2V5:
-            max_ref = 2.5
-        elif self._config.analog.adc_voltage_reference == ADCRef.REF_VDD:
-            max_ref = 3.3
-        else:
+        if self._adc_scale is None:
             return None
-        return value*max_ref/65535
+        return value*self._adc_scale
+
+    def start_acquisition(self, capacity: int) -> AIOAcquisition:
+        """Create an analog input acquisition and start recording the input notifications into it.
+        Requires NumPy.
+
+        Args:
+            capacity (int): The number of samples the acquisition buffers can hold.
+
+        Raises:
+            ImportError: NumPy is not installed.
+            ValueError: The capacity is not positive.
+
+        Returns:
+            AIOAcquisition: The running acquisition.
+        """
+        acquisition = AIOAcquisition(self, capacity)
+        acquisition.start()
+        return acquisition
+
+    def start_adaptive_period(self, min_period: float=0.1, max_period: float=25.6, max_rate: Optional[float]=None, low_threshold: float=0.005, high_threshold: float=0.02, hold: int=5, smoothing: float=0.3) -> AIOAdaptivePeriod:
+        """Create an adaptive ADC update period controller and start it.
+        See ``AIOAdaptivePeriod`` for the description of the parameters.
+
+        Raises:
+            ValueError: A parameter is out of range.
+
+        Returns:
+            AIOAdaptivePeriod: The running controller.
+        """
+        controller = AIOAdaptivePeriod(self, min_period, max_period, max_rate, low_threshold, high_threshold, hold, smoothing)
+        controller.start()
+        return controller
 
     async def config_adc_period(self, period: float) -> None:
         """Configure the ADC read period.
@@ -302,6 +758,46 @@ class _AIO(KonashiElementBase._KonashiElementBase):
         """
         self._input_cb = notify_callback
 
+    async def wait_for_threshold(self, pin: int, threshold: float, above: bool=True, hysteresis: float=0.0, timeout: Optional[float]=None) -> float:
+        """Wait until the input of the specified pin reaches a threshold.
+        The condition is evaluated on the input notifications, no read is issued.
+        Returns immediately if the current input value already meets the threshold.
+        With a hysteresis, the input has to be on the other side of the threshold by at least the hysteresis before
+        reaching the threshold counts, so noise around the threshold does not end the wait.
+
+        Args:
+            pin (int): The pin number.
+            threshold (float): The threshold in Volts.
+            above (bool, optional): True to wait for the input to rise to the threshold, False to wait for it to fall to it. Defaults to True.
+            hysteresis (float, optional): The hysteresis in Volts. Defaults to 0.0.
+            timeout (Optional[float], optional): The maximum time to wait in seconds, None to wait indefinitely. Defaults to None.
+
+        Raises:
+            ValueError: The pin number is out of range or the hysteresis is negative.
+            asyncio.TimeoutError: The threshold was not reached within the timeout.
+
+        Returns:
+            float: The input value that met the threshold in Volts.
+        """
+        if pin < 0 or pin >= KONASHI_AIO_COUNT:
+            raise ValueError(f"The pin number should be in the range [0,{KONASHI_AIO_COUNT-1}]")
+        if hysteresis < 0:
+            raise ValueError("The hysteresis cannot be negative")
+        future = asyncio.get_event_loop().create_future()
+        waiter = _AIOThresholdWaiter(pin, threshold, above, hysteresis, future)
+        if self._input.pin[pin].valid:
+            voltage = self._calc_voltage_for_value(self._input.pin[pin].value)
+            if voltage is not None:
+                if (above and voltage >= threshold) or (not above and voltage <= threshold):
+                    return voltage
+                waiter.update(voltage)
+        self._threshold_waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if not future.done():
+                future.cancel()
+
     async def control_pins(self, controls: Sequence(Tuple[int, AIOPinControl])) -> None:
         """Control analog pins.
 
@@ -311,12 +807,16 @@ class _AIO(KonashiElementBase._KonashiElementBase):
                 int: A bitmask of the pins to apply the control to.
                 AIOPinControl: The control for the specified pins.
         """
+        b = self._encode_control(controls)
+        await self._write(KONASHI_UUID_CONTROL_CMD, b)
+
+    def _encode_control(self, controls: Sequence(Tuple[int, AIOPinControl])) -> bytearray:
         b = bytearray([KONASHI_CTL_CMD_ANALOG])
         for control in controls:
             for i in range(KONASHI_AIO_COUNT):
                 if (control[0]&(1<<i)) > 0:
                     b.extend(bytearray([i])+bytearray(control[1]))
-        await self._write(KONASHI_UUID_CONTROL_CMD, b)
+        return b
 
     def calc_control_value_for_voltage(self, voltage: float) -> int:
         """Calculate the control value for the wanted voltage.
@@ -332,20 +832,10 @@ class _AIO(KonashiElementBase._KonashiElementBase):
         Returns:
             int: The corresponding control value.
         """
-        max_ref = None
-        if self._config.analog.vdac_voltage_reference == VDACRef.DISABLE:
-            raise KonashiDisabledError("The VDAC is not enabled")
-        elif self._config.analog.vdac_voltage_reference == VDACRef.REF_1V25LN or self._config.analog.vdac_voltage_reference == VDACRef.REF_1V25:
-            max_ref = 1.25
-        elif self._config.analog.vdac_voltage_reference == VDACRef.REF_2V5LN or self._config.analog.vdac_voltage_reference == VDACRef.REF_2V5:
-            max_ref = 2.5
-        elif self._config.analog.vdac_voltage_reference == VDACRef.REF_VDD:
-            max_ref = 3.3
-        else:
-            raise KonashiInvalidError("The VDAC configuration is not valid")
+        max_ref = self._get_vdac_max_ref()
         if voltage > max_ref:
             raise ValueError(f"The target voltage needs to be in the range [0,{max_ref}]")
-        return round(voltage*4095/max_ref)
+        return round(voltage*KONASHI_VDAC_MAX_VALUE/max_ref)
 
     def calc_control_value_for_current(self, current: float) -> int:
         """Calculate the control value for the wanted current.
@@ -361,27 +851,140 @@ class _AIO(KonashiElementBase._KonashiElementBase):
         Returns:
             int: The corresponding control value.
         """
-        first = None
-        last = None
-        if self._config.analog.idac_current_step == IDACRange.DISABLE:
-            raise KonashiDisabledError("The IDAC is not enabled")
-        elif self._config.analog.idac_current_step == IDACRange.RANGE0:
-            first = 0.05
-            last = 1.6
-        elif self._config.analog.idac_current_step == IDACRange.RANGE1:
-            first = 1.6
-            last = 4.7
-        elif self._config.analog.idac_current_step == IDACRange.RANGE2:
-            first = 0.5
-            last = 16
-        elif self._config.analog.idac_current_step == IDACRange.RANGE3:
-            first = 2
-            last = 64
-        else:
-            raise KonashiInvalidError("The IDAC configuration is not valid")
+        first, last = self._get_idac_limits()
         if not first <= current <= last:
             raise ValueError(f"The target current needs to be in the range [{first},{last}]")
-        return round((current-first)*31/(last-first))
+        return round((current-first)*KONASHI_IDAC_MAX_VALUE/(last-first))
+
+    def calc_control_values_for_voltages(self, voltages: Sequence[float]) -> Any:
+        """Calculate the control values for an array of wanted voltages.
+        Requires NumPy.
+
+        Args:
+            voltages (Sequence[float]): The wanted voltages in Volts (a NumPy array or any sequence).
+
+        Raises:
+            ImportError: NumPy is not installed.
+            KonashiDisabledError: The VDAC is disabled.
+            KonashiInvalidError: The VDAC configuration is invalid.
+            ValuesOutOfRangeError: At least one voltage is out of range for the configuration, the ``indices`` attribute holds their indices.
+
+        Returns:
+            numpy.ndarray: The corresponding control values.
+        """
+        self._require_numpy()
+        max_ref = self._get_vdac_max_ref()
+        voltages = np.asarray(voltages, dtype=np.float64)
+        self._check_array_range(voltages, 0, max_ref, f"The target voltage needs to be in the range [0,{max_ref}]")
+        return np.rint(voltages*(KONASHI_VDAC_MAX_VALUE/max_ref)).astype(np.uint16)
+
+    def calc_control_values_for_currents(self, currents: Sequence[float]) -> Any:
+        """Calculate the control values for an array of wanted currents.
+        Requires NumPy.
+
+        Args:
+            currents (Sequence[float]): The wanted currents in Amperes (a NumPy array or any sequence).
+
+        Raises:
+            ImportError: NumPy is not installed.
+            KonashiDisabledError: The IDAC is disabled.
+            KonashiInvalidError: The IDAC configuration is invalid.
+            ValuesOutOfRangeError: At least one current is out of range for the configuration, the ``indices`` attribute holds their indices.
+
+        Returns:
+            numpy.ndarray: The corresponding control values.
+        """
+        self._require_numpy()
+        first, last = self._get_idac_limits()
+        currents = np.asarray(currents, dtype=np.float64)
+        self._check_array_range(currents, first, last, f"The target current needs to be in the range [{first},{last}]")
+        return np.rint((currents-first)*(KONASHI_IDAC_MAX_VALUE/(last-first))).astype(np.uint16)
+
+    def calc_voltages_for_values(self, values: Sequence[int]) -> Any:
+        """Convert an array of raw ADC values to Volts, using the current ADC reference.
+        Requires NumPy.
+
+        Args:
+            values (Sequence[int]): The raw ADC values (a NumPy array or any sequence).
+
+        Raises:
+            ImportError: NumPy is not installed.
+            KonashiDisabledError: The ADC is disabled or its configuration is invalid.
+
+        Returns:
+            numpy.ndarray: The corresponding voltages in Volts.
+        """
+        self._require_numpy()
+        if self._adc_scale is None:
+            raise KonashiDisabledError("The ADC is not enabled")
+        return np.asarray(values, dtype=np.float64)*self._adc_scale
+
+    def _compile_waveform(self, samples: Sequence[float], interval: float, tolerance: float, first: float, last: float, max_value: int, unit: str) -> List[Waveform.WaveformSegment]:
+        scale = max_value/(last-first)
+        values = []
+        for i, sample in enumerate(samples):
+            if not first <= sample <= last:
+                raise ValueError(f"Sample {i} is out of range, the target needs to be in the range [{first},{last}] ({unit})")
+            values.append((sample-first)*scale)
+        return Waveform.fit_ramps(values, interval, tolerance*scale, 0, max_value)
+
+    def compile_voltage_waveform(self, voltages: Sequence[float], interval: float, tolerance: float) -> List[Waveform.WaveformSegment]:
+        """Compile a sampled VDAC waveform into linear ramps played with the output transitions.
+        The waveform is fitted with as few ramps as possible while staying within the tolerance of all the samples.
+        The result depends on the current VDAC reference, compile the waveform again if it changes.
+
+        Args:
+            voltages (Sequence[float]): The waveform samples in Volts.
+            interval (float): The interval between two samples in seconds.
+            tolerance (float): The maximum deviation from the samples in Volts. It cannot be lower than half a control value step.
+
+        Raises:
+            KonashiDisabledError: The VDAC is disabled.
+            KonashiInvalidError: The VDAC configuration is invalid.
+            ValueError: A sample, the interval or the tolerance is out of range.
+
+        Returns:
+            List[WaveformSegment]: The ramp segments, to pass to ``play_waveform``.
+        """
+        max_ref = self._get_vdac_max_ref()
+        return self._compile_waveform(voltages, interval, tolerance, 0, max_ref, KONASHI_VDAC_MAX_VALUE, "V")
+
+    def compile_current_waveform(self, currents: Sequence[float], interval: float, tolerance: float) -> List[Waveform.WaveformSegment]:
+        """Compile a sampled IDAC waveform into linear ramps played with the output transitions.
+        The waveform is fitted with as few ramps as possible while staying within the tolerance of all the samples.
+        The result depends on the current IDAC range, compile the waveform again if it changes.
+
+        Args:
+            currents (Sequence[float]): The waveform samples in Amperes.
+            interval (float): The interval between two samples in seconds.
+            tolerance (float): The maximum deviation from the samples in Amperes. It cannot be lower than half a control value step.
+
+        Raises:
+            KonashiDisabledError: The IDAC is disabled.
+            KonashiInvalidError: The IDAC configuration is invalid.
+            ValueError: A sample, the interval or the tolerance is out of range.
+
+        Returns:
+            List[WaveformSegment]: The ramp segments, to pass to ``play_waveform``.
+        """
+        first, last = self._get_idac_limits()
+        return self._compile_waveform(currents, interval, tolerance, first, last, KONASHI_IDAC_MAX_VALUE, "A")
+
+    async def play_waveform(self, pin_bitmask: int, segments: Sequence[Waveform.WaveformSegment]) -> Waveform.PlayStats:
+        """Play compiled ramp segments on analog output pins.
+        Each segment is sent as one control command when the previous ramp is due to end.
+        When a command is late, its ramp is shortened to keep the following deadlines.
+
+        Args:
+            pin_bitmask (int): A bitmask of the pins to play the waveform on.
+            segments (Sequence[WaveformSegment]): The segments returned by ``compile_voltage_waveform`` or ``compile_current_waveform``.
+
+        Returns:
+            PlayStats: The number of commands sent, the number of late commands and the maximum lateness in seconds.
+        """
+        async def write(segment):
+            await self.control_pins([(pin_bitmask, AIOPinControl(segment.value, segment.duration))])
+        return await Waveform.play_segments(segments, write)
 
     async def get_pins_control(self, pin_bitmask: int) -> List[AIOPinControl]:
         """Get the output control of the specified pins.
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+from typing import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .. import KonashiElementBase
+from ..Errors import *
+from . import GPIO
+from . import I2C
+
+
+class FramebufferStats(NamedTuple):
+    """The statistics of a framebuffer flush.
+    """
+    regions: int
+    data_bytes: int
+    frame_bytes: int
+
+
+def ssd1306_window(page_start: int, page_end: int, col_start: int, col_end: int) -> bytes:
+    """The SSD1306/SH1106-style horizontal addressing window command (column address 0x21, page address 0x22).
+
+    Args:
+        page_start (int): The first page.
+        page_end (int): The last page (inclusive).
+        col_start (int): The first column.
+        col_end (int): The last column (inclusive).
+
+    Returns:
+        bytes: The command bytes.
+    """
+    return bytes([0x21, col_start, col_end, 0x22, page_start, page_end])
+
+
+class I2CDisplayTransport:
+    """Display link over I2C, with the control byte prefix of SSD1306-style controllers (0x00 for commands, 0x40 for data).
+    """
+    def __init__(self, i2c, address: int, window: int=4) -> None:
+        """Constructor.
+
+        Args:
+            i2c: The I2C interface (``io.i2c``).
+            address (int): The display I2C slave address.
+            window (int, optional): The maximum number of data transactions in flight. Defaults to 4.
+        """
+        if address > 0x7F:
+            raise ValueError("The I2C address should be in the range [0x01,0x7F]")
+        self._i2c = i2c
+        self._address = address
+        self._window = window
+
+    def _frames(self, prefix: int, data) -> Iterator[Tuple[None, int, bytes]]:
+        chunk_len = I2C.KONASHI_I2C_MAX_WRITE_LEN-1
+        for offset in range(0, len(data), chunk_len):
+            yield (None, self._address, bytes([I2C.KONASHI_CTL_CMD_I2C_DATA, I2C.I2COperation.WRITE, 0, self._address, prefix]) + data[offset:offset+chunk_len])
+
+    def _check(self, tag, res: bytes) -> None:
+        if res[0] != I2C.I2CResult.DONE:
+            raise KonashiError(f"Display write failed: {I2C._result_name(res[0])}")
+
+    def reset(self) -> None:
+        """Forget the link state. The I2C link has none, the control byte is sent with each transaction.
+        """
+        pass
+
+    async def command(self, data: bytes) -> None:
+        await self._i2c._pipeline(self._frames(0x00, data), 1, self._check)
+
+    async def data(self, data) -> None:
+        await self._i2c._pipeline(self._frames(0x40, data), self._window, self._check)
+
+
+class SPIDisplayTransport:
+    """Display link over SPI, with a GPIO pin as data/command select (low for commands, high for data).
+    """
+    def __init__(self, spi, gpio, dc_pin: int, window: int=4) -> None:
+        """Constructor.
+
+        Args:
+            spi: The SPI interface (``io.spi``).
+            gpio: The GPIO interface (``io.gpio``).
+            dc_pin (int): The GPIO pin number of the data/command select, configured as output.
+            window (int, optional): The maximum number of data transactions in flight. Defaults to 4.
+        """
+        if dc_pin < 0 or dc_pin >= GPIO.KONASHI_GPIO_COUNT:
+            raise ValueError(f"The pin number should be in the range [0,{GPIO.KONASHI_GPIO_COUNT-1}]")
+        self._spi = spi
+        self._gpio = gpio
+        self._dc_pin = dc_pin
+        self._window = window
+        self._dc = None
+
+    async def _select(self, level: GPIO.GPIOPinControl) -> None:
+        # the pin is only written when the mode changes, its level is unknown until a write succeeds
+        if self._dc != level:
+            self._dc = None
+            await self._gpio.control_pins([(1<<self._dc_pin, level)])
+            self._dc = level
+
+    def reset(self) -> None:
+        """Forget the data/command select level, so it is written again on the next transfer (after a reconnection for instance).
+        """
+        self._dc = None
+
+    async def command(self, data: bytes) -> None:
+        await self._select(GPIO.GPIOPinControl.LOW)
+        await self._spi.transfer(data, window=1)
+
+    async def data(self, data) -> None:
+        await self._select(GPIO.GPIOPinControl.HIGH)
+        await self._spi.transfer(data, window=self._window)
+
+
+class Framebuffer:
+    """Page-addressed monochrome display framebuffer (SSD1306 layout: one byte holds 8 vertical pixels of a page).
+    Draw into ``buffer``, then ``flush`` sends only the regions changed since the last flush, as address window commands plus data.
+    Requires NumPy.
+    """
+    def __init__(self, transport, width: int=128, pages: int=8, merge_gap: Optional[int]=None, window_command: Callable[[int, int, int, int], bytes]=ssd1306_window) -> None:
+        """Constructor.
+
+        Args:
+            transport (I2CDisplayTransport | SPIDisplayTransport): The display link.
+            width (int, optional): The display width in columns. Defaults to 128.
+            pages (int, optional): The display height in pages of 8 rows. Defaults to 8.
+            merge_gap (Optional[int], optional): Changed column ranges of a page separated by at most this many unchanged columns are sent as one region.
+                None to use the length of the window command, so the unchanged columns are resent when they are no more bytes than a new window command. Defaults to None.
+            window_command (Callable[[int, int, int, int], bytes], optional): The function building the address window command
+                from (first page, last page, first column, last column). Defaults to ``ssd1306_window``.
+
+        Raises:
+            ImportError: NumPy is not installed.
+        """
+        KonashiElementBase._require_numpy()
+        self._transport = transport
+        self._width = width
+        self._pages = pages
+        self._merge_gap = len(window_command(0, pages-1, 0, width-1)) if merge_gap is None else merge_gap
+        self._window_command = window_command
+        self.buffer = np.zeros((pages, width), dtype=np.uint8)
+        self._sent = None
+
+    def __str__(self):
+        return f'KonashiFramebuffer({self._width}x{self._pages*8})'
+
+    def __repr__(self):
+        return f'KonashiFramebuffer(width={self._width}, pages={self._pages})'
+
+
+    def _page_runs(self, dirty) -> List[List[Tuple[int, int]]]:
+        # changed column runs of each page, with the runs closer than the merge gap joined
+        runs = [[] for page in range(self._pages)]
+        pages, cols = np.nonzero(dirty)
+        if cols.size == 0:
+            return runs
+        # a run starts on a new page or after a gap wider than the merge gap
+        new = np.empty(cols.size, dtype=bool)
+        new[0] = True
+        new[1:] = (pages[1:] != pages[:-1]) | (np.diff(cols) > self._merge_gap+1)
+        starts = np.flatnonzero(new)
+        ends = np.append(starts[1:]-1, cols.size-1)
+        for page, start, end in zip(pages[starts].tolist(), cols[starts].tolist(), cols[ends].tolist()):
+            runs[page].append((start, end))
+        return runs
+
+    def dirty_regions(self) -> List[Tuple[int, int, int, int]]:
+        """Compute the regions changed since the last flush.
+        The same column range changed on consecutive pages is merged into one region.
+
+        Returns:
+            List[Tuple[int, int, int, int]]: The regions as (first page, last page, first column, last column).
+        """
+        if self._sent is None:
+            return [(0, self._pages-1, 0, self._width-1)]
+        regions = []
+        open_regions = {}
+        for page, runs in enumerate(self._page_runs(self.buffer != self._sent)):
+            current = {}
+            for run in runs:
+                region = open_regions.get(run)
+                if region is not None:
+                    region[1] = page
+                else:
+                    region = [page, page, run[0], run[1]]
+                    regions.append(region)
+                current[run] = region
+            open_regions = current
+        return [tuple(r) for r in regions]
+
+    async def flush(self, force: bool=False) -> FramebufferStats:
+        """Send the changed regions of the buffer to the display.
+
+        Args:
+            force (bool, optional): True to send the whole buffer. Defaults to False.
+
+        Raises:
+            KonashiError: A write failed, the whole buffer is sent on the next flush.
+
+        Returns:
+            FramebufferStats: The number of regions, the number of data bytes sent, and the size of a full frame for comparison.
+        """
+        if force:
+            self._sent = None
+        regions = self.dirty_regions()
+        frame = self.buffer.copy()
+        data_bytes = 0
+        try:
+            for page_start, page_end, col_start, col_end in regions:
+                await self._transport.command(self._window_command(page_start, page_end, col_start, col_end))
+                data = frame[page_start:page_end+1, col_start:col_end+1].tobytes()
+                await self._transport.data(data)
+                data_bytes += len(data)
+        except:
+            self._sent = None
+            raise
+        self._sent = frame
+        return FramebufferStats(len(regions), data_bytes, frame.size)
+
+    def invalidate(self) -> None:
+        """Forget the last sent frame and the display link state, so the next flush sends the whole buffer (after a display reset or a reconnection for instance).
+        """
+        self._sent = None
+        self._transport.reset()
@@ -5,6 +5,7 @@ from __future__ import annotations
 import asyncio
 import struct
 import logging
+import time
 from ctypes import *
 from typing import *
 from enum import *
@@ -133,6 +134,274 @@ class _PinIO(LittleEndianStructure):
     ]
 _PinsIO = _PinIO*KONASHI_GPIO_COUNT
 
+_PIN_SETTLE_TIMEOUT = 2.0
+
+def _function_str(function: int) -> str:
+    if 0 <= function < len(_KONASHI_GPIO_FUNCTION_STR):
+        return _KONASHI_GPIO_FUNCTION_STR[function]
+    return "UNKNOWN"
+class _PinRegistry:
+    """Pin function ownership of a Konashi device.
+
+    Ownership is kept as one bitmask per pin function, updated from the GPIO configuration notifications,
+    so subsystems can validate a whole pin bitmask with a single AND.
+    Pins that are being configured are reserved until a configuration notification shows the new functions,
+    so no other subsystem can claim them between the configuration write and the notification.
+    """
+    def __init__(self) -> None:
+        self._functions = [GPIOPinFunction.DISABLED]*KONASHI_GPIO_COUNT
+        self._owned = [0]*len(GPIOPinFunction)
+        self._busy = 0  # pins configured with a function other than DISABLED
+        self._reservations = []
+        self._settling = []  # written reservations waiting for the configuration notification
+        self._reserved = [0]*len(GPIOPinFunction)
+        self._reserved_all = 0
+
+    def _update(self, config: _PinsConfig) -> None:
+        owned = [0]*len(GPIOPinFunction)
+        busy = 0
+        for i in range(KONASHI_GPIO_COUNT):
+            function = config[i].function
+            self._functions[i] = function
+            if function < len(owned):
+                owned[function] |= 1<<i
+            if function != GPIOPinFunction.DISABLED:
+                busy |= 1<<i
+        self._owned = owned
+        self._busy = busy
+        for settling in list(self._settling):
+            if self._settled(*settling[:3]):
+                self._release_settling(settling)
+
+    def _settled(self, pin_bitmask: int, function: GPIOPinFunction, expected: int) -> bool:
+        # the expected pins own the function and the other pins are disabled
+        return (self._owned[function]&expected) == expected and (self._busy&pin_bitmask&~expected) == 0
+
+    def _release_settling(self, settling: list) -> None:
+        pin_bitmask, function, expected, timer = settling
+        self._settling.remove(settling)
+        if timer is not None:
+            timer.cancel()
+        self.release(pin_bitmask, function)
+
+    def clear_settling(self) -> None:
+        # the configuration is read again on connection, the pending writes are settled by now or lost
+        for settling in list(self._settling):
+            self._release_settling(settling)
+
+    def owned(self, function: GPIOPinFunction) -> int:
+        return self._owned[function]
+
+    def check_available(self, pin_bitmask: int, function: GPIOPinFunction) -> None:
+        """Check that the pins are either disabled or already used for the given function.
+
+        Raises:
+            PinUnavailableError: At least one of the pins is configured or being configured with another function.
+        """
+        allowed = self._owned[function]|self._reserved[function]
+        blocked = pin_bitmask & (self._busy|self._reserved_all) & ~allowed
+        if blocked:
+            i = (blocked&-blocked).bit_length()-1
+            if self._busy & (1<<i):
+                raise PinUnavailableError(f'Pin {i} is already configured as {_function_str(self._functions[i])}')
+            for f in GPIOPinFunction:
+                if self._reserved[f] & (1<<i):
+                    raise PinUnavailableError(f'Pin {i} is already being configured as {_function_str(f)}')
+
+    def check_function(self, pin_bitmask: int, function: GPIOPinFunction) -> None:
+        """Check that the pins are configured with the given function.
+
+        Raises:
+            PinUnavailableError: At least one of the pins is not configured with the function.
+        """
+        missing = pin_bitmask & ~self._owned[function]
+        if missing:
+            i = (missing&-missing).bit_length()-1
+            raise PinUnavailableError(f'Pin {i} is not configured as {_function_str(function)} (configured as {_function_str(self._functions[i])})')
+
+    def reserve(self, pin_bitmask: int, function: GPIOPinFunction) -> None:
+        """Check the pins are available for the given function and reserve them.
+        The check and the reservation happen without yielding to the event loop, so they are atomic with respect to other subsystems.
+
+        Raises:
+            PinUnavailableError: At least one of the pins is configured or being configured with another function.
+        """
+        self.check_available(pin_bitmask, function)
+        self._reservations.append((pin_bitmask, function))
+        self._reserved[function] |= pin_bitmask
+        self._reserved_all |= pin_bitmask
+
+    def release(self, pin_bitmask: int, function: GPIOPinFunction) -> None:
+        self._reservations.remove((pin_bitmask, function))
+        self._reserved = [0]*len(GPIOPinFunction)
+        self._reserved_all = 0
+        for mask, f in self._reservations:
+            self._reserved[f] |= mask
+            self._reserved_all |= mask
+
+    def settle(self, pin_bitmask: int, function: GPIOPinFunction, expected: int) -> None:
+        """Keep a reservation whose configuration write completed until the configuration notification shows it applied.
+        If no matching notification comes within ``_PIN_SETTLE_TIMEOUT``, the reservation is released anyway.
+
+        Args:
+            pin_bitmask (int): The reserved pins.
+            function (GPIOPinFunction): The reserved function.
+            expected (int): The pins expected to end up with the function, the other reserved pins are expected to end up disabled.
+        """
+        if self._settled(pin_bitmask, function, expected):
+            self.release(pin_bitmask, function)
+            return
+        settling = [pin_bitmask, function, expected, None]
+        settling[3] = asyncio.get_event_loop().call_later(_PIN_SETTLE_TIMEOUT, self._settle_timeout, settling)
+        self._settling.append(settling)
+
+    def _settle_timeout(self, settling: list) -> None:
+        if settling in self._settling:
+            logger.warning("No configuration notification confirmed the function of pins 0x{:02x}".format(settling[0]))
+            settling[3] = None
+            self._release_settling(settling)
+
+    async def configure(self, pin_bitmask: int, function: GPIOPinFunction, expected: int, write: Callable[[], Awaitable[None]]) -> None:
+        """Reserve the pins, write their configuration and keep them reserved until the configuration notification.
+
+        Raises:
+            PinUnavailableError: At least one of the pins is configured or being configured with another function.
+        """
+        self.reserve(pin_bitmask, function)
+        try:
+            await write()
+        except:
+            self.release(pin_bitmask, function)
+            raise
+        self.settle(pin_bitmask, function, expected)
+
+class GPIOInputFilterStats(NamedTuple):
+    """GPIO input filter counters of a single pin.
+
+    Attributes:
+        accepted (int): The number of edges reported to the input callback.
+        bounces (int): The number of edges suppressed by the debounce window.
+        glitches (int): The number of pulses suppressed for being shorter than the minimum pulse width.
+    """
+    accepted: int
+    bounces: int
+    glitches: int
+class _GPIOInputFilter:
+    def __init__(self, debounce: float, min_pulse: float, level: Optional[int]) -> None:
+        self.debounce = debounce
+        self.min_pulse = min_pulse
+        self.level = level  # last reported level, None until a valid input notification
+        self.raw_level = level
+        self.raw_time = None
+        self.last_accepted = None
+        self.pending = None  # waiting for the minimum pulse width to elapse
+        self.reconcile = None  # waiting for the debounce window to close
+        self.accepted = 0
+        self.bounces = 0
+        self.glitches = 0
+    def cancel(self) -> None:
+        if self.pending is not None:
+            self.pending.cancel()
+            self.pending = None
+        if self.reconcile is not None:
+            self.reconcile.cancel()
+            self.reconcile = None
+
+class GPIOPulseStats(NamedTuple):
+    """GPIO pulse measurement statistics of a single pin, over the edges kept in the measurement window.
+    Values that cannot be computed yet (not enough edges) are None.
+
+    Attributes:
+        edges (int): The number of edges in the window.
+        period (float): The mean period in seconds.
+        frequency (float): The frequency in Hz.
+        duty (float): The duty cycle in %.
+        high_width (float): The mean high pulse width in seconds.
+        low_width (float): The mean low pulse width in seconds.
+        period_stddev (float): The standard deviation of the period in seconds, with the timestamp jitter removed.
+        period_error (float): The approximate standard error of the mean period caused by the timestamp jitter, in seconds.
+    """
+    edges: int
+    period: Optional[float]
+    frequency: Optional[float]
+    duty: Optional[float]
+    high_width: Optional[float]
+    low_width: Optional[float]
+    period_stddev: Optional[float]
+    period_error: Optional[float]
+class _GPIOPulseMeter:
+    def __init__(self, window: int, jitter: float) -> None:
+        self.window = window
+        self.jitter = jitter
+        self.reset()
+    def reset(self) -> None:
+        window = self.window
+        # ring of the most recent edges: timestamp, level after the edge, and the period ending at the edge
+        self.times = [0.0]*window
+        self.levels = [0]*window
+        self.periods = [None]*window
+        self.head = 0
+        self.count = 0
+        self.last_time = [None, None]  # last edge timestamp per level
+        # running sums over the intervals and periods inside the ring
+        self.width_sum = [0.0, 0.0]
+        self.width_count = [0, 0]
+        self.period_sum = 0.0
+        self.period_sqsum = 0.0
+        self.period_count = 0
+    def add(self, level: int, timestamp: float) -> None:
+        if self.count > 0:
+            prev = (self.head-1)%self.window
+            if self.levels[prev] == level:
+                # an edge was lost, restart from this one
+                self.reset()
+            else:
+                self.width_sum[self.levels[prev]] += timestamp-self.times[prev]
+                self.width_count[self.levels[prev]] += 1
+        if self.count == self.window:
+            # evict the oldest edge, and the interval that follows it
+            oldest = self.head
+            following = (oldest+1)%self.window
+            self.width_sum[self.levels[oldest]] -= self.times[following]-self.times[oldest]
+            self.width_count[self.levels[oldest]] -= 1
+            if self.periods[oldest] is not None:
+                self.period_sum -= self.periods[oldest]
+                self.period_sqsum -= self.periods[oldest]**2
+                self.period_count -= 1
+        else:
+            self.count += 1
+        period = None
+        if self.last_time[level] is not None:
+            period = timestamp-self.last_time[level]
+            self.period_sum += period
+            self.period_sqsum += period**2
+            self.period_count += 1
+        self.last_time[level] = timestamp
+        self.times[self.head] = timestamp
+        self.levels[self.head] = level
+        self.periods[self.head] = period
+        self.head = (self.head+1)%self.window
+    def stats(self) -> GPIOPulseStats:
+        high_width = self.width_sum[1]/self.width_count[1] if self.width_count[1] > 0 else None
+        low_width = self.width_sum[0]/self.width_count[0] if self.width_count[0] > 0 else None
+        period = None
+        frequency = None
+        duty = None
+        period_stddev = None
+        period_error = None
+        if self.period_count > 0:
+            period = self.period_sum/self.period_count
+            variance = self.period_sqsum/self.period_count-period**2
+            # each period is the difference of two jittered timestamps
+            period_stddev = max(variance-2*self.jitter**2, 0.0)**0.5
+            # consecutive periods share their timestamps, so the jitter of the mean only comes from the ends of each series
+            period_error = 2*self.jitter/self.period_count
+            if period > 0:
+                frequency = 1/period
+        if high_width is not None and low_width is not None and high_width+low_width > 0:
+            duty = high_width*100/(high_width+low_width)
+        return GPIOPulseStats(self.count, period, frequency, duty, high_width, low_width, period_stddev, period_error)
+
 
 class _GPIO(KonashiElementBase._KonashiElementBase):
     def __init__(self, konashi) -> None:
@@ -141,6 +410,12 @@ class _GPIO(KonashiElementBase._KonashiElementBase):
         self._output = _PinsIO()
         self._input = _PinsIO()
         self._input_cb = None
+        self._input_filter = [None]*KONASHI_GPIO_COUNT
+        self._async_loop = None
+        self._pins = _PinRegistry()
+        self._input_waiters = []
+        self._pulse_meters = [None]*KONASHI_GPIO_COUNT
+        self._input_listeners = []
 
     def __str__(self):
         return f'KonashiGPIO'
@@ -150,6 +425,13 @@ class _GPIO(KonashiElementBase._KonashiElementBase):
 
 
     async def _on_connect(self) -> None:
+        self._async_loop = asyncio.get_event_loop()
+        self._pins.clear_settling()
+        for f in self._input_filter:
+            if f is not None:
+                # the pin level is unknown until the first input notification of the new connection
+                f.cancel()
+                f.level = None
         await self._enable_notify(KONASHI_UUID_GPIO_CONFIG_GET, self._ntf_cb_config)
         await self._read(KONASHI_UUID_GPIO_CONFIG_GET)
         await self._enable_notify(KONASHI_UUID_GPIO_OUTPUT_GET, self._ntf_cb_output)
@@ -161,20 +443,115 @@ class _GPIO(KonashiElementBase._KonashiElementBase):
     def _ntf_cb_config(self, sender, data):
         logger.debug("Received config data: {}".format("".join("{:02x}".format(x) for x in data)))
         self._config = _PinsConfig.from_buffer_copy(data)
+        self._pins._update(self._config)
 
     def _ntf_cb_output(self, sender, data):
         logger.debug("Received output data: {}".format("".join("{:02x}".format(x) for x in data)))
         self._output = _PinsIO.from_buffer_copy(data)
 
     def _ntf_cb_input(self, sender, data):
+        timestamp = time.monotonic()
         logger.debug("Received input data: {}".format("".join("{:02x}".format(x) for x in data)))
         for i in range(KONASHI_GPIO_COUNT):
             if data[i]&0x10:
                 val = data[i]&0x01
-                if self._input[i].level != val:
-                    if self._input_cb is not None:
-                        self._input_cb(i, val)
+                f = self._input_filter[i]
+                if f is not None and f.level is None:
+                    # the first valid level seeds the filter, it is not an edge
+                    f.level = val
+                    f.raw_level = val
+                elif self._input[i].level != val:
+                    if self._input_filter[i] is None:
+                        self._dispatch_input(i, val, timestamp)
+                    else:
+                        self._filter_input_edge(i, val, timestamp)
         self._input = _PinsIO.from_buffer_copy(data)
+        if len(self._input_waiters) > 0:
+            self._check_input_waiters()
+
+    def _dispatch_input(self, pin: int, level: int, timestamp: float) -> None:
+        if self._pulse_meters[pin] is not None:
+            self._pulse_meters[pin].add(level, timestamp)
+        if self._input_cb is not None:
+            self._input_cb(pin, level)
+        for listener in self._input_listeners:
+            listener(pin, level, timestamp)
+
+    def _filter_input_edge(self, pin: int, level: int, timestamp: float) -> None:
+        f = self._input_filter[pin]
+        f.raw_level = level
+        f.raw_time = timestamp
+        if f.min_pulse > 0:
+            if f.pending is not None:
+                # the previous level did not last for the minimum pulse width
+                f.pending.cancel()
+                f.pending = None
+                f.glitches += 1
+            if level != f.level:
+                f.pending = self._async_loop.call_later(f.min_pulse, self._filter_input_confirm, pin, level, timestamp)
+            return
+        self._filter_input_confirm(pin, level, timestamp)
+
+    def _filter_input_confirm(self, pin: int, level: int, timestamp: float) -> None:
+        f = self._input_filter[pin]
+        f.pending = None
+        in_window = f.debounce > 0 and f.last_accepted is not None and timestamp-f.last_accepted < f.debounce
+        if level == f.level:
+            # back to the reported level: the bounce ended inside the debounce window
+            if in_window:
+                f.bounces += 1
+            return
+        if in_window:
+            f.bounces += 1
+            if f.reconcile is None:
+                delay = f.last_accepted+f.debounce-time.monotonic()
+                f.reconcile = self._async_loop.call_later(max(delay, 0), self._filter_input_reconcile, pin)
+            return
+        self._filter_input_accept(pin, level, timestamp)
+
+    def _filter_input_reconcile(self, pin: int) -> None:
+        # the debounce window closed: report the level the pin settled on, if it changed
+        f = self._input_filter[pin]
+        f.reconcile = None
+        if f.pending is None and f.raw_level != f.level:
+            self._filter_input_accept(pin, f.raw_level, f.raw_time)
+
+    def _filter_input_accept(self, pin: int, level: int, timestamp: float) -> None:
+        f = self._input_filter[pin]
+        f.level = level
+        f.last_accepted = timestamp
+        f.accepted += 1
+        self._dispatch_input(pin, level, timestamp)
+        if len(self._input_waiters) > 0:
+            self._check_input_waiters()
+
+    def _input_levels(self) -> Tuple[int, int]:
+        # bitmasks of the pins with a known input level and of the pins that are high, as reported to the user
+        known = 0
+        high = 0
+        for i in range(KONASHI_GPIO_COUNT):
+            f = self._input_filter[i]
+            if f is not None:
+                if f.level is not None:
+                    known |= 1<<i
+                    high |= f.level<<i
+            elif self._input[i].valid:
+                known |= 1<<i
+                high |= self._input[i].level<<i
+        return (known, high)
+
+    def _check_input_waiters(self) -> None:
+        known, high = self._input_levels()
+        waiters = []
+        for waiter in self._input_waiters:
+            pin_bitmask, level, future = waiter
+            if future.done():
+                continue
+            if pin_bitmask & ~known == 0 and (high&pin_bitmask) == (pin_bitmask if level == GPIOPinLevel.HIGH else 0):
+                future.set_result(None)
+                continue
+            waiters.append(waiter)
+        self._input_waiters = waiters
 
 
     async def config_pins(self, configs: Sequence(Tuple[int, GPIOPinConfig])) -> None:
@@ -189,14 +566,19 @@ class _GPIO(KonashiElementBase._KonashiElementBase):
         Raises:
             PinUnavailableError: At least one of the specified pins is confgured with a function other than GPIO.
         """
+        pin_bitmask = 0
+        expected = 0
         b = bytearray([KONASHI_CFG_CMD_GPIO])
         for config in configs:
+            pin_bitmask |= config[0]
+            if config[1].function == GPIOPinFunction.GPIO:
+                expected |= config[0]
+            config_bytes = bytes(config[1])
             for i in range(KONASHI_GPIO_COUNT):
                 if (config[0]&(1<<i)) > 0:
-                    if GPIOPinFunction(self._config[i].function) != GPIOPinFunction.DISABLED and GPIOPinFunction(self._config[i].function) != GPIOPinFunction.GPIO:
-                        raise PinUnavailableError(f'Pin {i} is already configured as {_KONASHI_GPIO_FUNCTION_STR[self._config[i].function]}')
-                    b.extend(bytearray([(i<<4)|(bytes(config[1])[0]), bytes(config[1])[1]]))
-        await self._write(KONASHI_UUID_CONFIG_CMD, b)
+                    b.extend(bytearray([(i<<4)|(config_bytes[0]), config_bytes[1]]))
+        pin_bitmask &= (1<<KONASHI_GPIO_COUNT)-1
+        await self._pins.configure(pin_bitmask, GPIOPinFunction.GPIO, expected&pin_bitmask, lambda: self._write(KONASHI_UUID_CONFIG_CMD, b))
 
     async def get_pins_config(self, pin_bitmask: int) -> List[GPIOPinConfig]:
         """Get the configuration of the specified pins.
@@ -226,6 +608,149 @@ class _GPIO(KonashiElementBase._KonashiElementBase):
         """
         self._input_cb = notify_callback
 
+    def config_input_filter(self, pin_bitmask: int, debounce: float=0.0, min_pulse: float=0.0) -> None:
+        """Configure the host-side input filter of the specified pins.
+        The filter runs on the host timestamps of the input notifications and decides which edges reach the input callback.
+        Setting both the debounce window and the minimum pulse width to 0 removes the filter.
+
+        Args:
+            pin_bitmask (int): A bitmask of the pins to apply the filter to.
+            debounce (float, optional): The debounce window in seconds.
+                Edges received less than this after a reported edge are suppressed, and the settled level is reported when the window closes.
+                Defaults to 0.0.
+            min_pulse (float, optional): The minimum pulse width in seconds.
+                A new level is only reported after it has been stable for this long, shorter pulses are suppressed.
+                Defaults to 0.0.
+
+        Raises:
+            ValueError: The debounce window or minimum pulse width is negative.
+        """
+        if debounce < 0:
+            raise ValueError("The debounce window cannot be negative")
+        if min_pulse < 0:
+            raise ValueError("The minimum pulse width cannot be negative")
+        for i in range(KONASHI_GPIO_COUNT):
+            if (pin_bitmask&(1<<i)) > 0:
+                if self._input_filter[i] is not None:
+                    self._input_filter[i].cancel()
+                if debounce == 0 and min_pulse == 0:
+                    self._input_filter[i] = None
+                else:
+                    self._input_filter[i] = _GPIOInputFilter(debounce, min_pulse, self._input[i].level if self._input[i].valid else None)
+
+    def get_input_filter_stats(self, pin_bitmask: int) -> List[GPIOInputFilterStats]:
+        """Get the input filter counters of the specified pins.
+
+        Args:
+            pin_bitmask (int): A bitmask of the pins to get the counters for.
+
+        Returns:
+            List[GPIOInputFilterStats]: The counters of the specified pins (None for pins without a filter).
+        """
+        l = []
+        for i in range(KONASHI_GPIO_COUNT):
+            if (pin_bitmask&(1<<i)) > 0:
+                f = self._input_filter[i]
+                if f is None:
+                    l.append(None)
+                else:
+                    l.append(GPIOInputFilterStats(f.accepted, f.bounces, f.glitches))
+        return l
+
+    def reset_input_filter_stats(self, pin_bitmask: int) -> None:
+        """Reset the input filter counters of the specified pins.
+
+        Args:
+            pin_bitmask (int): A bitmask of the pins to reset the counters for.
+        """
+        for i in range(KONASHI_GPIO_COUNT):
+            if (pin_bitmask&(1<<i)) > 0:
+                f = self._input_filter[i]
+                if f is not None:
+                    f.accepted = 0
+                    f.bounces = 0
+                    f.glitches = 0
+
+    def start_pulse_measurement(self, pin_bitmask: int, window: int=64, jitter: float=0.0) -> None:
+        """Start measuring the pulses on the specified input pins.
+        The measurement uses the host timestamps of the input notifications (after the input filter, if configured)
+        and keeps a fixed number of recent edges, the statistics are updated for each edge in constant time.
+        Restarting the measurement of a pin clears its statistics.
+
+        Args:
+            pin_bitmask (int): A bitmask of the pins to measure.
+            window (int, optional): The number of recent edges to compute the statistics over (minimum 3). Defaults to 64.
+            jitter (float, optional): The standard deviation of the notification timestamps in seconds
+                (for example the BLE connection interval divided by the square root of 12).
+                It is removed from the period standard deviation and used to estimate the period error. Defaults to 0.0.
+
+        Raises:
+            ValueError: The window is too small or the jitter is negative.
+        """
+        if window < 3:
+            raise ValueError("The measurement window should be at least 3 edges")
+        if jitter < 0:
+            raise ValueError("The jitter cannot be negative")
+        for i in range(KONASHI_GPIO_COUNT):
+            if (pin_bitmask&(1<<i)) > 0:
+                self._pulse_meters[i] = _GPIOPulseMeter(window, jitter)
+
+    def stop_pulse_measurement(self, pin_bitmask: int) -> None:
+        """Stop measuring the pulses on the specified pins.
+
+        Args:
+            pin_bitmask (int): A bitmask of the pins to stop measuring.
+        """
+        for i in range(KONASHI_GPIO_COUNT):
+            if (pin_bitmask&(1<<i)) > 0:
+                self._pulse_meters[i] = None
+
+    def get_pulse_stats(self, pin_bitmask: int) -> List[GPIOPulseStats]:
+        """Get the pulse measurement statistics of the specified pins.
+
+        Args:
+            pin_bitmask (int): A bitmask of the pins to get the statistics for.
+
+        Returns:
+            List[GPIOPulseStats]: The statistics of the specified pins (None for pins that are not measured).
+        """
+        l = []
+        for i in range(KONASHI_GPIO_COUNT):
+            if (pin_bitmask&(1<<i)) > 0:
+                if self._pulse_meters[i] is None:
+                    l.append(None)
+                else:
+                    l.append(self._pulse_meters[i].stats())
+        return l
+
+    async def wait_for(self, pin_bitmask: int, level: GPIOPinLevel, timeout: Optional[float]=None) -> None:
+        """Wait until all the specified pins are at the given input level.
+        The condition is evaluated on the input notifications (after the input filter, if configured), no read is issued.
+        Returns immediately if the condition is already met.
+
+        Args:
+            pin_bitmask (int): A bitmask of the pins to wait for.
+            level (GPIOPinLevel): The input level to wait for (LOW or HIGH).
+            timeout (Optional[float], optional): The maximum time to wait in seconds, None to wait indefinitely. Defaults to None.
+
+        Raises:
+            ValueError: The level is not LOW or HIGH.
+            asyncio.TimeoutError: The condition was not met within the timeout.
+        """
+        if level != GPIOPinLevel.LOW and level != GPIOPinLevel.HIGH:
+            raise ValueError("The level to wait for should be LOW or HIGH")
+        pin_bitmask &= (1<<KONASHI_GPIO_COUNT)-1
+        known, high = self._input_levels()
+        if pin_bitmask & ~known == 0 and (high&pin_bitmask) == (pin_bitmask if level == GPIOPinLevel.HIGH else 0):
+            return
+        future = asyncio.get_event_loop().create_future()
+        self._input_waiters.append((pin_bitmask, level, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        finally:
+            if not future.done():
+                future.cancel()
+
     async def control_pins(self, controls: Sequence(Tuple[int, GPIOPinControl])) -> None:
         """Control GPIO pins.
 
@@ -238,14 +763,19 @@ class _GPIO(KonashiElementBase._KonashiElementBase):
         Raises:
             PinUnavailableError: At least one pin is not configured as GPIO.
         """
+        b = self._encode_control(controls)
+        await self._write(KONASHI_UUID_CONTROL_CMD, b)
+
+    def _encode_control(self, controls: Sequence(Tuple[int, GPIOPinControl])) -> bytearray:
+        pin_bitmask = 0
         b = bytearray([KONASHI_CTL_CMD_GPIO])
         for control in controls:
+            pin_bitmask |= control[0]
             for i in range(KONASHI_GPIO_COUNT):
                 if (control[0]&(1<<i)) > 0:
-                    if GPIOPinFunction(self._config[i].function) != GPIOPinFunction.GPIO:
-                        raise PinUnavailableError(f'Pin {i} is not configured as GPIO (configured as {_KONASHI_GPIO_FUNCTION_STR[self._config[i].function]})')
                     b.extend(bytearray([(i<<4)|(control[1])]))
-        await self._write(KONASHI_UUID_CONTROL_CMD, b)
+        self._pins.check_function(pin_bitmask&((1<<KONASHI_GPIO_COUNT)-1), GPIOPinFunction.GPIO)
+        return b
 
     async def get_pins_control(self, pin_bitmask: int) -> List[GPIOPinLevel]:
         """Get the output control of the specified pin.
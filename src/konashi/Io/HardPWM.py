@@ -5,11 +5,16 @@ from __future__ import annotations
 import asyncio
 import struct
 import logging
+import functools
 from ctypes import *
 from typing import *
 from enum import *
 
 from bleak import *
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from .. import KonashiElementBase
 from ..Errors import *
@@ -30,6 +35,7 @@ KONASHI_UUID_HARDPWM_OUTPUT_GET = "064d0305-8251-49d9-b6f3-f7ba35e5d0a1"
 
 KONASHI_HARDPWM_COUNT = 4
 KONASHI_HARDPWM_PIN_TO_GPIO_NUM = [0, 1, 2, 3]
+_HARDPWM_MASK_TO_GPIO_MASK = [sum(1<<KONASHI_HARDPWM_PIN_TO_GPIO_NUM[i] for i in range(KONASHI_HARDPWM_COUNT) if m&(1<<i)) for m in range(1<<KONASHI_HARDPWM_COUNT)]
 class HardPWMClock(IntEnum):
     HFCLK = 0
     CASCADE = 1
@@ -96,6 +102,26 @@ class HardPWMConfig(LittleEndianStructure):
         s += ", Period={}s".format((self.top/(KONASHI_HARDPWM_CLOCK_FREQ[self.clock]/(1<<self.prescale))))
         s += ")"
         return s
+class HardPWMSolution(NamedTuple):
+    """A Hardware PWM configuration solved for a wanted period.
+    """
+    config: HardPWMConfig
+    period: float
+    error: float
+    resolution: float
+# every (clock, prescale) the timer can run from, fastest count frequency first
+_HARDPWM_COUNT_FREQS = [(HardPWMClock.HFCLK, div, KONASHI_HARDPWM_CLOCK_FREQ[HardPWMClock.HFCLK]/(1<<div.value)) for div in HardPWMPrescale] + [(HardPWMClock.CASCADE, HardPWMPrescale.DIV1, KONASHI_HARDPWM_CLOCK_FREQ[HardPWMClock.CASCADE])]
+@functools.lru_cache(maxsize=1024)
+def _solve_pwm_period(period: float) -> Optional[Tuple[HardPWMClock, HardPWMPrescale, int, float]]:
+    # the fastest frequency the period fits in has the largest top, so the finest duty resolution
+    for clock, prescale, freq in _HARDPWM_COUNT_FREQS:
+        top = round(period*freq)
+        if top > 65535:
+            continue
+        if top < 1:
+            return None
+        return (clock, prescale, top, top/freq)
+    return None
 class _Config(LittleEndianStructure):
     _pack_ = 1
     _fields_ = [
@@ -140,7 +166,9 @@ class _HardPWM(KonashiElementBase._KonashiElementBase):
         self._config = _Config()
         self._output = _PinsControl()
         self._trans_end_cb = None
-        self._ongoing_control = []
+        self._trans_end_cbs = []
+        self._transitions = KonashiElementBase._TransitionTracker()
+        self._update_scales()
 
     def __str__(self):
         return f'KonashiHardPWM'
@@ -159,41 +187,56 @@ class _HardPWM(KonashiElementBase._KonashiElementBase):
     def _ntf_cb_config(self, sender, data):
         logger.debug("Received config data: {}".format("".join("{:02x}".format(x) for x in data)))
         self._config = _Config.from_buffer_copy(data)
+        self._update_scales()
 
     def _ntf_cb_output(self, sender, data):
         logger.debug("Received output data: {}".format("".join("{:02x}".format(x) for x in data)))
         self._output = _PinsControl.from_buffer_copy(data)
         for i in range(KONASHI_HARDPWM_COUNT):
-            if i in self._ongoing_control and self._output[i].transition_duration == 0:
-                self._ongoing_control.remove(i)
+            future = self._transitions.end(i, self._output[i].control_value, self._output[i].transition_duration == 0)
+            if future is not None:
+                duty = self._calc_duty_for_control_value(self._output[i].control_value)
+                if not future.done():
+                    future.set_result(duty)
                 if self._trans_end_cb is not None:
-                    self._trans_end_cb(i, self._calc_duty_for_control_value(self._output[i].control_value))
+                    self._trans_end_cb(i, duty)
+                for cb in list(self._trans_end_cbs):
+                    cb(i, duty)
 
 
     def _calc_pwm_config_for_period(self, period: float) -> HardPWMConfig:
-        freq = KONASHI_HARDPWM_CLOCK_FREQ[HardPWMClock.HFCLK]
-        presc = None
-        top = None
-        for div in HardPWMPrescale:
-            f = freq/(1<<div.value)
-            top = round(period*f)
-            if top <= 65535:
-                presc = div
-                break
-        if presc is not None:
-            return HardPWMConfig(HardPWMClock.HFCLK, presc, top)
-        freq = KONASHI_HARDPWM_CLOCK_FREQ[HardPWMClock.CASCADE]
-        presc = HardPWMPrescale.DIV1
-        top = round(period*freq)
-        if top <= 65535:
-            return HardPWMConfig(HardPWMClock.CASCADE, presc, top)
-        raise ValueError("A suitable configuration cannot be calculated for this period value")
+        return self.solve_pwm_period(period).config
+
+    def _update_scales(self) -> None:
+        top = self._config.pwm.top
+        self._value_per_duty = top/100.0
+        self._duty_per_value = 100.0/top if top > 0 else 0.0
 
     def _calc_duty_for_control_value(self, value: int) -> float:
-        return value * 100.0 / self._config.pwm.top
+        return value * self._duty_per_value
+
 
+    def solve_pwm_period(self, period: float) -> HardPWMSolution:
+        """Find the Hardware PWM configuration for the given period.
+        The smallest HFCLK prescale the period fits in is selected, then the CASCADE clock for longer periods.
+        The solutions are memoized, so solving the same period again is cheap.
 
-    async def config_pwm(self, period: float) -> None:
+        Args:
+            period (float): The wanted period in seconds.
+
+        Raises:
+            ValueError: A suitable configuration could not be found for the given period.
+
+        Returns:
+            HardPWMSolution: The configuration, the achieved period in seconds, the period error in seconds (achieved minus wanted) and the duty resolution in %.
+        """
+        solution = _solve_pwm_period(float(period))
+        if solution is None:
+            raise ValueError("A suitable configuration cannot be calculated for this period value")
+        clock, prescale, top, achieved = solution
+        return HardPWMSolution(HardPWMConfig(clock, prescale, top), achieved, achieved-period, 100.0/top)
+
+    async def config_pwm(self, period: float) -> HardPWMSolution:
         """Configure the Hardware PWM with the given period.
 
         Args:
@@ -201,10 +244,14 @@ class _HardPWM(KonashiElementBase._KonashiElementBase):
 
         Raises:
             ValueError: A suitable configuration could not be found for the given period.
+
+        Returns:
+            HardPWMSolution: The applied configuration, the achieved period in seconds, the period error in seconds and the duty resolution in %.
         """
-        config = self._calc_pwm_config_for_period(period)
-        b = bytearray([KONASHI_CFG_CMD_HARDPWM, 0xFF]) + bytearray(config)
+        solution = self.solve_pwm_period(period)
+        b = bytearray([KONASHI_CFG_CMD_HARDPWM, 0xFF]) + bytearray(solution.config)
         await self._write(KONASHI_UUID_CONFIG_CMD, b)
+        return solution
 
     async def get_pwm_config(self) -> HardPWMConfig:
         """Get the current Hardware PWM configuration.
@@ -227,14 +274,19 @@ class _HardPWM(KonashiElementBase._KonashiElementBase):
         Raises:
             PinUnavailableError: At least one of the specified pins is already configured with another function.
         """
+        pin_bitmask = 0
+        enabled = 0
         b = bytearray([KONASHI_CFG_CMD_HARDPWM])
         for config in configs:
+            pin_bitmask |= config[0]
+            if config[1]:
+                enabled |= config[0]
             for i in range(KONASHI_HARDPWM_COUNT):
                 if (config[0]&(1<<i)) > 0:
-                    if self._gpio._config[KONASHI_HARDPWM_PIN_TO_GPIO_NUM[i]].function != int(GPIO.GPIOPinFunction.DISABLED) and self._gpio._config[KONASHI_HARDPWM_PIN_TO_GPIO_NUM[i]].function != int(GPIO.GPIOPinFunction.PWM):
-                        raise PinUnavailableError(f'Pin {KONASHI_HARDPWM_PIN_TO_GPIO_NUM[i]} is already configured as {GPIO._KONASHI_GPIO_FUNCTION_STR[self._gpio._config[KONASHI_HARDPWM_PIN_TO_GPIO_NUM[i]].function]}')
                     b.extend(bytearray([(i<<4)|int(config[1])]))
-        await self._write(KONASHI_UUID_CONFIG_CMD, b)
+        gpio_bitmask = _HARDPWM_MASK_TO_GPIO_MASK[pin_bitmask&((1<<KONASHI_HARDPWM_COUNT)-1)]
+        expected = _HARDPWM_MASK_TO_GPIO_MASK[enabled&pin_bitmask&((1<<KONASHI_HARDPWM_COUNT)-1)]
+        await self._gpio._pins.configure(gpio_bitmask, GPIO.GPIOPinFunction.PWM, expected, lambda: self._write(KONASHI_UUID_CONFIG_CMD, b))
 
     async def get_pins_config(self, pin_bitmask: int) -> List[_HardPWMPinConfig]:
         """Get the configuration of the specified pins.
@@ -266,8 +318,31 @@ class _HardPWM(KonashiElementBase._KonashiElementBase):
         """
         self._trans_end_cb = notify_callback
 
-    async def control_pins(self, controls: Sequence(Tuple[int, HardPWMPinControl])) -> None:
+    def add_transition_end_cb(self, notify_callback: Callable[[int, float], None]) -> None:
+        """Add a transition end callback function, called in addition to the one set with ``set_transition_end_cb``.
+
+        Args:
+            notify_callback (Callable[[int, float], None]): The callback function.
+                The function takes 2 parameters and returns nothing:
+                int: The pin number.
+                float: The current duty in %.
+        """
+        self._trans_end_cbs.append(notify_callback)
+
+    def remove_transition_end_cb(self, notify_callback: Callable[[int, float], None]) -> None:
+        """Remove a transition end callback function added with ``add_transition_end_cb``.
+
+        Args:
+            notify_callback (Callable[[int, float], None]): The callback function.
+
+        Raises:
+            ValueError: The callback function was not added.
+        """
+        self._trans_end_cbs.remove(notify_callback)
+
+    async def control_pins(self, controls: Sequence(Tuple[int, HardPWMPinControl])) -> Dict[int, asyncio.Future]:
         """Control Hardware PWM pins.
+        A transition still ongoing on a controlled pin is superseded, and its future is cancelled.
 
         Args:
             controls (Sequence[Tuple[int, HardPWMPinControl]]): A list of pin controls.
@@ -277,20 +352,55 @@ class _HardPWM(KonashiElementBase._KonashiElementBase):
 
         Raises:
             PinUnavailableError: At least one pin is not configured as a Hardware PWM pin.
+
+        Returns:
+            Dict[int, asyncio.Future]: For each controlled pin number, a future resolved with the duty in % when the transition ends.
         """
-        ongoing_control = []
+        b, targets = self._encode_control(controls)
+        return await self._write_transitions(self._transitions, KONASHI_UUID_CONTROL_CMD, b, targets)
+
+    def _encode_control(self, controls: Sequence(Tuple[int, HardPWMPinControl])) -> Tuple[bytearray, Dict[int, int]]:
+        targets = {}
+        pin_bitmask = 0
         b = bytearray([KONASHI_CTL_CMD_HARDPWM])
         for control in controls:
+            pin_bitmask |= control[0]
             for i in range(KONASHI_HARDPWM_COUNT):
                 if (control[0]&(1<<i)) > 0:
-                    if self._gpio._config[KONASHI_HARDPWM_PIN_TO_GPIO_NUM[i]].function != int(GPIO.GPIOPinFunction.PWM):
-                        raise PinUnavailableError(f'Pin {KONASHI_HARDPWM_PIN_TO_GPIO_NUM[i]} is not configured as PWM (configured as {GPIO._KONASHI_GPIO_FUNCTION_STR[self._gpio._config[KONASHI_HARDPWM_PIN_TO_GPIO_NUM[i]].function]})')
                     b.extend(bytearray([i])+bytearray(control[1]))
-                    ongoing_control.append(i)
-        await self._write(KONASHI_UUID_CONTROL_CMD, b)
-        for i in ongoing_control:
-            if i not in self._ongoing_control:
-                self._ongoing_control.append(i)
+                    targets[i] = control[1].control_value
+        self._gpio._pins.check_function(_HARDPWM_MASK_TO_GPIO_MASK[pin_bitmask&((1<<KONASHI_HARDPWM_COUNT)-1)], GPIO.GPIOPinFunction.PWM)
+        return (b, targets)
+
+    async def control_pins_array(self, pins: Sequence[int], duties: Sequence[float], durations: Union[int, Sequence[int]]=0) -> Dict[int, asyncio.Future]:
+        """Control Hardware PWM pins from arrays of duties.
+        The duties and durations are validated and encoded vectorized, into a single control command.
+        Requires NumPy.
+
+        Args:
+            pins (Sequence[int]): The pin numbers (a NumPy array or any sequence), each pin at most once.
+            duties (Sequence[float]): The wanted duty cycle values in %, one per pin.
+            durations (Union[int, Sequence[int]], optional): The transition durations in milliseconds, one per pin or one for all. Defaults to 0.
+
+        Raises:
+            ImportError: NumPy is not installed.
+            ValueError: The arrays do not match or a pin is repeated.
+            ValuesOutOfRangeError: At least one pin number, duty or duration is out of range, the ``indices`` attribute holds their indices.
+            PinUnavailableError: At least one pin is not configured as a Hardware PWM pin.
+
+        Returns:
+            Dict[int, asyncio.Future]: For each controlled pin number, a future resolved with the duty in % when the transition ends.
+        """
+        b, targets = self._encode_control_array(pins, duties, durations)
+        return await self._write_transitions(self._transitions, KONASHI_UUID_CONTROL_CMD, b, targets)
+
+    def _encode_control_array(self, pins: Sequence[int], duties: Sequence[float], durations: Union[int, Sequence[int]]) -> Tuple[bytearray, Dict[int, int]]:
+        self._require_numpy()
+        pins, durations = self._pin_control_arrays(pins, duties, durations, KONASHI_HARDPWM_COUNT)
+        values = self.calc_control_values_for_duties(duties)
+        pin_bitmask = int(np.bitwise_or.reduce(np.left_shift(1, pins.astype(np.int64)), initial=0))
+        self._gpio._pins.check_function(_HARDPWM_MASK_TO_GPIO_MASK[pin_bitmask], GPIO.GPIOPinFunction.PWM)
+        return (self._pack_pin_controls(KONASHI_CTL_CMD_HARDPWM, pins, values, durations), dict(zip(pins.tolist(), values.tolist())))
 
     def calc_control_value_for_duty(self, duty: float) -> int:
         """Calculate the control value for the wanted duty.
@@ -301,7 +411,26 @@ class _HardPWM(KonashiElementBase._KonashiElementBase):
         Returns:
             int: The corresponding control value.
         """
-        return round(duty * self._config.pwm.top / 100.0)
+        return round(duty * self._value_per_duty)
+
+    def calc_control_values_for_duties(self, duties: Sequence[float]) -> Any:
+        """Calculate the control values for an array of wanted duties.
+        Requires NumPy.
+
+        Args:
+            duties (Sequence[float]): The wanted duty cycle values in % (a NumPy array or any sequence).
+
+        Raises:
+            ImportError: NumPy is not installed.
+            ValuesOutOfRangeError: At least one duty is out of the range [0,100], the ``indices`` attribute holds their indices.
+
+        Returns:
+            numpy.ndarray: The corresponding control values.
+        """
+        self._require_numpy()
+        duties = np.asarray(duties, dtype=np.float64)
+        self._check_array_range(duties, 0, 100, "The duty needs to be in the range [0,100]")
+        return np.rint(duties*self._value_per_duty).astype(np.uint16)
 
     async def get_pins_control(self, pin_bitmask: int) -> List[HardPWMPinControl]:
         """Get the output control of the specified pins.
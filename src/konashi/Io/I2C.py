@@ -3,7 +3,9 @@
 from __future__ import annotations
 
 import asyncio
+import collections
 import struct
+import time
 import logging
 from ctypes import *
 from typing import *
@@ -13,6 +15,7 @@ from bleak import *
 
 from .. import KonashiElementBase
 from ..Errors import *
+from ..Stats import LatencyStats
 from . import GPIO
 
 
@@ -28,8 +31,13 @@ KONASHI_CTL_CMD_I2C_DATA = 0x05
 KONASHI_UUID_I2C_DATA_IN = "064d0308-8251-49d9-b6f3-f7ba35e5d0a1"
 
 
+KONASHI_I2C_MAX_READ_LEN = 126
+KONASHI_I2C_MAX_WRITE_LEN = 124
+
+
 KONASHI_I2C_SDA_PINNB = 6
 KONASHI_I2C_SCL_PINNB = 7
+_I2C_GPIO_MASK = (1<<KONASHI_I2C_SDA_PINNB)|(1<<KONASHI_I2C_SCL_PINNB)
 class I2CMode(IntEnum):
     STANDARD = 0
     FAST = 1
@@ -78,13 +86,409 @@ class I2CResult(IntEnum):
     SW_FAULT = 5  # SW fault.
 
 
+def _result(code: int) -> Union[I2CResult, int]:
+    # the result codes unknown to the SDK are kept as plain integers
+    try:
+        return I2CResult(code)
+    except ValueError:
+        return code
+
+def _result_name(code: int) -> str:
+    result = _result(code)
+    return result.name if isinstance(result, I2CResult) else f"unknown result 0x{code:02x}"
+
+
+class I2CScanResult(NamedTuple):
+    """The result of an I2C bus scan.
+    """
+    found: List[int]
+    failed: Dict[int, Optional[Union[I2CResult, int]]]
+
+
+class I2CRegisterCache:
+    """Write-through register cache of an I2C slave.
+    Writes go to the device and update the cache, reads of cached non-volatile registers are served from memory.
+    The volatile registers (status, data...) are never cached. The cache is invalidated when the device reconnects.
+    Use ``get_register_cache`` of the I2C interface to get one.
+    """
+    def __init__(self, i2c, address: int, volatile: Iterable[int]=(), reg_width: int=1) -> None:
+        """Constructor.
+
+        Args:
+            i2c: The I2C interface.
+            address (int): The I2C slave address (address range is 0x00 to 0x7F).
+            volatile (Iterable[int], optional): The volatile register addresses. Defaults to ().
+            reg_width (int, optional): The register address width in bytes. Defaults to 1.
+        """
+        if address > 0x7F:
+            raise ValueError("The I2C address should be in the range [0x01,0x7F]")
+        self._i2c = i2c
+        self._address = address
+        self._volatile = frozenset(volatile)
+        self._reg_width = reg_width
+        self._values = {}
+        self._hits = 0
+        self._misses = 0
+
+    def __str__(self):
+        return f'KonashiI2CRegisterCache(address=0x{self._address:02x}, cached={len(self._values)}, hits={self._hits}, misses={self._misses})'
+
+    def __repr__(self):
+        return f'KonashiI2CRegisterCache(address=0x{self._address:02x})'
+
+
+    def _store(self, reg: int, data: bytes) -> None:
+        for i, v in enumerate(data):
+            if reg+i not in self._volatile:
+                self._values[reg+i] = v
+
+    async def read(self, reg: int, length: int=1) -> bytes:
+        """Read registers, from the cache if they are all cached.
+
+        Args:
+            reg (int): The first register address.
+            length (int, optional): The number of registers (bytes) to read. Defaults to 1.
+
+        Raises:
+            KonashiError: The I2C transaction failed.
+
+        Returns:
+            bytes: The register values.
+        """
+        values = self._values
+        if all(r in values for r in range(reg, reg+length)):
+            self._hits += 1
+            return bytes(values[r] for r in range(reg, reg+length))
+        self._misses += 1
+        data = bytes(await self._i2c.read_registers(self._address, reg, length, self._reg_width))
+        self._store(reg, data)
+        return data
+
+    async def write(self, reg: int, data: bytes) -> None:
+        """Write registers to the device and update the cache.
+
+        Args:
+            reg (int): The first register address.
+            data (bytes): The register values.
+
+        Raises:
+            KonashiError: The I2C transaction failed, the written registers are then invalidated.
+        """
+        try:
+            await self._i2c.write_registers(self._address, reg, data, self._reg_width)
+        except:
+            self.invalidate(reg, len(data))
+            raise
+        self._store(reg, data)
+
+    async def update_bits(self, reg: int, mask: int, value: int) -> int:
+        """Read-modify-write a bit field of a register.
+        The current value is read from the cache when possible, and nothing is written if the register already holds the value.
+
+        Args:
+            reg (int): The register address.
+            mask (int): The bit field mask.
+            value (int): The bit field value (only the bits in the mask are used).
+
+        Raises:
+            KonashiError: The I2C transaction failed.
+
+        Returns:
+            int: The new register value.
+        """
+        old = (await self.read(reg, 1))[0]
+        new = (old&~mask&0xFF)|(value&mask)
+        if new != old or reg in self._volatile:
+            await self.write(reg, bytes([new]))
+        return new
+
+    def invalidate(self, reg: Optional[int]=None, length: int=1) -> None:
+        """Invalidate cached registers, so they are read from the device next time.
+
+        Args:
+            reg (Optional[int], optional): The first register address, None to invalidate all the registers. Defaults to None.
+            length (int, optional): The number of registers to invalidate. Defaults to 1.
+        """
+        if reg is None:
+            self._values.clear()
+            return
+        for r in range(reg, reg+length):
+            self._values.pop(r, None)
+
+    @property
+    def hits(self) -> int:
+        """The number of reads served from the cache.
+        """
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        """The number of reads sent to the device.
+        """
+        return self._misses
+
+
+class I2CPollResult(NamedTuple):
+    """A result delivered by an I2C poller.
+    """
+    job: int
+    timestamp: float
+    result: Union[I2CResult, int]
+    value: Any
+
+
+class I2CPollStats(NamedTuple):
+    """The statistics of an I2C poller job.
+    """
+    reads: int
+    late: int
+    skipped: int
+    errors: int
+
+
+class _I2CPollJob:
+    def __init__(self, job_id: int, address: int, frame: bytes, period: float, decoder: Optional[Callable[[bytes], Any]]) -> None:
+        self.id = job_id
+        self.address = address
+        self.frame = frame
+        self.period = period
+        self.decoder = decoder
+        self.due = 0.0
+        self.busy = False
+        self.reads = 0
+        self.late = 0
+        self.skipped = 0
+        self.errors = 0
+    def __lt__(self, other):
+        return self.id < other.id
+
+
+class I2CPoller:
+    """Periodic I2C register reads, delivered as an asynchronous stream of ``I2CPollResult``.
+    The command frame of each job is encoded once, when the job is added. The jobs are spread over time so their reads do not collide.
+    A read is late when it is sent more than ``late_tolerance`` of its period after its due time. A read is skipped when its previous
+    read has not completed yet, or when the poller fell behind by more than a period. A read whose decoder raises is counted as an error
+    and logged, and no result is delivered for it.
+    Use ``create_poller`` of the I2C interface to create one, then iterate over it with ``async for``.
+    """
+    def __init__(self, i2c, queue_size: int=256, late_tolerance: float=0.1) -> None:
+        """Constructor.
+
+        Args:
+            i2c: The I2C interface.
+            queue_size (int, optional): The number of undelivered results kept, the oldest are dropped when it is full. Defaults to 256.
+            late_tolerance (float, optional): The fraction of the period after which a read is counted as late. Defaults to 0.1.
+        """
+        self._i2c = i2c
+        self._jobs = {}
+        self._next_id = 0
+        self._results = collections.deque(maxlen=queue_size)
+        self._result_event = None
+        self._late_tolerance = late_tolerance
+        self._task = None
+        self._wakeup = None
+        self._dropped = 0
+
+    def __str__(self):
+        return f'KonashiI2CPoller(jobs={len(self._jobs)})'
+
+    def __repr__(self):
+        return f'KonashiI2CPoller()'
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> I2CPollResult:
+        while len(self._results) == 0:
+            if self._result_event is None:
+                self._result_event = asyncio.Event()
+            self._result_event.clear()
+            await self._result_event.wait()
+        return self._results.popleft()
+
+
+    def add_job(self, address: int, register: int, length: int, period: float, decoder: Optional[Callable[[bytes], Any]]=None, reg_width: int=1) -> int:
+        """Add a periodic register read.
+
+        Args:
+            address (int): The I2C slave address (address range is 0x00 to 0x7F).
+            register (int): The register address.
+            length (int): The number of bytes to read (0 to 126 bytes).
+            period (float): The read period in seconds.
+            decoder (Optional[Callable[[bytes], Any]], optional): A function converting the read bytes to the delivered value, None to deliver the bytes. Defaults to None.
+            reg_width (int, optional): The register address width in bytes, sent big endian. Defaults to 1.
+
+        Raises:
+            ValueError: A parameter is out of range.
+
+        Returns:
+            int: The job ID.
+        """
+        if address > 0x7F:
+            raise ValueError("The I2C address should be in the range [0x01,0x7F]")
+        if length < 0 or length > KONASHI_I2C_MAX_READ_LEN:
+            raise ValueError("Maximum read length is 126 bytes")
+        if period <= 0:
+            raise ValueError("The period should be positive")
+        frame = bytes([KONASHI_CTL_CMD_I2C_DATA, I2COperation.WRITE_READ, length, address]) + register.to_bytes(reg_width, 'big')
+        job = _I2CPollJob(self._next_id, address, frame, period, decoder)
+        self._next_id += 1
+        self._jobs[job.id] = job
+        if self.is_running:
+            job.due = time.monotonic()+self._spread(job)
+            self._wakeup.set()
+        return job.id
+
+    def remove_job(self, job_id: int) -> None:
+        """Remove a job.
+
+        Args:
+            job_id (int): The job ID.
+
+        Raises:
+            KeyError: There is no job with this ID.
+        """
+        del self._jobs[job_id]
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def get_job_stats(self, job_id: int) -> I2CPollStats:
+        """Get the statistics of a job.
+
+        Args:
+            job_id (int): The job ID.
+
+        Raises:
+            KeyError: There is no job with this ID.
+
+        Returns:
+            I2CPollStats: The number of reads, late reads, skipped reads and failed reads.
+        """
+        job = self._jobs[job_id]
+        return I2CPollStats(job.reads, job.late, job.skipped, job.errors)
+
+    def _spread(self, job: _I2CPollJob) -> float:
+        # offset each job by its rank over the shortest period, so the reads interleave
+        shortest = min(j.period for j in self._jobs.values())
+        rank = sorted(self._jobs).index(job.id)
+        return (rank*shortest/len(self._jobs))%job.period
+
+    async def _read(self, job: _I2CPollJob) -> None:
+        try:
+            res = await self._i2c._request(job.frame, job.address)
+        except (KonashiError, KonashiConnectionError) as e:
+            job.errors += 1
+            logger.warning("I2C poll of 0x{:02x} failed: {}".format(job.address, e))
+            return
+        finally:
+            job.busy = False
+        result = _result(res[0])
+        value = None
+        if result == I2CResult.DONE:
+            data = bytes(res[2:])
+            if job.decoder is None:
+                value = data
+            else:
+                try:
+                    value = job.decoder(data)
+                except Exception as e:
+                    # a decoder failure only loses this read
+                    job.errors += 1
+                    logger.warning("I2C poll decoder of 0x{:02x} failed: {!r}".format(job.address, e))
+                    return
+            job.reads += 1
+        else:
+            job.errors += 1
+        if len(self._results) == self._results.maxlen:
+            self._dropped += 1
+        self._results.append(I2CPollResult(job.id, time.monotonic(), result, value))
+        if self._result_event is not None:
+            self._result_event.set()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_event_loop()
+        tasks = set()
+        try:
+            while True:
+                self._wakeup.clear()
+                if len(self._jobs) == 0:
+                    await self._wakeup.wait()
+                    continue
+                job = min(self._jobs.values(), key=lambda j: (j.due, j.id))
+                delay = job.due-time.monotonic()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                        continue
+                    except asyncio.TimeoutError:
+                        pass
+                if job.id not in self._jobs:
+                    continue
+                lateness = time.monotonic()-job.due
+                if lateness >= job.period:
+                    missed = int(lateness/job.period)
+                    job.skipped += missed
+                    job.due += missed*job.period
+                elif lateness > job.period*self._late_tolerance:
+                    job.late += 1
+                job.due += job.period
+                if job.busy:
+                    job.skipped += 1
+                    continue
+                job.busy = True
+                task = loop.create_task(self._read(job))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+    def start(self) -> None:
+        """Start polling.
+        """
+        if self.is_running:
+            return
+        now = time.monotonic()
+        for job in self._jobs.values():
+            job.due = now+self._spread(job)
+            job.busy = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop polling. The undelivered results are kept.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    @property
+    def is_running(self) -> bool:
+        """True if the poller is running.
+        """
+        return self._task is not None and not self._task.done()
+
+    @property
+    def dropped(self) -> int:
+        """The number of results dropped because they were not consumed in time.
+        """
+        return self._dropped
+
+
 class _I2C(KonashiElementBase._KonashiElementBase):
     def __init__(self, konashi, gpio) -> None:
         super().__init__(konashi)
         self._gpio = gpio
         self._config = I2CConfig(False, I2CMode.STANDARD)
-        self._async_loop = None
-        self._data_in_future = None
+        # the firmware echoes the slave address in the second byte of the response
+        self._responses = KonashiElementBase._ResponseQueue(lambda data: data[1])
+        self._register_caches = {}
 
     def __str__(self):
         return f'KonashiI2C'
@@ -94,10 +498,16 @@ class _I2C(KonashiElementBase._KonashiElementBase):
 
 
     async def _on_connect(self) -> None:
+        self._responses.clear()
+        for cache in self._register_caches.values():
+            cache.invalidate()
         await self._enable_notify(KONASHI_UUID_I2C_CONFIG_GET, self._ntf_cb_config)
         await self._read(KONASHI_UUID_I2C_CONFIG_GET)
         await self._enable_notify(KONASHI_UUID_I2C_DATA_IN, self._ntf_cb_data_in)
 
+    def _on_disconnect(self) -> None:
+        self._responses.fail(KonashiConnectionError("The connection was closed"))
+
 
     def _ntf_cb_config(self, sender, data):
         logger.debug("Received config data: {}".format("".join("{:02x}".format(x) for x in data)))
@@ -105,8 +515,7 @@ class _I2C(KonashiElementBase._KonashiElementBase):
 
     def _ntf_cb_data_in(self, sender, data):
         logger.debug("Received input data: {}".format("".join("{:02x}".format(x) for x in data)))
-        if self._async_loop is not None and self._data_in_future is not None:
-            self._async_loop.call_soon_threadsafe(self._data_in_future.set_result, data)
+        self._responses.notify(data)
 
 
     async def config(self, config: I2CConfig) -> None:
@@ -118,13 +527,11 @@ class _I2C(KonashiElementBase._KonashiElementBase):
         Raises:
             PinUnavailableError: One of the I2C pins is set to another function.
         """
-        if config.enabled:
-            if self._gpio._config[KONASHI_I2C_SDA_PINNB].function != int(GPIO.GPIOPinFunction.DISABLED) and self._gpio._config[KONASHI_I2C_SDA_PINNB].function != int(GPIO.GPIOPinFunction.I2C):
-                raise PinUnavailableError(f'Pin {KONASHI_I2C_SDA_PINNB} is already configured as {GPIO._KONASHI_GPIO_FUNCTION_STR[self._gpio._config[KONASHI_I2C_SDA_PINNB].function]}')
-            if self._gpio._config[KONASHI_I2C_SCL_PINNB].function != int(GPIO.GPIOPinFunction.DISABLED) and self._gpio._config[KONASHI_I2C_SCL_PINNB].function != int(GPIO.GPIOPinFunction.I2C):
-                raise PinUnavailableError(f'Pin {KONASHI_I2C_SCL_PINNB} is already configured as {GPIO._KONASHI_GPIO_FUNCTION_STR[self._gpio._config[KONASHI_I2C_SCL_PINNB].function]}')
         b = bytearray([KONASHI_CFG_CMD_I2C]) + bytearray(config)
-        await self._write(KONASHI_UUID_CONFIG_CMD, b)
+        if config.enabled:
+            await self._gpio._pins.configure(_I2C_GPIO_MASK, GPIO.GPIOPinFunction.I2C, _I2C_GPIO_MASK, lambda: self._write(KONASHI_UUID_CONFIG_CMD, b))
+        else:
+            await self._write(KONASHI_UUID_CONFIG_CMD, b)
 
     async def get_config(self) -> I2CConfig:
         """Get the current I2C configuration
@@ -135,36 +542,241 @@ class _I2C(KonashiElementBase._KonashiElementBase):
         await self._read(KONASHI_UUID_I2C_CONFIG_GET)
         return self._config
 
-    async def transaction(self, operation: I2COperation, address: int, read_len: int, write_data: bytes) -> Tuple[I2CResult, int, bytes]:
+    async def transaction(self, operation: I2COperation, address: int, read_len: int, write_data: bytes, timeout: Optional[float]=None) -> Tuple[I2CResult, int, bytes]:
         """Perform an I2C transaction.
+        Transactions can be called concurrently: they are sent in call order and each response is matched to its transaction.
+        A cancelled transaction does not disturb the following ones.
 
         Args:
             operation (I2COperation): The transaction operation.
             address (int): The I2C slave address (address range is 0x00 to 0x7F).
             read_len (int): The length of the data to read (0 to 126 bytes).
             write_data (bytes): The data to write (valid length 0 to 124 bytes).
+            timeout (Optional[float], optional): The time in seconds to wait for the response, None to wait without limit. Defaults to None.
 
         Returns:
             Tuple[I2CResult, int, bytes]: result, address, bytes.
-                I2CResult: The transaction result.
+                I2CResult: The transaction result (a plain int for a result code unknown to the SDK).
                 int: The transaction slave address.
                 bytes: The read data (if there is no read data, the length will be 0).
 
         Raises:
             ValueError: The read length or slave address is out of range, or the write data is too long.
+            asyncio.TimeoutError: The response did not come within the timeout.
+            KonashiConnectionError: The connection was lost before the response.
         """
-        if read_len > 126:
+        if read_len > KONASHI_I2C_MAX_READ_LEN:
             raise ValueError("Maximum read length is 126 bytes")
         if address > 0x7F:
             raise ValueError("The I2C address should be in the range [0x01,0x7F]")
-        if len(write_data) > 124:
+        if len(write_data) > KONASHI_I2C_MAX_WRITE_LEN:
             raise ValueError("Maximum write data length is 124 bytes")
         b = bytearray([KONASHI_CTL_CMD_I2C_DATA, operation, read_len, address]) + bytearray(write_data)
-        self._async_loop = asyncio.get_event_loop()
-        self._data_in_future = self._async_loop.create_future()
-        await self._write(KONASHI_UUID_CONTROL_CMD, b)
-        res = await self._data_in_future
-        self._async_loop = None
-        self._data_in_future = None
-        ret = (I2CResult(res[0]), res[1], res[2:])
+        res = await self._request(b, address, timeout)
+        ret = (_result(res[0]), res[1], res[2:])
         return ret
+
+    async def _request(self, frame: bytes, address: int, timeout: Optional[float]=None) -> bytes:
+        return await self._request_response(self._responses, KONASHI_UUID_CONTROL_CMD, frame, address, timeout)
+
+    def _register_chunks(self, start_reg: int, length: int, reg_width: int, max_len: int, page_size: Optional[int]) -> List[Tuple[int, int, int]]:
+        if reg_width < 1 or reg_width > 4:
+            raise ValueError("The register address width should be in the range [1,4] bytes")
+        if start_reg < 0 or start_reg+length > (1<<(8*reg_width)):
+            raise ValueError(f"The register range does not fit in {reg_width} address byte(s)")
+        if page_size is not None and page_size < 1:
+            raise ValueError("The page size should be positive")
+        chunks = []
+        offset = 0
+        while offset < length:
+            reg = start_reg+offset
+            size = min(max_len, length-offset)
+            if page_size is not None:
+                size = min(size, page_size-reg%page_size)
+            chunks.append((offset, reg, size))
+            offset += size
+        return chunks
+
+    async def read_registers(self, address: int, start_reg: int, length: int, reg_width: int=1, page_size: Optional[int]=None, window: int=4, out: Optional[bytearray]=None) -> bytearray:
+        """Read a range of registers of an I2C slave, of any length.
+        The read is split into write-read transactions of at most 126 bytes (and not crossing the page boundaries if a page size is given),
+        with the register address offset for each chunk. Up to ``window`` transactions are in flight at the same time.
+
+        Args:
+            address (int): The I2C slave address (address range is 0x00 to 0x7F).
+            start_reg (int): The first register address.
+            length (int): The number of bytes to read.
+            reg_width (int, optional): The register address width in bytes, sent big endian. Defaults to 1.
+            page_size (Optional[int], optional): The device page size in bytes, None if the device has no pages. Defaults to None.
+            window (int, optional): The maximum number of transactions in flight. Defaults to 4.
+            out (Optional[bytearray], optional): A buffer of at least ``length`` bytes to read into, None to allocate one. Defaults to None.
+
+        Raises:
+            ValueError: A parameter is out of range, or the buffer is too small.
+            KonashiError: A transaction failed (the message holds the I2C result and the register address).
+
+        Returns:
+            bytearray: The read data (``out`` if given).
+        """
+        if address > 0x7F:
+            raise ValueError("The I2C address should be in the range [0x01,0x7F]")
+        if out is None:
+            out = bytearray(length)
+        elif len(out) < length:
+            raise ValueError("The output buffer is too small")
+        view = memoryview(out)
+        chunks = self._register_chunks(start_reg, length, reg_width, KONASHI_I2C_MAX_READ_LEN, page_size)
+        def frames():
+            for offset, reg, size in chunks:
+                yield ((offset, reg, size), address, bytearray([KONASHI_CTL_CMD_I2C_DATA, I2COperation.WRITE_READ, size, address]) + reg.to_bytes(reg_width, 'big'))
+        def handle(chunk, res):
+            offset, reg, size = chunk
+            if res[0] != I2CResult.DONE:
+                raise KonashiError(f"I2C read of register 0x{reg:x} failed: {_result_name(res[0])}")
+            if len(res)-2 < size:
+                raise KonashiError(f"I2C read of register 0x{reg:x} returned {len(res)-2} bytes instead of {size}")
+            view[offset:offset+size] = res[2:2+size]
+        await self._pipeline(frames(), window, handle)
+        return out
+
+    async def write_registers(self, address: int, start_reg: int, data: bytes, reg_width: int=1, page_size: Optional[int]=None, window: int=1, poll_ack: Optional[float]=None) -> None:
+        """Write a range of registers of an I2C slave, of any length.
+        The write is split into write transactions of at most 124 bytes including the register address
+        (and not crossing the page boundaries if a page size is given), with the register address offset for each chunk.
+        Up to ``window`` transactions are in flight at the same time: keep the default of 1 for devices busy after each write (such as EEPROMs).
+        A device busy after a write (an EEPROM writing its page for instance) does not acknowledge its address until it is done:
+        give ``poll_ack`` to probe it with empty writes after each chunk until it answers, otherwise the caller has to wait before the next access.
+
+        Args:
+            address (int): The I2C slave address (address range is 0x00 to 0x7F).
+            start_reg (int): The first register address.
+            data (bytes): The data to write.
+            reg_width (int, optional): The register address width in bytes, sent big endian. Defaults to 1.
+            page_size (Optional[int], optional): The device page size in bytes, None if the device has no pages. Defaults to None.
+            window (int, optional): The maximum number of transactions in flight. Defaults to 1.
+            poll_ack (Optional[float], optional): The time in seconds to wait for the device to acknowledge again after each chunk,
+                None to not poll. When polling, the chunks are written one at a time. Defaults to None.
+
+        Raises:
+            ValueError: A parameter is out of range.
+            KonashiError: A transaction failed (the message holds the I2C result and the register address),
+                or the device did not acknowledge within ``poll_ack`` after a chunk.
+        """
+        if address > 0x7F:
+            raise ValueError("The I2C address should be in the range [0x01,0x7F]")
+        view = memoryview(data)
+        chunks = self._register_chunks(start_reg, len(data), reg_width, KONASHI_I2C_MAX_WRITE_LEN-reg_width, page_size)
+        def frames():
+            for offset, reg, size in chunks:
+                yield (reg, address, bytearray([KONASHI_CTL_CMD_I2C_DATA, I2COperation.WRITE, 0, address]) + reg.to_bytes(reg_width, 'big') + view[offset:offset+size])
+        def handle(reg, res):
+            if res[0] != I2CResult.DONE:
+                raise KonashiError(f"I2C write of register 0x{reg:x} failed: {_result_name(res[0])}")
+        if poll_ack is None:
+            await self._pipeline(frames(), window, handle)
+            return
+        for reg, key, frame in frames():
+            handle(reg, await self._request(frame, key))
+            await self._poll_ack(address, reg, poll_ack)
+
+    async def _poll_ack(self, address: int, reg: int, timeout: float) -> None:
+        # the device NACKs its address while it is busy
+        frame = bytes([KONASHI_CTL_CMD_I2C_DATA, I2COperation.WRITE, 0, address])
+        deadline = time.monotonic()+timeout
+        while True:
+            res = await self._request(frame, address)
+            if res[0] == I2CResult.DONE:
+                return
+            if time.monotonic() >= deadline:
+                raise KonashiError(f"I2C slave 0x{address:02x} did not acknowledge after the write of register 0x{reg:x}: {_result_name(res[0])}")
+
+    async def scan(self, first: int=0x08, last: int=0x77, window: int=8, read: bool=False) -> I2CScanResult:
+        """Scan the I2C bus for the slaves answering with an ACK.
+        Each address is probed with an empty write (or a 1 byte read), and up to ``window`` probes are in flight at the same time.
+        A probe whose response is lost does not stop the scan: the address is reported as failed with a None result.
+
+        Args:
+            first (int, optional): The first address to probe. Defaults to 0x08.
+            last (int, optional): The last address to probe. Defaults to 0x77.
+            window (int, optional): The maximum number of probes in flight. Defaults to 8.
+            read (bool, optional): True to probe with a 1 byte read, for the devices that do not handle empty writes. Defaults to False.
+
+        Raises:
+            ValueError: The address range or the window is invalid.
+            KonashiConnectionError: The connection was lost during the scan.
+
+        Returns:
+            I2CScanResult: The addresses that answered, and the result of the probe for each address that did not
+                (None if the response was lost, a plain int for a result code unknown to the SDK).
+        """
+        if not 0 <= first <= last <= 0x7F:
+            raise ValueError("The address range should be within [0x00,0x7F]")
+        if read:
+            operation, read_len = I2COperation.READ, 1
+        else:
+            operation, read_len = I2COperation.WRITE, 0
+        found = []
+        failed = {}
+        def frames():
+            for address in range(first, last+1):
+                yield (address, address, bytes([KONASHI_CTL_CMD_I2C_DATA, operation, read_len, address]))
+        async def probe(frame, address):
+            try:
+                return await self._request(frame, address)
+            except KonashiError:
+                return None
+        def handle(address, res):
+            if res is None:
+                failed[address] = None
+            elif res[0] == I2CResult.DONE:
+                found.append(address)
+            else:
+                failed[address] = _result(res[0])
+        await self._pipeline(frames(), window, handle, probe)
+        return I2CScanResult(found, failed)
+
+    def create_poller(self, queue_size: int=256, late_tolerance: float=0.1) -> I2CPoller:
+        """Create an I2C poller. Add jobs to it, start it and iterate over its results.
+
+        Args:
+            queue_size (int, optional): The number of undelivered results kept, the oldest are dropped when it is full. Defaults to 256.
+            late_tolerance (float, optional): The fraction of the period after which a read is counted as late. Defaults to 0.1.
+
+        Returns:
+            I2CPoller: The poller.
+        """
+        return I2CPoller(self, queue_size, late_tolerance)
+
+    def get_register_cache(self, address: int, volatile: Iterable[int]=(), reg_width: int=1) -> I2CRegisterCache:
+        """Get the register cache of an I2C slave, creating it on first use.
+
+        Args:
+            address (int): The I2C slave address (address range is 0x00 to 0x7F).
+            volatile (Iterable[int], optional): The volatile register addresses, the same on every call for a slave. Defaults to ().
+            reg_width (int, optional): The register address width in bytes, the same on every call for a slave. Defaults to 1.
+
+        Raises:
+            ValueError: The slave address is out of range, or the cache of the slave already exists with other volatile registers or register address width.
+
+        Returns:
+            I2CRegisterCache: The register cache.
+        """
+        cache = self._register_caches.get(address)
+        if cache is None:
+            cache = I2CRegisterCache(self, address, volatile, reg_width)
+            self._register_caches[address] = cache
+        elif cache._volatile != frozenset(volatile) or cache._reg_width != reg_width:
+            raise ValueError(f"The register cache of 0x{address:02x} already exists with other volatile registers or register address width")
+        return cache
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of transactions waiting for their response.
+        """
+        return self._responses.depth
+
+    @property
+    def latency(self) -> LatencyStats:
+        """The transaction latency, from the command write to the response.
+        """
+        return self._responses.latency
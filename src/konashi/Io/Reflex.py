@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import logging
+import time
+from typing import *
+from enum import *
+
+from .. import KonashiElementBase
+from ..Errors import *
+from ..Stats import LatencyStats
+from . import GPIO
+from . import AIO
+from . import HardPWM
+from . import SoftPWM
+
+
+logger = logging.getLogger(__name__)
+
+
+KONASHI_UUID_CONTROL_CMD = "064d0301-8251-49d9-b6f3-f7ba35e5d0a1"
+
+
+class ReflexEdge(IntEnum):
+    RISING = 1
+    FALLING = 2
+    BOTH = 3
+
+
+class _ReflexRule:
+    def __init__(self, rule_id: int, write: Callable[[], Awaitable[Any]]) -> None:
+        self.id = rule_id
+        self.write = write
+        self.pending = False
+        self.triggered = 0
+        self.coalesced = 0
+        self.latency = LatencyStats()
+class _ReflexGPIORule(_ReflexRule):
+    def __init__(self, rule_id: int, write: Callable[[], Awaitable[Any]], pin: int, edge: ReflexEdge) -> None:
+        super().__init__(rule_id, write)
+        self.pin = pin
+        self.edge = edge
+    def update(self, level: int) -> bool:
+        if level:
+            return (self.edge&ReflexEdge.RISING) > 0
+        return (self.edge&ReflexEdge.FALLING) > 0
+class _ReflexAnalogRule(_ReflexRule):
+    def __init__(self, rule_id: int, write: Callable[[], Awaitable[Any]], pin: int, threshold: float, above: bool, hysteresis: float) -> None:
+        super().__init__(rule_id, write)
+        self.pin = pin
+        # armed once the input is seen on the other side of the threshold, so a rule added past the threshold does not fire
+        self.crossing = AIO._ThresholdCrossing(threshold, above, hysteresis, False)
+    def update(self, voltage: float) -> bool:
+        return self.crossing.update(voltage)
+
+
+class _Reflex(KonashiElementBase._KonashiElementBase):
+    def __init__(self, konashi, gpio, analog) -> None:
+        super().__init__(konashi)
+        self._gpio = gpio
+        self._analog = analog
+        self._gpio_rules = [[] for i in range(GPIO.KONASHI_GPIO_COUNT)]
+        self._analog_rules = [[] for i in range(AIO.KONASHI_AIO_COUNT)]
+        self._rules = {}
+        self._next_id = 0
+        self._pending = collections.deque()
+        self._wakeup = None
+        self._writer = None
+        self._latency = LatencyStats()
+        self._gpio._input_listeners.append(self._on_gpio_input)
+        self._analog._input_listeners.append(self._on_analog_input)
+
+    def __str__(self):
+        return f'KonashiReflex'
+
+    def __repr__(self):
+        return f'KonashiReflex()'
+
+
+    async def _on_connect(self) -> None:
+        # the writer runs on the loop of the connection
+        self._stop_writer()
+        self._wakeup = asyncio.Event()
+        self._writer = asyncio.get_event_loop().create_task(self._write_loop())
+
+    def _on_disconnect(self) -> None:
+        self._stop_writer()
+
+    def _stop_writer(self) -> None:
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        self._wakeup = None
+        # the triggers still waiting for the link are dropped
+        for rule, timestamp in self._pending:
+            rule.pending = False
+        self._pending.clear()
+
+
+    def _on_gpio_input(self, pin: int, level: int, timestamp: float) -> None:
+        for rule in self._gpio_rules[pin]:
+            if rule.update(level):
+                self._fire(rule)
+
+    def _on_analog_input(self, pins_in, timestamp: float) -> None:
+        for i in range(AIO.KONASHI_AIO_COUNT):
+            if len(self._analog_rules[i]) == 0 or not pins_in.pin[i].valid:
+                continue
+            voltage = self._analog._calc_voltage_for_value(pins_in.pin[i].value)
+            if voltage is None:
+                continue
+            for rule in self._analog_rules[i]:
+                if rule.update(voltage):
+                    self._fire(rule)
+
+    def _fire(self, rule: _ReflexRule) -> None:
+        # timestamped at the match, the input filter delay is not part of the latency
+        timestamp = time.monotonic()
+        rule.triggered += 1
+        if self._writer is None:
+            # not connected, nothing can be written
+            return
+        if rule.pending:
+            # the previous trigger is still waiting for the link, its write covers this one
+            rule.coalesced += 1
+            return
+        rule.pending = True
+        self._pending.append((rule, timestamp))
+        self._wakeup.set()
+
+    async def _write_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while len(self._pending) > 0:
+                rule, timestamp = self._pending.popleft()
+                rule.pending = False
+                if self._rules.get(rule.id) is not rule:
+                    continue
+                try:
+                    await rule.write()
+                except Exception as e:
+                    # a failed write does not stop the other rules
+                    logger.warning("Reflex rule {} write failed: {}".format(rule.id, e))
+                    continue
+                latency = time.monotonic()-timestamp
+                rule.latency.record(latency)
+                self._latency.record(latency)
+
+    def _encode(self, target, controls) -> Callable[[], Awaitable[Any]]:
+        # the command is encoded once, the returned function writes it
+        if isinstance(target, (HardPWM._HardPWM, SoftPWM._SoftPWM)):
+            frame, targets = target._encode_control(controls)
+            frame = bytes(frame)
+            # the PWM transitions are tracked as for control_pins, so their end futures and callbacks fire
+            async def write_pwm():
+                return await target._write_transitions(target._transitions, KONASHI_UUID_CONTROL_CMD, frame, targets)
+            return write_pwm
+        if isinstance(target, (GPIO._GPIO, AIO._AIO)):
+            frame = bytes(target._encode_control(controls))
+            async def write():
+                await self._write(KONASHI_UUID_CONTROL_CMD, frame)
+            return write
+        raise ValueError("The target should be the GPIO, Software PWM, Hardware PWM or analog interface")
+
+    def _add_rule(self, rule: _ReflexRule, rules: List[_ReflexRule]) -> int:
+        self._rules[rule.id] = rule
+        rules.append(rule)
+        self._next_id += 1
+        return rule.id
+
+
+    def add_gpio_rule(self, pin: int, edge: ReflexEdge, target, controls: Sequence[Tuple[int, Any]]) -> int:
+        """Add a rule that sends a control command when a GPIO input edge is received.
+        The command is validated and encoded once, when the rule is added, and written as is each time the rule is triggered.
+        If the pin configuration of the target changes afterwards, the rule has to be added again.
+
+        Args:
+            pin (int): The GPIO input pin number.
+            edge (ReflexEdge): The edge that triggers the rule.
+            target: The interface to control (``io.gpio``, ``io.softpwm``, ``io.hardpwm`` or ``io.analog``).
+            controls (Sequence[Tuple[int, Any]]): The pin controls, as passed to ``control_pins`` of the target.
+
+        Raises:
+            ValueError: The pin number or target is invalid.
+            PinUnavailableError: At least one of the controlled pins is not configured for the target function.
+
+        Returns:
+            int: The rule ID.
+        """
+        if pin < 0 or pin >= GPIO.KONASHI_GPIO_COUNT:
+            raise ValueError(f"The pin number should be in the range [0,{GPIO.KONASHI_GPIO_COUNT-1}]")
+        rule = _ReflexGPIORule(self._next_id, self._encode(target, controls), pin, ReflexEdge(edge))
+        return self._add_rule(rule, self._gpio_rules[pin])
+
+    def add_analog_rule(self, pin: int, threshold: float, target, controls: Sequence[Tuple[int, Any]], above: bool=True, hysteresis: float=0.0) -> int:
+        """Add a rule that sends a control command when an analog input crosses a threshold.
+        The rule triggers once per crossing, and is re-armed when the input goes back past the threshold by more than the hysteresis.
+        The command is validated and encoded once, when the rule is added, and written as is each time the rule is triggered.
+
+        Args:
+            pin (int): The analog input pin number.
+            threshold (float): The threshold in Volts.
+            target: The interface to control (``io.gpio``, ``io.softpwm``, ``io.hardpwm`` or ``io.analog``).
+            controls (Sequence[Tuple[int, Any]]): The pin controls, as passed to ``control_pins`` of the target.
+            above (bool, optional): True to trigger when the input rises above the threshold, False when it falls below it. Defaults to True.
+            hysteresis (float, optional): The hysteresis in Volts. Defaults to 0.0.
+
+        Raises:
+            ValueError: The pin number, hysteresis or target is invalid.
+            PinUnavailableError: At least one of the controlled pins is not configured for the target function.
+
+        Returns:
+            int: The rule ID.
+        """
+        if pin < 0 or pin >= AIO.KONASHI_AIO_COUNT:
+            raise ValueError(f"The pin number should be in the range [0,{AIO.KONASHI_AIO_COUNT-1}]")
+        if hysteresis < 0:
+            raise ValueError("The hysteresis cannot be negative")
+        rule = _ReflexAnalogRule(self._next_id, self._encode(target, controls), pin, threshold, above, hysteresis)
+        return self._add_rule(rule, self._analog_rules[pin])
+
+    def remove_rule(self, rule_id: int) -> None:
+        """Remove a rule.
+
+        Args:
+            rule_id (int): The rule ID.
+
+        Raises:
+            KeyError: There is no rule with this ID.
+        """
+        rule = self._rules.pop(rule_id)
+        if isinstance(rule, _ReflexGPIORule):
+            self._gpio_rules[rule.pin].remove(rule)
+        else:
+            self._analog_rules[rule.pin].remove(rule)
+
+    def clear_rules(self) -> None:
+        """Remove all the rules.
+        """
+        for rule_id in list(self._rules):
+            self.remove_rule(rule_id)
+
+    def get_rule_stats(self, rule_id: int) -> Tuple[int, int, LatencyStats]:
+        """Get the statistics of a rule.
+
+        Args:
+            rule_id (int): The rule ID.
+
+        Raises:
+            KeyError: There is no rule with this ID.
+
+        Returns:
+            Tuple[int, int, LatencyStats]: triggered, coalesced, latency.
+                int: The number of times the rule was triggered.
+                int: The number of triggers merged into an already pending write.
+                LatencyStats: The latency from the rule match to the end of the write.
+        """
+        rule = self._rules[rule_id]
+        return (rule.triggered, rule.coalesced, rule.latency)
+
+    @property
+    def latency(self) -> LatencyStats:
+        """The latency from the rule match to the end of the write, over all the rules.
+        """
+        return self._latency
@@ -13,6 +13,7 @@ from bleak import *
 
 from .. import KonashiElementBase
 from ..Errors import *
+from ..Stats import LatencyStats
 from . import GPIO
 
 
@@ -28,10 +29,14 @@ KONASHI_CTL_CMD_SPI_DATA = 0x07
 KONASHI_UUID_SPI_DATA_IN = "064d030b-8251-49d9-b6f3-f7ba35e5d0a1"
 
 
+KONASHI_SPI_MAX_TRANSFER_LEN = 127
+
+
 KONASHI_SPI_CS_PINNB = 2
 KONASHI_SPI_CLK_PINNB = 5
 KONASHI_SPI_MISO_PINNB = 3
 KONASHI_SPI_MOSI_PINNB = 4
+_SPI_GPIO_MASK = (1<<KONASHI_SPI_CS_PINNB)|(1<<KONASHI_SPI_CLK_PINNB)|(1<<KONASHI_SPI_MISO_PINNB)|(1<<KONASHI_SPI_MOSI_PINNB)
 class SPIMode(IntEnum):
     MODE0 = 0  # SPI mode 0: CLKPOL=0, CLKPHA=0.
     MODE1 = 1  # SPI mode 1: CLKPOL=0, CLKPHA=1.
@@ -92,8 +97,7 @@ class _SPI(KonashiElementBase._KonashiElementBase):
         super().__init__(konashi)
         self._gpio = gpio
         self._config = SPIConfig(False, SPIMode.MODE0, SPIEndian.LSB_FIRST, 0)
-        self._async_loop = None
-        self._data_in_future = None
+        self._responses = KonashiElementBase._ResponseQueue()
 
     def __str__(self):
         return f'KonashiSpi'
@@ -103,10 +107,14 @@ class _SPI(KonashiElementBase._KonashiElementBase):
 
 
     async def _on_connect(self) -> None:
+        self._responses.clear()
         await self._enable_notify(KONASHI_UUID_SPI_CONFIG_GET, self._ntf_cb_config)
         await self._read(KONASHI_UUID_SPI_CONFIG_GET)
         await self._enable_notify(KONASHI_UUID_SPI_DATA_IN, self._ntf_cb_data_in)
 
+    def _on_disconnect(self) -> None:
+        self._responses.fail(KonashiConnectionError("The connection was closed"))
+
 
     def _ntf_cb_config(self, sender, data):
         logger.debug("Received config data: {}".format("".join("{:02x}".format(x) for x in data)))
@@ -114,8 +122,7 @@ class _SPI(KonashiElementBase._KonashiElementBase):
 
     def _ntf_cb_data_in(self, sender, data):
         logger.debug("Received input data: {}".format("".join("{:02x}".format(x) for x in data)))
-        if self._async_loop is not None and self._data_in_future is not None:
-            self._async_loop.call_soon_threadsafe(self._data_in_future.set_result, data)
+        self._responses.notify(data)
 
 
     async def config(self, config: SPIConfig) -> None:
@@ -127,17 +134,11 @@ class _SPI(KonashiElementBase._KonashiElementBase):
         Raises:
             PinUnavailableError: At least one of the pins is already configured with another function.
         """
-        if config.enabled:
-            if self._gpio._config[KONASHI_SPI_CS_PINNB].function != int(GPIO.GPIOPinFunction.DISABLED) and self._gpio._config[KONASHI_SPI_CS_PINNB].function != int(GPIO.GPIOPinFunction.SPI):
-                raise PinUnavailableError(f'Pin {KONASHI_SPI_CS_PINNB} is already configured as {GPIO._KONASHI_GPIO_FUNCTION_STR[self._gpio._config[KONASHI_SPI_CS_PINNB].function]}')
-            if self._gpio._config[KONASHI_SPI_CLK_PINNB].function != int(GPIO.GPIOPinFunction.DISABLED) and self._gpio._config[KONASHI_SPI_CLK_PINNB].function != int(GPIO.GPIOPinFunction.SPI):
-                raise PinUnavailableError(f'Pin {KONASHI_SPI_CLK_PINNB} is already configured as {GPIO._KONASHI_GPIO_FUNCTION_STR[self._gpio._config[KONASHI_SPI_CLK_PINNB].function]}')
-            if self._gpio._config[KONASHI_SPI_MISO_PINNB].function != int(GPIO.GPIOPinFunction.DISABLED) and self._gpio._config[KONASHI_SPI_MISO_PINNB].function != int(GPIO.GPIOPinFunction.SPI):
-                raise PinUnavailableError(f'Pin {KONASHI_SPI_MISO_PINNB} is already configured as {GPIO._KONASHI_GPIO_FUNCTION_STR[self._gpio._config[KONASHI_SPI_MISO_PINNB].function]}')
-            if self._gpio._config[KONASHI_SPI_MOSI_PINNB].function != int(GPIO.GPIOPinFunction.DISABLED) and self._gpio._config[KONASHI_SPI_MOSI_PINNB].function != int(GPIO.GPIOPinFunction.SPI):
-                raise PinUnavailableError(f'Pin {KONASHI_SPI_MOSI_PINNB} is already configured as {GPIO._KONASHI_GPIO_FUNCTION_STR[self._gpio._config[KONASHI_SPI_MOSI_PINNB].function]}')
         b = bytearray([KONASHI_CFG_CMD_SPI]) + bytearray(config)
-        await self._write(KONASHI_UUID_CONFIG_CMD, b)
+        if config.enabled:
+            await self._gpio._pins.configure(_SPI_GPIO_MASK, GPIO.GPIOPinFunction.SPI, _SPI_GPIO_MASK, lambda: self._write(KONASHI_UUID_CONFIG_CMD, b))
+        else:
+            await self._write(KONASHI_UUID_CONFIG_CMD, b)
 
     async def get_config(self) -> SPIConfig:
         """Get the current SPI configuration.
@@ -148,27 +149,88 @@ class _SPI(KonashiElementBase._KonashiElementBase):
         await self._read(KONASHI_UUID_SPI_CONFIG_GET)
         return self._config
 
-    async def transaction(self, write_data: bytes) -> bytes:
+    async def transaction(self, write_data: bytes, out: Optional[Union[bytearray, memoryview]]=None, timeout: Optional[float]=None) -> Union[bytearray, memoryview]:
         """Perform an SPI transaction.
+        Transactions can be called concurrently: they are sent in call order and each caller gets its own response.
 
         Args:
             write_data (bytes): The data to send (length range is [1,127]).
+            out (Optional[Union[bytearray, memoryview]], optional): A writable buffer of at least the length of the received data to receive into, None to allocate one. Defaults to None.
+            timeout (Optional[float], optional): The time in seconds to wait for the response, None to wait without limit. Defaults to None.
 
         Raises:
-            ValueError: The write data length is out of range.
+            ValueError: The write data length is out of range, or the output buffer is too small.
+            asyncio.TimeoutError: The response did not come within the timeout.
+            KonashiConnectionError: The connection was lost before the response.
 
         Returns:
-            bytes: The received data (the length should be the same the write data length).
+            Union[bytearray, memoryview]: The received data (the length should be the same the write data length), ``out`` if given.
         """
         if len(write_data) == 0:
             raise ValueError("Write data buffer cannot be empty")
-        if len(write_data) > 127:
+        if len(write_data) > KONASHI_SPI_MAX_TRANSFER_LEN:
             raise ValueError("Maximum write data length is 127 bytes")
         b = bytearray([KONASHI_CTL_CMD_SPI_DATA]) + bytearray(write_data)
-        self._async_loop = asyncio.get_event_loop()
-        self._data_in_future = self._async_loop.create_future()
-        await self._write(KONASHI_UUID_CONTROL_CMD, b)
-        res = await self._data_in_future
-        self._async_loop = None
-        self._data_in_future = None
-        return res
+        res = await self._request(b, timeout=timeout)
+        if out is None:
+            return bytearray(res)
+        dst = memoryview(out).cast('B')
+        if len(dst) < len(res):
+            raise ValueError("The output buffer is too small")
+        dst[:len(res)] = res
+        return out
+
+    async def _request(self, frame: bytes, key=None, timeout: Optional[float]=None) -> bytes:
+        return await self._request_response(self._responses, KONASHI_UUID_CONTROL_CMD, frame, timeout=timeout)
+
+    async def transfer(self, buffer: bytes, out: Optional[Union[bytearray, memoryview]]=None, window: int=4) -> Union[bytearray, memoryview]:
+        """Perform a full-duplex SPI transfer of any length.
+        The transfer is split into transactions of at most 127 bytes, with up to ``window`` transactions in flight,
+        and the received data is written directly into the output buffer.
+        The chip select is released between the transactions, so the device has to accept a transfer split this way.
+
+        Args:
+            buffer (bytes): The data to send (any bytes-like object).
+            out (Optional[Union[bytearray, memoryview]], optional): A writable buffer of at least the length of the data to receive into, None to allocate one. Defaults to None.
+            window (int, optional): The maximum number of transactions in flight. Defaults to 4.
+
+        Raises:
+            ValueError: The data is empty, the output buffer is too small or the window is invalid.
+            KonashiError: A transaction returned less data than sent.
+
+        Returns:
+            Union[bytearray, memoryview]: The received data (``out`` if given).
+        """
+        # lengths in bytes, whatever the item size of the buffers
+        src = memoryview(buffer).cast('B')
+        length = len(src)
+        if length == 0:
+            raise ValueError("Write data buffer cannot be empty")
+        if out is None:
+            out = bytearray(length)
+        dst = memoryview(out).cast('B')
+        if len(dst) < length:
+            raise ValueError("The output buffer is too small")
+        def frames():
+            for offset in range(0, length, KONASHI_SPI_MAX_TRANSFER_LEN):
+                chunk = src[offset:offset+KONASHI_SPI_MAX_TRANSFER_LEN]
+                yield ((offset, len(chunk)), None, bytearray([KONASHI_CTL_CMD_SPI_DATA]) + chunk)
+        def handle(chunk, res):
+            offset, size = chunk
+            if len(res) < size:
+                raise KonashiError(f"The SPI transaction at offset {offset} returned {len(res)} bytes instead of {size}")
+            dst[offset:offset+size] = res[:size]
+        await self._pipeline(frames(), window, handle)
+        return out
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of transactions waiting for their response.
+        """
+        return self._responses.depth
+
+    @property
+    def latency(self) -> LatencyStats:
+        """The transaction latency, from the command write to the response.
+        """
+        return self._responses.latency
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import logging
+import mmap
+import os
+import time
+from typing import *
+
+from ..Errors import *
+from . import SPI
+
+
+logger = logging.getLogger(__name__)
+
+
+SPI_FLASH_CMD_READ = 0x03
+SPI_FLASH_CMD_READ_4B = 0x13
+SPI_FLASH_CMD_JEDEC_ID = 0x9F
+
+
+class SPIFlashDumpStats(NamedTuple):
+    """The result of an SPI flash dump.
+    """
+    length: int
+    elapsed: float
+    throughput: float
+    mismatches: int
+    first_mismatch: Optional[int]
+
+
+class SPIFlash:
+    """SPI NOR flash reader using the standard JEDEC commands through the SPI interface.
+    The SPI interface has to be configured for the flash (usually mode 0, MSB first) before use.
+    """
+    def __init__(self, spi, address_bytes: int=3) -> None:
+        """Constructor.
+
+        Args:
+            spi: The SPI interface (``io.spi``).
+            address_bytes (int, optional): The flash address length, 3 or 4 bytes (4 uses the 4-byte address read command). Defaults to 3.
+
+        Raises:
+            ValueError: The address length is invalid.
+        """
+        if address_bytes not in (3, 4):
+            raise ValueError("The flash address length should be 3 or 4 bytes")
+        self._spi = spi
+        self._address_bytes = address_bytes
+        self._read_cmd = SPI_FLASH_CMD_READ if address_bytes == 3 else SPI_FLASH_CMD_READ_4B
+        self._header_len = 1+address_bytes
+        self._chunk_len = SPI.KONASHI_SPI_MAX_TRANSFER_LEN-self._header_len
+
+    def __str__(self):
+        return f'KonashiSPIFlash'
+
+    def __repr__(self):
+        return f'KonashiSPIFlash(address_bytes={self._address_bytes})'
+
+
+    async def read_jedec_id(self) -> Tuple[int, int, int]:
+        """Read the JEDEC ID of the flash.
+
+        Returns:
+            Tuple[int, int, int]: manufacturer, memory type, capacity.
+                int: The manufacturer ID.
+                int: The memory type.
+                int: The capacity code (the size is usually 2**capacity bytes).
+        """
+        res = await self._spi.transaction(bytes([SPI_FLASH_CMD_JEDEC_ID, 0, 0, 0]))
+        return (res[1], res[2], res[3])
+
+    def _frames(self, address: int, length: int) -> Iterator[Tuple[Tuple[int, int], None, bytes]]:
+        # one read command per chunk, the chip select is released between transactions
+        for offset in range(0, length, self._chunk_len):
+            size = min(self._chunk_len, length-offset)
+            header = bytes([SPI.KONASHI_CTL_CMD_SPI_DATA, self._read_cmd]) + (address+offset).to_bytes(self._address_bytes, 'big')
+            yield ((offset, size), None, header + bytes(size))
+
+    def _check_response(self, offset: int, size: int, res: bytes) -> None:
+        if len(res) < self._header_len+size:
+            raise KonashiError(f"The SPI transaction at offset {offset} returned {len(res)} bytes instead of {self._header_len+size}")
+
+    async def read(self, address: int, length: int, out: Optional[Union[bytearray, memoryview]]=None, window: int=4) -> Union[bytearray, memoryview]:
+        """Read a range of the flash.
+
+        Args:
+            address (int): The flash address to start reading at.
+            length (int): The number of bytes to read.
+            out (Optional[Union[bytearray, memoryview]], optional): A writable buffer of at least ``length`` bytes to read into, None to allocate one. Defaults to None.
+            window (int, optional): The maximum number of read commands in flight. Defaults to 4.
+
+        Raises:
+            ValueError: The range is invalid or the output buffer is too small.
+            TransferInterruptedError: An SPI transaction failed or returned less data than sent, the data before the ``offset`` attribute has been read.
+
+        Returns:
+            Union[bytearray, memoryview]: The read data (``out`` if given).
+        """
+        if address < 0 or length < 0 or address+length > (1<<(8*self._address_bytes)):
+            raise ValueError(f"The range does not fit in {self._address_bytes} address bytes")
+        if out is None:
+            out = bytearray(length)
+        dst = memoryview(out).cast('B')
+        if len(dst) < length:
+            raise ValueError("The output buffer is too small")
+        header_len = self._header_len
+        done = 0
+        def handle(chunk, res):
+            nonlocal done
+            offset, size = chunk
+            self._check_response(offset, size, res)
+            dst[offset:offset+size] = res[header_len:header_len+size]
+            done = offset+size
+        try:
+            await self._spi._pipeline(self._frames(address, length), window, handle)
+        except (KonashiError, KonashiConnectionError) as e:
+            raise TransferInterruptedError(f"The read was interrupted at offset {done}: {e}", done) from e
+        return out
+
+    async def dump(self, path: str, length: int, address: int=0, offset: int=0, reference: Optional[str]=None, window: int=4) -> SPIFlashDumpStats:
+        """Dump a range of the flash into a file, through a memory mapping of the file.
+        The file holds the range from ``address`` at file offset 0, and is extended to ``length`` bytes if needed.
+        A dump interrupted by an error can be resumed by calling again with the ``offset`` held by the ``TransferInterruptedError``.
+
+        Args:
+            path (str): The output file path.
+            length (int): The length of the range to dump in bytes.
+            address (int, optional): The flash address of the range. Defaults to 0.
+            offset (int, optional): The offset in the range to start (or resume) at. Defaults to 0.
+            reference (Optional[str], optional): A reference image file to verify the data against while dumping (same layout as the output file). Defaults to None.
+            window (int, optional): The maximum number of read commands in flight. Defaults to 4.
+
+        Raises:
+            ValueError: The range is invalid, or the reference image is too short.
+            TransferInterruptedError: An SPI transaction failed or returned less data than sent, the data before the ``offset`` attribute has been written to the file.
+
+        Returns:
+            SPIFlashDumpStats: The dumped length, the elapsed time in seconds, the throughput in bytes per second,
+                the number of bytes different from the reference and the offset of the first one.
+        """
+        if length <= 0 or offset < 0 or offset > length:
+            raise ValueError("The offset should be in the range [0,length] and the length positive")
+        if address < 0 or address+length > (1<<(8*self._address_bytes)):
+            raise ValueError(f"The range does not fit in {self._address_bytes} address bytes")
+        mode = "r+b" if os.path.exists(path) else "w+b"
+        with open(path, mode) as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < length:
+                f.truncate(length)
+            with mmap.mmap(f.fileno(), length) as mm:
+                ref_file = None
+                ref_map = None
+                try:
+                    if reference is not None:
+                        ref_file = open(reference, "rb")
+                        ref_map = mmap.mmap(ref_file.fileno(), 0, access=mmap.ACCESS_READ)
+                        if len(ref_map) < length:
+                            raise ValueError("The reference image is shorter than the dumped range")
+                    return await self._dump(mm, length, address, offset, ref_map, window)
+                finally:
+                    if ref_map is not None:
+                        ref_map.close()
+                    if ref_file is not None:
+                        ref_file.close()
+                    mm.flush()
+
+    async def _dump(self, mm: mmap.mmap, length: int, address: int, offset: int, ref_map: Optional[mmap.mmap], window: int) -> SPIFlashDumpStats:
+        dst = memoryview(mm)
+        header_len = self._header_len
+        done = offset
+        mismatches = 0
+        first_mismatch = None
+        def handle(chunk, res):
+            nonlocal done, mismatches, first_mismatch
+            chunk_offset, size = chunk
+            start = offset+chunk_offset
+            self._check_response(start, size, res)
+            data = res[header_len:header_len+size]
+            dst[start:start+size] = data
+            if ref_map is not None and ref_map[start:start+size] != data:
+                ref = ref_map[start:start+size]
+                diff = [i for i in range(size) if ref[i] != data[i]]
+                mismatches += len(diff)
+                if first_mismatch is None:
+                    first_mismatch = start+diff[0]
+            done = start+size
+        start_time = time.monotonic()
+        try:
+            await self._spi._pipeline(self._frames(address+offset, length-offset), window, handle)
+        except (KonashiError, KonashiConnectionError) as e:
+            raise TransferInterruptedError(f"The dump was interrupted at offset {done}: {e}", done) from e
+        finally:
+            dst.release()
+        elapsed = time.monotonic()-start_time
+        dumped = length-offset
+        return SPIFlashDumpStats(dumped, elapsed, dumped/elapsed if elapsed > 0 else 0.0, mismatches, first_mismatch)
@@ -10,6 +10,10 @@ from typing import *
 from enum import *
 
 from bleak import *
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from .. import KonashiElementBase
 from ..Errors import *
@@ -30,6 +34,7 @@ KONASHI_UUID_SOFTPWM_OUTPUT_GET = "064d0304-8251-49d9-b6f3-f7ba35e5d0a1"
 
 KONASHI_SOFTPWM_COUNT = 4
 KONASHI_SOFTPWM_PIN_TO_GPIO_NUM = [4, 5, 6, 7]
+_SOFTPWM_MASK_TO_GPIO_MASK = [sum(1<<KONASHI_SOFTPWM_PIN_TO_GPIO_NUM[i] for i in range(KONASHI_SOFTPWM_COUNT) if m&(1<<i)) for m in range(1<<KONASHI_SOFTPWM_COUNT)]
 class SoftPWMControlType(IntEnum):
     DISABLED = 0
     DUTY = 1
@@ -126,7 +131,8 @@ class _SoftPWM(KonashiElementBase._KonashiElementBase):
         self._config = _PinsConfig()
         self._output = _PinsControl()
         self._trans_end_cb = None
-        self._ongoing_control = []
+        self._trans_end_cbs = []
+        self._transitions = KonashiElementBase._TransitionTracker()
 
     def __str__(self):
         return f'KonashiSoftPWM'
@@ -150,10 +156,14 @@ class _SoftPWM(KonashiElementBase._KonashiElementBase):
         logger.debug("Received output data: {}".format("".join("{:02x}".format(x) for x in data)))
         self._output = _PinsControl.from_buffer_copy(data)
         for i in range(KONASHI_SOFTPWM_COUNT):
-            if i in self._ongoing_control and self._output[i].transition_duration == 0:
-                self._ongoing_control.remove(i)
+            future = self._transitions.end(i, self._output[i].control_value, self._output[i].transition_duration == 0)
+            if future is not None:
+                if not future.done():
+                    future.set_result(self._output[i].control_value)
                 if self._trans_end_cb is not None:
                     self._trans_end_cb(i, self._output[i].control_type, self._output[i].control_value)
+                for cb in list(self._trans_end_cbs):
+                    cb(i, self._output[i].control_type, self._output[i].control_value)
 
 
     async def config_pins(self, configs: Sequence(Tuple[int, SoftPWMPinConfig])) -> None:
@@ -168,14 +178,19 @@ class _SoftPWM(KonashiElementBase._KonashiElementBase):
         Raises:
             PinUnavailableError: At least one of the specified is already configured with another function.
         """
+        pin_bitmask = 0
+        enabled = 0
         b = bytearray([KONASHI_CFG_CMD_SOFTPWM])
         for config in configs:
+            pin_bitmask |= config[0]
+            if config[1].control_type != SoftPWMControlType.DISABLED:
+                enabled |= config[0]
             for i in range(KONASHI_SOFTPWM_COUNT):
                 if (config[0]&(1<<i)) > 0:
-                    if self._gpio._config[KONASHI_SOFTPWM_PIN_TO_GPIO_NUM[i]].function != int(GPIO.GPIOPinFunction.DISABLED) and self._gpio._config[KONASHI_SOFTPWM_PIN_TO_GPIO_NUM[i]].function != int(GPIO.GPIOPinFunction.PWM):
-                        raise PinUnavailableError(f'Pin {KONASHI_SOFTPWM_PIN_TO_GPIO_NUM[i]} is already configured as {GPIO._KONASHI_GPIO_FUNCTION_STR[self._gpio._config[KONASHI_SOFTPWM_PIN_TO_GPIO_NUM[i]].function]}')
                     b.extend(bytearray([(i<<4)|(bytes(config[1])[0])]) + bytearray(config[1])[1:3])
-        await self._write(KONASHI_UUID_CONFIG_CMD, b)
+        gpio_bitmask = _SOFTPWM_MASK_TO_GPIO_MASK[pin_bitmask&((1<<KONASHI_SOFTPWM_COUNT)-1)]
+        expected = _SOFTPWM_MASK_TO_GPIO_MASK[enabled&pin_bitmask&((1<<KONASHI_SOFTPWM_COUNT)-1)]
+        await self._gpio._pins.configure(gpio_bitmask, GPIO.GPIOPinFunction.PWM, expected, lambda: self._write(KONASHI_UUID_CONFIG_CMD, b))
 
     async def get_pins_config(self, pin_bitmask: int) -> List[SoftPWMPinConfig]:
         """Get the configuration of the specified pins.
@@ -205,8 +220,32 @@ class _SoftPWM(KonashiElementBase._KonashiElementBase):
         """
         self._trans_end_cb = notify_callback
 
-    async def control_pins(self, controls: Sequence(Tuple[int, SoftPWMPinControl])) -> None:
+    def add_transition_end_cb(self, notify_callback: Callable[[int, SoftPWMControlType, int], None]) -> None:
+        """Add a transition end callback function, called in addition to the one set with ``set_transition_end_cb``.
+
+        Args:
+            notify_callback (Callable[[int, SoftPWMControlType, int], None]): The callback function.
+                The function takes 3 parameters and returns nothing:
+                int: The pin number.
+                SoftPWMControlType: The pins control type.
+                int: The current control value.
+        """
+        self._trans_end_cbs.append(notify_callback)
+
+    def remove_transition_end_cb(self, notify_callback: Callable[[int, SoftPWMControlType, int], None]) -> None:
+        """Remove a transition end callback function added with ``add_transition_end_cb``.
+
+        Args:
+            notify_callback (Callable[[int, SoftPWMControlType, int], None]): The callback function.
+
+        Raises:
+            ValueError: The callback function was not added.
+        """
+        self._trans_end_cbs.remove(notify_callback)
+
+    async def control_pins(self, controls: Sequence(Tuple[int, SoftPWMPinControl])) -> Dict[int, asyncio.Future]:
         """Control Software PWM pins.
+        A transition still ongoing on a controlled pin is superseded, and its future is cancelled.
 
         Args:
             controls (Sequence[Tuple[int, SoftPWMPinControl]]): A list of pin controls.
@@ -217,14 +256,63 @@ class _SoftPWM(KonashiElementBase._KonashiElementBase):
         Raises:
             PinUnavailableError: At least one pin is not configured as a Software PWM pin.
             ValueError: The control value is out of range.
+
+        Returns:
+            Dict[int, asyncio.Future]: For each controlled pin number, a future resolved with the control value when the transition ends.
         """
-        ongoing_control = []
+        b, targets = self._encode_control(controls)
+        return await self._write_transitions(self._transitions, KONASHI_UUID_CONTROL_CMD, b, targets)
+
+    async def control_pins_array(self, pins: Sequence[int], values: Sequence[int], durations: Union[int, Sequence[int]]=0) -> Dict[int, asyncio.Future]:
+        """Control Software PWM pins from arrays of control values.
+        The values are validated vectorized against the control type of each pin, and encoded into a single control command.
+        Requires NumPy.
+
+        Args:
+            pins (Sequence[int]): The pin numbers (a NumPy array or any sequence), each pin at most once.
+            values (Sequence[int]): The control values, one per pin: the duty cycle in 0.1% (valid range is [0,1000]) for ``DUTY`` pins,
+                the period in milliseconds (valid range is [0,65535]) for ``PERIOD`` pins.
+            durations (Union[int, Sequence[int]], optional): The transition durations in milliseconds, one per pin or one for all. Defaults to 0.
+
+        Raises:
+            ImportError: NumPy is not installed.
+            ValueError: The arrays do not match or a pin is repeated.
+            ValuesOutOfRangeError: At least one pin number, control value or duration is out of range, the ``indices`` attribute holds their indices.
+            PinUnavailableError: At least one pin is not configured as a Software PWM pin, or is not enabled.
+
+        Returns:
+            Dict[int, asyncio.Future]: For each controlled pin number, a future resolved with the control value when the transition ends.
+        """
+        b, targets = self._encode_control_array(pins, values, durations)
+        return await self._write_transitions(self._transitions, KONASHI_UUID_CONTROL_CMD, b, targets)
+
+    def _encode_control_array(self, pins: Sequence[int], values: Sequence[int], durations: Union[int, Sequence[int]]) -> Tuple[bytearray, Dict[int, int]]:
+        self._require_numpy()
+        pins, durations = self._pin_control_arrays(pins, values, durations, KONASHI_SOFTPWM_COUNT)
+        values = np.asarray(values, dtype=np.float64)
+        pin_bitmask = int(np.bitwise_or.reduce(np.left_shift(1, pins.astype(np.int64)), initial=0))
+        self._gpio._pins.check_function(_SOFTPWM_MASK_TO_GPIO_MASK[pin_bitmask], GPIO.GPIOPinFunction.PWM)
+        control_types = np.array([self._config[i].control_type for i in range(KONASHI_SOFTPWM_COUNT)], dtype=np.uint8)[pins]
+        disabled = np.flatnonzero(control_types == int(SoftPWMControlType.DISABLED))
+        if disabled.size > 0:
+            raise PinUnavailableError(f'SoftPWM{pins[disabled[0]]} is not enabled')
+        # the upper limit depends on the control type of each pin
+        limits = np.where(control_types == int(SoftPWMControlType.DUTY), 1000, 65535)
+        self._check_array_range(values - limits, -np.inf, 0, "The valid range for the control value is [0,1000] (unit: 0.1%) for duty control and [0,65535] (unit: 1ms) for period control")
+        self._check_array_range(values, 0, np.inf, "The control value cannot be negative")
+        values = np.rint(values).astype(np.uint16)
+        return (self._pack_pin_controls(KONASHI_CTL_CMD_SOFTPWM, pins, values, durations), dict(zip(pins.tolist(), values.tolist())))
+
+    def _encode_control(self, controls: Sequence(Tuple[int, SoftPWMPinControl])) -> Tuple[bytearray, Dict[int, int]]:
+        pin_bitmask = 0
+        for control in controls:
+            pin_bitmask |= control[0]
+        self._gpio._pins.check_function(_SOFTPWM_MASK_TO_GPIO_MASK[pin_bitmask&((1<<KONASHI_SOFTPWM_COUNT)-1)], GPIO.GPIOPinFunction.PWM)
+        targets = {}
         b = bytearray([KONASHI_CTL_CMD_SOFTPWM])
         for control in controls:
             for i in range(KONASHI_SOFTPWM_COUNT):
                 if (control[0]&(1<<i)) > 0:
-                    if self._gpio._config[KONASHI_SOFTPWM_PIN_TO_GPIO_NUM[i]].function != int(GPIO.GPIOPinFunction.PWM):
-                        raise PinUnavailableError(f'Pin {KONASHI_SOFTPWM_PIN_TO_GPIO_NUM[i]} is not configured as PWM (configured as {GPIO._KONASHI_GPIO_FUNCTION_STR[self._gpio._config[KONASHI_SOFTPWM_PIN_TO_GPIO_NUM[i]].function]})')
                     if self._config[i].control_type == int(SoftPWMControlType.DUTY):
                         if control[1].control_value < 0 or control[1].control_value > 1000:
                             raise ValueError("The valid range for the duty cycle control is [0,1000] (unit: 0.1%)")
@@ -234,11 +322,8 @@ class _SoftPWM(KonashiElementBase._KonashiElementBase):
                     else:
                         raise PinUnavailableError(f'SoftPWM{i} is not enabled')
                     b.extend(bytearray([i])+(bytearray(control[1])[1:]))
-                    ongoing_control.append(i)
-        await self._write(KONASHI_UUID_CONTROL_CMD, b)
-        for i in ongoing_control:
-            if i not in self._ongoing_control:
-                self._ongoing_control.append(i)
+                    targets[i] = control[1].control_value
+        return (b, targets)
 
     async def get_pins_control(self, pin_bitmask: int) -> List[SoftPWMPinControl]:
         """Get the output control of the specified pins.
@@ -3,6 +3,7 @@
 from __future__ import annotations
 
 import asyncio
+import collections
 import struct
 import logging
 from ctypes import *
@@ -13,6 +14,7 @@ from bleak import *
 
 from .. import KonashiElementBase
 from ..Errors import *
+from ..Stats import LatencyStats
 
 
 logger = logging.getLogger(__name__)
@@ -28,6 +30,9 @@ KONASHI_UUID_UART_DATA_IN = "064d0309-8251-49d9-b6f3-f7ba35e5d0a1"
 KONASHI_UUID_UART_DATA_SEND_DONE = "064d030a-8251-49d9-b6f3-f7ba35e5d0a1"
 
 
+KONASHI_UART_MAX_SEND_LEN = 127
+
+
 class UARTParity(IntEnum):
     NONE = 0
     ODD = 1
@@ -85,13 +90,532 @@ class UARTConfig(LittleEndianStructure):
         return s
 
 
+class UARTStreamReader:
+    """UART receive stream with the interface of ``asyncio.StreamReader``, over a fixed-capacity ring buffer.
+    The received data is copied once into the ring buffer. When the buffer is full, the data that does not fit is dropped and counted.
+    Reads return a ``memoryview`` of the ring buffer when the data is contiguous, and a ``bytes`` copy when it wraps around.
+    A returned view stays valid until the next read on the stream, or until the received data needs its space: the view is then released
+    (using it raises ``ValueError``), so it never shows overwritten data. Copy the data to keep it.
+    When the buffer is full of unread data, the data that does not fit is dropped, counted in ``dropped`` and logged.
+    As with ``asyncio.StreamReader``, only one coroutine can wait for data at a time.
+    The stream fails with ``KonashiConnectionError`` when the device disconnects or reconnects.
+    Use ``create_reader`` of the UART interface to create one.
+    """
+    def __init__(self, uart, capacity: int=4096) -> None:
+        """Constructor.
+
+        Args:
+            uart: The UART interface.
+            capacity (int, optional): The ring buffer capacity in bytes. Defaults to 4096.
+
+        Raises:
+            ValueError: The capacity is out of range.
+        """
+        if capacity < 1:
+            raise ValueError("The capacity should be at least 1 byte")
+        self._uart = uart
+        self._loop = None
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._head = 0
+        self._size = 0
+        self._release = 0
+        self._outstanding = None
+        self._data_event = None
+        self._waiting = False
+        self._eof = False
+        self._exception = None
+        self._received = 0
+        self._overflows = 0
+        self._dropped = 0
+        self._high_water = 0
+
+    def __str__(self):
+        return f'KonashiUARTStreamReader(buffered={self._size-self._release}, dropped={self._dropped})'
+
+    def __repr__(self):
+        return f'KonashiUARTStreamReader(capacity={len(self._buf)})'
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Union[memoryview, bytes]:
+        line = await self.readline()
+        if len(line) == 0:
+            raise StopAsyncIteration
+        return line
+
+
+    def _bind(self) -> asyncio.AbstractEventLoop:
+        # bound lazily to the loop running the reads, and rebound when used from a new loop
+        loop = asyncio.get_event_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._data_event = None
+        return loop
+
+    def _notify(self, data: bytes) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            loop = self._bind()
+        loop.call_soon_threadsafe(self.feed_data, data)
+
+    def _wake(self) -> None:
+        if self._data_event is not None:
+            self._data_event.set()
+
+    async def _wait(self, func_name: str) -> None:
+        if self._waiting:
+            raise RuntimeError(f"{func_name}() called while another coroutine is already waiting for incoming data")
+        if self._exception is not None:
+            raise self._exception
+        if self._eof:
+            return
+        self._bind()
+        if self._data_event is None:
+            self._data_event = asyncio.Event()
+        self._data_event.clear()
+        self._waiting = True
+        try:
+            await self._data_event.wait()
+        finally:
+            self._waiting = False
+        if self._exception is not None:
+            raise self._exception
+
+    def _free_released(self) -> None:
+        # the space of the previous read is reused from now on
+        capacity = len(self._buf)
+        self._head = (self._head+self._release)%capacity
+        self._size -= self._release
+        self._release = 0
+        self._outstanding = None
+
+    def _reclaim(self) -> None:
+        # the space of the last read is needed before the next read: its view is released so it cannot show the new data
+        if self._outstanding is not None:
+            try:
+                self._outstanding.release()
+            except BufferError:
+                # the view is exported (to a NumPy array for instance), its space cannot be reused
+                return
+        self._free_released()
+
+    def _take(self, n: int) -> Union[memoryview, bytes]:
+        capacity = len(self._buf)
+        end = self._head+n
+        if end <= capacity:
+            data = self._view[self._head:end]
+            self._outstanding = data
+        else:
+            data = bytes(self._view[self._head:])+bytes(self._view[:end-capacity])
+            self._outstanding = None
+        self._release = n
+        return data
+
+    def _find(self, separator: bytes, start: int) -> int:
+        # offset of the separator from the read position, searching the two spans of the ring and the seam between them
+        capacity = len(self._buf)
+        first = min(self._size, capacity-self._head)
+        second = self._size-first
+        idx = self._buf.find(separator, self._head+start, self._head+first)
+        if idx >= 0:
+            return idx-self._head
+        if second == 0:
+            return -1
+        k = len(separator)-1
+        if k > 0:
+            seam_start = max(first-k, start)
+            seam = bytes(self._view[self._head+seam_start:]) + bytes(self._view[:min(k, second)])
+            idx = seam.find(separator)
+            if idx >= 0:
+                return seam_start+idx
+        idx = self._buf.find(separator, max(start-first, 0), second)
+        if idx >= 0:
+            return first+idx
+        return -1
+
+    def feed_data(self, data: bytes) -> None:
+        """Append received data to the ring buffer. Called for each UART data in notification.
+
+        Args:
+            data (bytes): The received data.
+        """
+        capacity = len(self._buf)
+        if len(data) > capacity-self._size and self._release > 0:
+            self._reclaim()
+        n = min(len(data), capacity-self._size)
+        if n < len(data):
+            self._overflows += 1
+            self._dropped += len(data)-n
+            logger.warning("UART reader buffer full, dropped {} bytes".format(len(data)-n))
+        if n > 0:
+            tail = (self._head+self._size)%capacity
+            first = min(n, capacity-tail)
+            self._view[tail:tail+first] = data[:first]
+            if n > first:
+                self._view[:n-first] = data[first:n]
+            self._size += n
+            self._received += n
+            self._high_water = max(self._high_water, self._size)
+            self._wake()
+
+    def feed_eof(self) -> None:
+        """Mark the end of the stream, pending and following reads return the remaining data.
+        """
+        self._eof = True
+        self._wake()
+
+    def at_eof(self) -> bool:
+        """True if the end of the stream was reached and the buffer is empty.
+        """
+        return self._eof and self._size == self._release
+
+    def exception(self) -> Optional[BaseException]:
+        """The exception set on the stream, if any.
+        """
+        return self._exception
+
+    def set_exception(self, exc: BaseException) -> None:
+        """Fail the pending and following reads.
+
+        Args:
+            exc (BaseException): The exception raised by the reads.
+        """
+        self._exception = exc
+        self._wake()
+
+    async def read(self, n: int=-1) -> Union[memoryview, bytes]:
+        """Read up to n bytes.
+        With n > 0, the contiguous data available is returned without copy, so the read can return less than the available data when it wraps around.
+
+        Args:
+            n (int, optional): The maximum number of bytes, -1 to read until the end of the stream. Defaults to -1.
+
+        Raises:
+            RuntimeError: Another coroutine is already waiting for data on the stream.
+
+        Returns:
+            Union[memoryview, bytes]: The data, empty at the end of the stream.
+        """
+        self._free_released()
+        if n == 0:
+            return b''
+        if n < 0:
+            chunks = []
+            while True:
+                block = await self.read(len(self._buf))
+                if len(block) == 0:
+                    return b''.join(chunks)
+                chunks.append(bytes(block))
+        while self._size == 0 and not self._eof:
+            await self._wait('read')
+        if self._exception is not None:
+            raise self._exception
+        return self._take(min(n, self._size, len(self._buf)-self._head))
+
+    async def readexactly(self, n: int) -> Union[memoryview, bytes]:
+        """Read exactly n bytes.
+
+        Args:
+            n (int): The number of bytes, at most the buffer capacity.
+
+        Raises:
+            ValueError: n is out of range.
+            RuntimeError: Another coroutine is already waiting for data on the stream.
+            asyncio.IncompleteReadError: The end of the stream was reached before n bytes.
+
+        Returns:
+            Union[memoryview, bytes]: The data.
+        """
+        if n < 0 or n > len(self._buf):
+            raise ValueError(f"The read length should be in the range [0,{len(self._buf)}]")
+        self._free_released()
+        while self._size < n:
+            if self._eof:
+                partial = bytes(self._take(self._size))
+                raise asyncio.IncompleteReadError(partial, n)
+            await self._wait('readexactly')
+        return self._take(n)
+
+    async def readuntil(self, separator: bytes=b'\n') -> Union[memoryview, bytes]:
+        """Read until the separator is found. The returned data includes the separator.
+
+        Args:
+            separator (bytes, optional): The separator. Defaults to b'\\n'.
+
+        Raises:
+            ValueError: The separator is empty.
+            RuntimeError: Another coroutine is already waiting for data on the stream.
+            asyncio.LimitOverrunError: The buffer is full without the separator. The data is left in the buffer.
+            asyncio.IncompleteReadError: The end of the stream was reached before the separator. The data is consumed.
+
+        Returns:
+            Union[memoryview, bytes]: The data.
+        """
+        if len(separator) == 0:
+            raise ValueError("The separator should be at least one byte")
+        self._free_released()
+        start = 0
+        while True:
+            idx = self._find(separator, start)
+            if idx >= 0:
+                return self._take(idx+len(separator))
+            start = max(self._size-len(separator)+1, 0)
+            if self._size == len(self._buf):
+                raise asyncio.LimitOverrunError("The separator was not found and the buffer is full", self._size)
+            if self._eof:
+                partial = bytes(self._take(self._size))
+                raise asyncio.IncompleteReadError(partial, None)
+            await self._wait('readuntil')
+
+    async def readline(self) -> Union[memoryview, bytes]:
+        """Read one line, ending with b'\\n'.
+        At the end of the stream, the remaining data is returned without line end.
+
+        Raises:
+            ValueError: The buffer is full without line end. The buffer is cleared.
+
+        Returns:
+            Union[memoryview, bytes]: The line, empty at the end of the stream.
+        """
+        try:
+            return await self.readuntil(b'\n')
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+        except asyncio.LimitOverrunError as e:
+            self._release = self._size
+            raise ValueError(e.args[0])
+
+    @property
+    def buffered(self) -> int:
+        """The number of bytes waiting to be read.
+        """
+        return self._size-self._release
+
+    @property
+    def received(self) -> int:
+        """The number of bytes stored in the buffer since creation.
+        """
+        return self._received
+
+    @property
+    def overflows(self) -> int:
+        """The number of notifications truncated because the buffer was full.
+        """
+        return self._overflows
+
+    @property
+    def dropped(self) -> int:
+        """The number of bytes dropped because the buffer was full.
+        """
+        return self._dropped
+
+    @property
+    def high_water(self) -> int:
+        """The highest buffer fill in bytes.
+        """
+        return self._high_water
+
+    def close(self) -> None:
+        """Stop receiving data and mark the end of the stream.
+        """
+        self._uart._remove_reader(self)
+        self.feed_eof()
+
+
+class UARTStreamWriter:
+    """UART transmit stream with the interface of ``asyncio.StreamWriter``.
+    The written data is buffered and sent in the background in chunks of at most 127 bytes, in write order, with up to ``window`` chunks
+    waiting for their send done notification.
+    ``drain`` waits while more than ``high_water`` bytes are pending, until the pending data goes down to a quarter of it.
+    A send failure stops the stream and is raised by the following ``drain`` or ``wait_closed``.
+    Use ``create_writer`` of the UART interface to create one.
+    """
+    def __init__(self, uart, window: int=4, high_water: int=4096) -> None:
+        """Constructor.
+
+        Args:
+            uart: The UART interface.
+            window (int, optional): The maximum number of chunks in flight. Defaults to 4.
+            high_water (int, optional): The number of pending bytes above which ``drain`` waits. Defaults to 4096.
+
+        Raises:
+            ValueError: The window or the high water mark is out of range.
+        """
+        if window < 1:
+            raise ValueError("The window should be at least 1")
+        if high_water < 0:
+            raise ValueError("The high water mark cannot be negative")
+        self._uart = uart
+        self._window = window
+        self._high_water = high_water
+        self._low_water = high_water//4
+        self._buffer = bytearray()
+        self._in_flight = 0
+        self._task = None
+        self._wakeup = None
+        self._drained = None
+        self._closing = False
+        self._exception = None
+        self._bytes_sent = 0
+        self._busy_time = 0.0
+
+    def __str__(self):
+        return f'KonashiUARTStreamWriter(sent={self._bytes_sent}, pending={self.get_write_buffer_size()})'
+
+    def __repr__(self):
+        return f'KonashiUARTStreamWriter(window={self._window}, high_water={self._high_water})'
+
+
+    def _next_chunk(self) -> Tuple[int, bytes]:
+        chunk = bytes(self._buffer[:KONASHI_UART_MAX_SEND_LEN])
+        del self._buffer[:KONASHI_UART_MAX_SEND_LEN]
+        self._in_flight += len(chunk)
+        return (len(chunk), bytes([KONASHI_CTL_CMD_UART_DATA]) + chunk)
+
+    def _handle(self, size: int, res: bytes) -> None:
+        self._in_flight -= size
+        if not (len(res) == 1 and res[0] == 0x01):
+            raise KonashiError(f"UART send failed after {self._bytes_sent} bytes")
+        self._bytes_sent += size
+        self._wake_drain()
+
+    def _wake_drain(self) -> None:
+        if self._drained is not None and (self.get_write_buffer_size() <= self._low_water or self._exception is not None):
+            self._drained.set()
+
+    async def _run(self) -> None:
+        # the chunks are written in order (the requests hold the send queue lock while writing), only their send done waits overlap
+        loop = asyncio.get_event_loop()
+        pending = collections.deque()
+        start = loop.time()
+        try:
+            while len(self._buffer) > 0 or len(pending) > 0:
+                while len(self._buffer) > 0 and len(pending) < self._window:
+                    size, frame = self._next_chunk()
+                    pending.append((size, loop.create_task(self._uart._request(frame))))
+                # the data written meanwhile is sent as soon as the window has room
+                self._wakeup = loop.create_future()
+                await asyncio.wait([pending[0][1], self._wakeup], return_when=asyncio.FIRST_COMPLETED)
+                while len(pending) > 0 and pending[0][1].done():
+                    size, task = pending.popleft()
+                    self._handle(size, task.result())
+        except Exception as e:
+            self._exception = e
+            self._buffer.clear()
+            self._in_flight = 0
+        finally:
+            for size, task in pending:
+                task.cancel()
+                task.add_done_callback(KonashiElementBase._retrieve_exception)
+            self._wakeup = None
+            self._busy_time += loop.time()-start
+            self._task = None
+            self._wake_drain()
+
+    def write(self, data: bytes) -> None:
+        """Buffer data to send. The data is sent in the background.
+
+        Args:
+            data (bytes): The data (any bytes-like object).
+
+        Raises:
+            KonashiError: The writer is closed or a previous send failed.
+        """
+        if self._closing:
+            raise KonashiError("The writer is closed")
+        if self._exception is not None:
+            raise self._exception
+        if len(data) == 0:
+            return
+        self._buffer += data
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+        elif self._wakeup is not None and not self._wakeup.done():
+            self._wakeup.set_result(None)
+
+    def writelines(self, data: Iterable[bytes]) -> None:
+        """Buffer a list of data to send.
+
+        Args:
+            data (Iterable[bytes]): The data.
+        """
+        for d in data:
+            self.write(d)
+
+    async def drain(self) -> None:
+        """Wait until the pending data goes down to the low water mark, if it is above the high water mark.
+
+        Raises:
+            KonashiError: A send failed.
+        """
+        if self._exception is None and self.get_write_buffer_size() > self._high_water:
+            if self._drained is None:
+                self._drained = asyncio.Event()
+            self._drained.clear()
+            await self._drained.wait()
+        if self._exception is not None:
+            raise self._exception
+
+    def can_write_eof(self) -> bool:
+        """The UART has no end of stream, always False.
+        """
+        return False
+
+    def get_extra_info(self, name: str, default: Any=None) -> Any:
+        """No transport information is available, always returns the default.
+        """
+        return default
+
+    def close(self) -> None:
+        """Close the writer. The buffered data is still sent.
+        """
+        self._closing = True
+
+    def is_closing(self) -> bool:
+        """True if the writer is closed or closing.
+        """
+        return self._closing
+
+    async def wait_closed(self) -> None:
+        """Wait until the buffered data is sent.
+
+        Raises:
+            KonashiError: A send failed.
+        """
+        while self._task is not None:
+            await asyncio.shield(self._task)
+        if self._exception is not None:
+            raise self._exception
+
+    def get_write_buffer_size(self) -> int:
+        """The number of bytes buffered or in flight.
+        """
+        return len(self._buffer)+self._in_flight
+
+    @property
+    def bytes_sent(self) -> int:
+        """The number of bytes sent and acknowledged.
+        """
+        return self._bytes_sent
+
+    @property
+    def throughput(self) -> float:
+        """The send rate in bytes per second, over the time spent sending.
+        """
+        if self._busy_time <= 0:
+            return 0.0
+        return self._bytes_sent/self._busy_time
+
+
 class _UART(KonashiElementBase._KonashiElementBase):
     def __init__(self, konashi) -> None:
         super().__init__(konashi)
         self._config = UARTConfig(False, 0, UARTParity.NONE, UARTStopBits.ONE)
-        self._async_loop = None
-        self._send_done_future = None
+        self._send_done = KonashiElementBase._ResponseQueue()
         self._data_in_cb = None
+        self._readers = []
 
     def __str__(self):
         return f'KonashiUART'
@@ -101,6 +625,8 @@ class _UART(KonashiElementBase._KonashiElementBase):
 
 
     async def _on_connect(self) -> None:
+        self._send_done.clear()
+        self._fail_readers("The connection was reset")
         await self._enable_notify(KONASHI_UUID_UART_CONFIG_GET, self._ntf_cb_config)
         await self._read(KONASHI_UUID_UART_CONFIG_GET)
         await self._enable_notify(KONASHI_UUID_UART_DATA_IN, self._ntf_cb_data_in)
@@ -113,13 +639,14 @@ class _UART(KonashiElementBase._KonashiElementBase):
 
     def _ntf_cb_data_in(self, sender, data):
         logger.debug("Received input data: {}".format("".join("{:02x}".format(x) for x in data)))
+        for reader in self._readers:
+            reader._notify(data)
         if self._data_in_cb is not None:
             self._data_in_cb(data)
 
     def _ntf_cb_send_done(self, sender, data):
         logger.debug("Received send done data: {}".format("".join("{:02x}".format(x) for x in data)))
-        if self._async_loop is not None and self._send_done_future is not None:
-            self._async_loop.call_soon_threadsafe(self._send_done_future.set_result, data)
+        self._send_done.notify(data)
 
 
     async def config(self, config: UARTConfig) -> None:
@@ -150,30 +677,86 @@ class _UART(KonashiElementBase._KonashiElementBase):
         """
         self._data_in_cb = callback
 
-    async def send(self, write_data: bytes) -> bool:
+    async def _request(self, frame: bytes, key=None, timeout: Optional[float]=None) -> bytes:
+        return await self._request_response(self._send_done, KONASHI_UUID_CONTROL_CMD, frame, timeout=timeout)
+
+    async def send(self, write_data: bytes, timeout: Optional[float]=None) -> bool:
         """Send UART data.
+        Sends can be called concurrently: they are sent in call order and each send done notification is matched to its send.
 
         Args:
             write_data (bytes): The data to send (length range is [1,127]).
+            timeout (Optional[float], optional): The time in seconds to wait for the send done notification, None to wait without limit. Defaults to None.
 
         Raises:
             ValueError: The write data length is out of range.
+            asyncio.TimeoutError: The send done notification did not come within the timeout.
+            KonashiConnectionError: The connection was lost before the send done notification.
 
         Returns:
             bool: True if successful, False otherwise.
         """
         if len(write_data) == 0:
             raise ValueError("Write data buffer cannot be empty")
-        if len(write_data) > 127:
+        if len(write_data) > KONASHI_UART_MAX_SEND_LEN:
             raise ValueError("Maximum write data length is 127 bytes")
         b = bytearray([KONASHI_CTL_CMD_UART_DATA]) + bytearray(write_data)
-        self._async_loop = asyncio.get_event_loop()
-        self._send_done_future = self._async_loop.create_future()
-        await self._write(KONASHI_UUID_CONTROL_CMD, b)
-        res = await self._send_done_future
-        self._async_loop = None
-        self._send_done_future = None
+        res = await self._request(b, timeout=timeout)
         if len(res) == 1 and res[0] == 0x01:
             return True
         else:
             return False
+
+    def create_reader(self, capacity: int=4096) -> UARTStreamReader:
+        """Create a UART receive stream with the interface of ``asyncio.StreamReader``.
+        The stream receives the data from its creation until it is closed, alongside the data in callback.
+        It is bound to the current connection: create it once connected, it fails with ``KonashiConnectionError`` on disconnection or reconnection.
+        The data returned by a read is only guaranteed until the next read: when the received data needs its space before, the returned view is released.
+
+        Args:
+            capacity (int, optional): The ring buffer capacity in bytes. Defaults to 4096.
+
+        Returns:
+            UARTStreamReader: The reader.
+        """
+        reader = UARTStreamReader(self, capacity)
+        self._readers.append(reader)
+        return reader
+
+    def _fail_readers(self, message: str) -> None:
+        # the data received on another connection does not follow the data already read
+        for reader in self._readers:
+            reader.set_exception(KonashiConnectionError(message))
+        self._readers.clear()
+
+    def _on_disconnect(self) -> None:
+        self._send_done.fail(KonashiConnectionError("The connection was closed"))
+        self._fail_readers("The connection was closed")
+
+    def _remove_reader(self, reader: UARTStreamReader) -> None:
+        if reader in self._readers:
+            self._readers.remove(reader)
+
+    def create_writer(self, window: int=4, high_water: int=4096) -> UARTStreamWriter:
+        """Create a UART transmit stream with the interface of ``asyncio.StreamWriter``.
+
+        Args:
+            window (int, optional): The maximum number of chunks in flight. Defaults to 4.
+            high_water (int, optional): The number of pending bytes above which ``drain`` waits. Defaults to 4096.
+
+        Returns:
+            UARTStreamWriter: The writer.
+        """
+        return UARTStreamWriter(self, window, high_water)
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of sends waiting for their send done notification.
+        """
+        return self._send_done.depth
+
+    @property
+    def latency(self) -> LatencyStats:
+        """The send latency, from the command write to the send done notification.
+        """
+        return self._send_done.latency
@@ -9,6 +9,7 @@ from . import AIO
 from . import I2C
 from . import UART
 from . import SPI
+from . import Reflex
 
 
 class _Io:
@@ -20,6 +21,7 @@ class _Io:
         self._i2c = I2C._I2C(konashi, self._gpio)
         self._uart = UART._UART(konashi)
         self._spi = SPI._SPI(konashi, self._gpio)
+        self._reflex = Reflex._Reflex(konashi, self._gpio, self._analog)
 
     @property
     def gpio(self) -> GPIO._GPIO:
@@ -63,6 +65,12 @@ class _Io:
         """
         return self._spi
 
+    @property
+    def reflex(self) -> Reflex._Reflex:
+        """This Konashi devices reflex rules interface.
+        """
+        return self._reflex
+
     async def _on_connect(self):
         await self._gpio._on_connect()
         await self._softpwm._on_connect()
@@ -71,3 +79,10 @@ class _Io:
         await self._i2c._on_connect()
         await self._uart._on_connect()
         await self._spi._on_connect()
+        await self._reflex._on_connect()
+
+    def _on_disconnect(self):
+        self._i2c._on_disconnect()
+        self._uart._on_disconnect()
+        self._spi._on_disconnect()
+        self._reflex._on_disconnect()
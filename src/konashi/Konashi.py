@@ -78,7 +78,7 @@ class Konashi:
             except InvalidDeviceError:
                 raise
         if self._ble_client is None:
-            self._ble_client = BleakClient(self._ble_dev.address)
+            self._ble_client = BleakClient(self._ble_dev.address, disconnected_callback=self._on_ble_disconnect)
         try:
             logger.debug("Connect to device {}".format(self._name))
             if not timeout > 0.0:
@@ -92,12 +92,18 @@ class Konashi:
             await self._io._on_connect()
             await self._builtin._on_connect()
 
+    def _on_ble_disconnect(self, client) -> None:
+        # the link was lost: the requests waiting for a response would never get it
+        logger.debug("Disconnected from device {}".format(self._name))
+        self._io._on_disconnect()
+
     async def disconnect(self) -> None:
         """Disconnect from this Konashi device.
         """
         if self._ble_client is not None:
             await self._ble_client.disconnect()
             self._ble_client = None
+            self._io._on_disconnect()
 
     @property
     def settings(self) -> _Settings:
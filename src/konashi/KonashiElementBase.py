@@ -9,16 +9,168 @@ from ctypes import *
 from typing import *
 from enum import *
 import abc
+import collections
+import time
 
 from bleak import *
 from bleak.exc import BleakDBusError
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 from .Errors import *
+from .Stats import LatencyStats
 
 
 logger = logging.getLogger(__name__)
 
 
+class _PendingResponse:
+    def __init__(self, key, future: asyncio.Future) -> None:
+        self.key = key
+        self.future = future
+        self.time = time.monotonic()
+
+
+class _ResponseQueue:
+    """FIFO of the requests waiting for a notified response.
+    The firmware answers the requests in order. A request cancelled after its command was written stays in the queue until its
+    response arrives, so it cannot take the response of the next request. A request whose command was not written is removed. When the responses carry a key (``key_of``), a response is
+    matched to the oldest request with the same key, and the live requests before it are failed as their responses were lost.
+    """
+    def __init__(self, key_of: Optional[Callable[[bytes], Any]]=None) -> None:
+        self._key_of = key_of
+        self._entries = collections.deque()
+        self._loop = None
+        self._lock = None
+        self._latency = LatencyStats()
+
+    def _bind(self) -> asyncio.AbstractEventLoop:
+        # bound lazily to the loop running the requests, and rebound when used from a new loop
+        loop = asyncio.get_event_loop()
+        if self._loop is not loop:
+            # the requests of the previous loop cannot be answered anymore
+            self._entries.clear()
+            self._loop = loop
+            self._lock = asyncio.Lock()
+        return loop
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        # held from the push to the end of the write, so the requests are written in push order
+        self._bind()
+        return self._lock
+
+    def push(self, key=None) -> _PendingResponse:
+        entry = _PendingResponse(key, self._bind().create_future())
+        self._entries.append(entry)
+        return entry
+
+    def discard(self, entry: _PendingResponse) -> None:
+        # the request was not sent, no response will come for it
+        try:
+            self._entries.remove(entry)
+        except ValueError:
+            pass
+        entry.future.cancel()
+
+    def notify(self, data: bytes) -> None:
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._resolve, bytes(data))
+
+    def _resolve(self, data: bytes) -> None:
+        if self._key_of is None:
+            index = 0 if len(self._entries) > 0 else None
+        else:
+            key = self._key_of(data)
+            index = next((i for i, e in enumerate(self._entries) if e.key == key), None)
+        if index is None:
+            logger.warning("Received an unexpected response: {}".format("".join("{:02x}".format(x) for x in data)))
+            return
+        for i in range(index):
+            entry = self._entries.popleft()
+            if not entry.future.done():
+                entry.future.set_exception(KonashiError("The response to the request was lost"))
+        entry = self._entries.popleft()
+        if not entry.future.done():
+            entry.future.set_result(data)
+            self._latency.record(time.monotonic()-entry.time)
+
+    def fail(self, exc: BaseException) -> None:
+        # no response will come anymore: the pending requests raise exc
+        for entry in self._entries:
+            if not entry.future.done():
+                entry.future.set_exception(exc)
+        self._entries.clear()
+
+    def clear(self) -> None:
+        self.fail(KonashiConnectionError("The connection was reset"))
+
+    @property
+    def depth(self) -> int:
+        return sum(1 for e in self._entries if not e.future.done())
+
+    @property
+    def latency(self) -> LatencyStats:
+        return self._latency
+
+
+class _TransitionTracker:
+    """Futures of the output transitions in progress, resolved from the output notifications.
+    A transition is registered with its commanded value before the control write, as its end can be notified before the write returns.
+    It only ends on a notification of the commanded value with no transition left, so an output state notified meanwhile
+    (the stale state pushed when another pin is controlled for instance) does not end it early.
+    """
+    def __init__(self) -> None:
+        self._transitions = {}
+
+    def register(self, key, target, future: asyncio.Future) -> None:
+        # a transition still in progress on the same output is superseded
+        previous = self._transitions.get(key)
+        if previous is not None and previous[1] is not future:
+            previous[1].cancel()
+        self._transitions[key] = (target, future)
+
+    def start(self, targets: Dict[Any, Any]) -> Dict[Any, asyncio.Future]:
+        loop = asyncio.get_event_loop()
+        futures = {}
+        for key, target in targets.items():
+            futures[key] = loop.create_future()
+            self.register(key, target, futures[key])
+        return futures
+
+    def forget(self, key, future: asyncio.Future) -> None:
+        transition = self._transitions.get(key)
+        if transition is not None and transition[1] is future:
+            del self._transitions[key]
+
+    def cancel(self, futures: Dict[Any, asyncio.Future]) -> None:
+        for key, future in futures.items():
+            self.forget(key, future)
+            future.cancel()
+
+    def end(self, key, value, idle: bool=True) -> Optional[asyncio.Future]:
+        # the future of the transition ended by this output state, None if it is not the commanded one
+        transition = self._transitions.get(key)
+        if transition is None or not idle or value != transition[0]:
+            return None
+        del self._transitions[key]
+        return transition[1]
+
+
+def _retrieve_exception(task: asyncio.Future) -> None:
+    # the result of an abandoned request is not awaited, its failure is not an unhandled error
+    if not task.cancelled():
+        task.exception()
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError("NumPy is required for array operations (pip install konashi[numpy])")
+
+
 class _KonashiElementBase:
     def __init__(self, konashi):
         self._konashi = konashi
@@ -91,6 +243,87 @@ class _KonashiElementBase:
         except BleakError as e:
             raise KonashiError(f'Error occured during BLE notify stop: "{str(e)}"')
 
+    async def _request_response(self, responses: _ResponseQueue, uuid: str, frame: bytes, key=None, timeout: Optional[float]=None) -> bytes:
+        # registered before the write, the response can come before the write returns
+        async with responses.lock:
+            entry = responses.push(key)
+            try:
+                await self._write(uuid, frame)
+            except:
+                # the write did not complete, an entry left in the queue would take the response of the next request
+                responses.discard(entry)
+                raise
+        # on timeout or cancellation the command was sent, the cancelled entry stays to absorb its response
+        return await asyncio.wait_for(entry.future, timeout)
+
+    async def _write_transitions(self, transitions: _TransitionTracker, uuid: str, frame: bytes, targets: Dict[Any, Any]) -> Dict[Any, asyncio.Future]:
+        futures = transitions.start(targets)
+        try:
+            await self._write(uuid, frame)
+        except:
+            transitions.cancel(futures)
+            raise
+        return futures
+
+    async def _pipeline(self, frames: Iterable[Tuple[Any, Any, bytes]], window: int, handle: Callable[[Any, bytes], None], request: Optional[Callable[[bytes, Any], Awaitable[Any]]]=None) -> None:
+        # up to window requests in flight (sent through request, the element's _request by default), the responses are handled in order
+        if window < 1:
+            raise ValueError("The pipeline window should be at least 1")
+        if request is None:
+            request = self._request
+        loop = asyncio.get_event_loop()
+        pending = collections.deque()
+        try:
+            for tag, key, frame in frames:
+                if len(pending) >= window:
+                    tag0, task = pending.popleft()
+                    handle(tag0, await task)
+                pending.append((tag, loop.create_task(request(frame, key))))
+            while len(pending) > 0:
+                tag0, task = pending.popleft()
+                handle(tag0, await task)
+        finally:
+            for tag0, task in pending:
+                task.cancel()
+                task.add_done_callback(_retrieve_exception)
+
+    @staticmethod
+    def _require_numpy() -> None:
+        _require_numpy()
+
+    @staticmethod
+    def _check_array_range(values, low: float, high: float, message: str) -> None:
+        out_of_range = np.flatnonzero(~((values >= low) & (values <= high)))
+        if out_of_range.size > 0:
+            shown = ", ".join(str(i) for i in out_of_range[:10])
+            if out_of_range.size > 10:
+                shown += ", ..."
+            raise ValuesOutOfRangeError(f"{message} (out of range at indices {shown})", out_of_range)
+
+    @staticmethod
+    def _pin_control_arrays(pins, values, durations, pin_count: int) -> Tuple[Any, Any]:
+        pins = np.asarray(pins)
+        if pins.ndim != 1:
+            raise ValueError("The pins should be a one-dimensional array")
+        _KonashiElementBase._check_array_range(pins, 0, pin_count-1, f"The pin number should be in the range [0,{pin_count-1}]")
+        if np.unique(pins).size != pins.size:
+            raise ValueError("A pin can only be controlled once per command")
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape != pins.shape:
+            raise ValueError("The values should have one element per pin")
+        durations = np.broadcast_to(np.asarray(durations, dtype=np.int64), pins.shape)
+        _KonashiElementBase._check_array_range(durations, 0, 4294967295, "The valid range for the transition duration is [0,4294967295] (unit: 1ms)")
+        return (pins.astype(np.uint8), durations)
+
+    @staticmethod
+    def _pack_pin_controls(cmd: int, pins, values, durations) -> bytearray:
+        # one (pin, value, duration) record per pin, laid out as the firmware control command
+        records = np.empty(len(pins), dtype=[('pin', 'u1'), ('value', '<u2'), ('duration', '<u4')])
+        records['pin'] = pins
+        records['value'] = values
+        records['duration'] = durations
+        return bytearray([cmd]) + records.tobytes()
+
     @abc.abstractmethod
     async def _on_connect(self) -> None:
         pass
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import bisect
+import math
+from typing import *
+
+
+class LatencyStats:
+    """Running latency statistics (count, mean, min, max and last value), in seconds.
+    """
+    def __init__(self) -> None:
+        """Constructor.
+        """
+        self.reset()
+
+    def __str__(self):
+        if self._count == 0:
+            return "LatencyStats(no samples)"
+        return "LatencyStats(count={}, mean={:.6f}s, min={:.6f}s, max={:.6f}s, last={:.6f}s)".format(self._count, self.mean, self._min, self._max, self._last)
+
+    def __repr__(self):
+        return str(self)
+
+
+    def reset(self) -> None:
+        """Clear all the recorded samples.
+        """
+        self._count = 0
+        self._sum = 0.0
+        self._min = None
+        self._max = None
+        self._last = None
+
+    def record(self, latency: float) -> None:
+        """Record a latency sample.
+
+        Args:
+            latency (float): The latency in seconds.
+        """
+        self._count += 1
+        self._sum += latency
+        self._last = latency
+        if self._min is None or latency < self._min:
+            self._min = latency
+        if self._max is None or latency > self._max:
+            self._max = latency
+
+    @property
+    def count(self) -> int:
+        """The number of recorded samples.
+        """
+        return self._count
+
+    @property
+    def mean(self) -> Optional[float]:
+        """The mean latency in seconds, None if there is no sample.
+        """
+        if self._count == 0:
+            return None
+        return self._sum/self._count
+
+    @property
+    def min(self) -> Optional[float]:
+        """The minimum latency in seconds, None if there is no sample.
+        """
+        return self._min
+
+    @property
+    def max(self) -> Optional[float]:
+        """The maximum latency in seconds, None if there is no sample.
+        """
+        return self._max
+
+    @property
+    def last(self) -> Optional[float]:
+        """The last recorded latency in seconds, None if there is no sample.
+        """
+        return self._last
+
+
+class Histogram:
+    """Histogram of positive values (typically durations in seconds) over logarithmic bins.
+    Values below the lowest bin edge are counted in the first bin, values above the highest edge in an overflow bin.
+    """
+    def __init__(self, low: float=1e-4, high: float=10.0, bins_per_decade: int=10) -> None:
+        """Constructor.
+
+        Args:
+            low (float, optional): The upper edge of the first bin. Defaults to 1e-4.
+            high (float, optional): The upper edge of the last bin before the overflow bin. Defaults to 10.0.
+            bins_per_decade (int, optional): The number of bins per decade. Defaults to 10.
+
+        Raises:
+            ValueError: The edges or the number of bins per decade are invalid.
+        """
+        if not 0 < low < high:
+            raise ValueError("The edges should satisfy 0 < low < high")
+        if bins_per_decade < 1:
+            raise ValueError("The number of bins per decade should be at least 1")
+        count = int(math.ceil(math.log10(high/low)*bins_per_decade))
+        self._edges = [low*10**(i/bins_per_decade) for i in range(count+1)]
+        self.reset()
+
+    def __str__(self):
+        if self._count == 0:
+            return "Histogram(no samples)"
+        return "Histogram(count={}, mean={:.6f}, p50={:.6f}, p99={:.6f}, max={:.6f})".format(self._count, self.mean, self.percentile(50), self.percentile(99), self._max)
+
+    def __repr__(self):
+        return str(self)
+
+
+    def reset(self) -> None:
+        """Clear all the recorded samples.
+        """
+        self._counts = [0]*(len(self._edges)+1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = None
+
+    def record(self, value: float) -> None:
+        """Record a sample.
+
+        Args:
+            value (float): The sample value.
+        """
+        self._counts[bisect.bisect_left(self._edges, value)] += 1
+        self._count += 1
+        self._sum += value
+        if self._max is None or value > self._max:
+            self._max = value
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Get an upper bound of a percentile, as the upper edge of the bin it falls in.
+
+        Args:
+            p (float): The percentile in the range [0,100].
+
+        Returns:
+            Optional[float]: The upper bound, the maximum value if it falls in the overflow bin, None if there is no sample.
+        """
+        if self._count == 0:
+            return None
+        rank = p/100*self._count
+        total = 0
+        for i, c in enumerate(self._counts):
+            total += c
+            if total >= rank and c > 0:
+                return self._edges[i] if i < len(self._edges) else self._max
+        return self._max
+
+    @property
+    def bins(self) -> List[Tuple[float, int]]:
+        """The bins as (upper edge, count), the last one being the overflow bin with an infinite edge.
+        """
+        return list(zip(self._edges+[math.inf], self._counts))
+
+    @property
+    def count(self) -> int:
+        """The number of recorded samples.
+        """
+        return self._count
+
+    @property
+    def mean(self) -> Optional[float]:
+        """The mean value, None if there is no sample.
+        """
+        if self._count == 0:
+            return None
+        return self._sum/self._count
+
+    @property
+    def max(self) -> Optional[float]:
+        """The maximum value, None if there is no sample.
+        """
+        return self._max
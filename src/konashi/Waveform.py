@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import asyncio
+import math
+from typing import *
+
+
+class WaveformSegment(NamedTuple):
+    """A linear ramp of a waveform.
+    The output ramps from the previous segment end value to ``value`` over ``duration`` milliseconds.
+    A duration of 0 sets the output immediately.
+    """
+    value: int
+    duration: int
+
+
+class PlayStats(NamedTuple):
+    """Statistics of a timed playback (waveform or animation).
+    """
+    writes: int
+    late: int
+    max_lateness: float
+
+
+def fit_ramps(samples: Sequence[float], interval: float, tolerance: float, low: int, high: int) -> List[WaveformSegment]:
+    """Fit a sampled waveform with linear ramps.
+    The samples are placed on the millisecond timeline of the segments (sample i at ``round(i*interval*1000)`` ms), and the ramps are fitted on it,
+    so the rounding of the durations cannot take the played ramps out of the tolerance.
+    The segments are fitted greedily: each ramp is extended for as long as a straight line from its start can stay within the tolerance of all the samples it covers.
+    The ramps are continuous, their end values are rounded to integers. The first segment sets the first sample with a duration of 0.
+    Samples falling on the same millisecond as the ramp start and out of the tolerance of it are set with a duration of 0 instead.
+
+    Args:
+        samples (Sequence[float]): The waveform samples, in control value units.
+        interval (float): The interval between two samples in seconds.
+        tolerance (float): The maximum deviation from the samples, in control value units. The valid minimum is 0.5.
+        low (int): The minimum control value.
+        high (int): The maximum control value.
+
+    Raises:
+        ValueError: The interval or tolerance is out of range, or there is no sample.
+
+    Returns:
+        List[WaveformSegment]: The ramp segments.
+    """
+    if interval <= 0:
+        raise ValueError("The sample interval should be positive")
+    if tolerance < 0.5:
+        raise ValueError("The tolerance should be at least 0.5 (the control value rounding)")
+    if len(samples) == 0:
+        raise ValueError("The waveform has no sample")
+    # keep room for the rounding of the ramp end values
+    tol = tolerance-0.5
+    def clamp(v):
+        return min(max(int(round(v)), low), high)
+    times = [int(round(i*interval*1000)) for i in range(len(samples))]
+    segments = []
+    start = clamp(samples[0])
+    start_i = 0
+    segments.append(WaveformSegment(start, 0))
+    slope_lo = -math.inf
+    slope_hi = math.inf
+    i = 1
+    while i < len(samples):
+        dt = times[i]-times[start_i]
+        if dt == 0:
+            if abs(samples[i]-start) > tol:
+                # no ramp fits in no time: set the value
+                start = clamp(samples[i])
+                start_i = i
+                segments.append(WaveformSegment(start, 0))
+            i += 1
+            continue
+        lo = max(slope_lo, (samples[i]-tol-start)/dt)
+        hi = min(slope_hi, (samples[i]+tol-start)/dt)
+        if lo <= hi:
+            slope_lo = lo
+            slope_hi = hi
+            i += 1
+            continue
+        # sample i does not fit: close the ramp at the previous sample
+        end_i = i-1
+        duration = times[end_i]-times[start_i]
+        slope = min(max((samples[end_i]-start)/duration, slope_lo), slope_hi)
+        start = clamp(start+slope*duration)
+        segments.append(WaveformSegment(start, duration))
+        start_i = end_i
+        slope_lo = -math.inf
+        slope_hi = math.inf
+    end_i = len(samples)-1
+    duration = times[end_i]-times[start_i]
+    if duration > 0:
+        slope = min(max((samples[end_i]-start)/duration, slope_lo), slope_hi)
+        segments.append(WaveformSegment(clamp(start+slope*duration), duration))
+    return segments
+
+
+async def play_timed(steps: Iterable[Tuple[int, Callable[[int], Awaitable[int]]]], start: Optional[float]=None, end: int=0) -> PlayStats:
+    """Run timed writes on absolute deadlines from the start time, so the write latency does not accumulate.
+    A write more than 1 ms late is given its lateness in milliseconds, to shorten its ramps and keep the following deadlines.
+
+    Args:
+        steps (Iterable[Tuple[int, Callable[[int], Awaitable[int]]]]): The steps in time order, as (time in milliseconds from the start, write).
+            The write is a coroutine function taking the lateness to shorten the ramps by in milliseconds, and returning the number of commands written.
+        start (Optional[float], optional): The start time on the event loop clock (``loop.time()``). Defaults to None (now).
+        end (int, optional): The time in milliseconds from the start to wait until after the last step. Defaults to 0.
+
+    Returns:
+        PlayStats: The number of commands written, the number of late steps and the maximum lateness in seconds.
+    """
+    loop = asyncio.get_event_loop()
+    origin = loop.time() if start is None else start
+    writes = 0
+    late = 0
+    max_lateness = 0.0
+    for t, write in steps:
+        deadline = origin+t/1000
+        delay = deadline-loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lateness = loop.time()-deadline
+        shorten = 0
+        if lateness > 0.001:
+            late += 1
+            max_lateness = max(max_lateness, lateness)
+            shorten = int(lateness*1000)
+        writes += await write(shorten)
+    delay = origin+end/1000-loop.time()
+    if delay > 0:
+        await asyncio.sleep(delay)
+    return PlayStats(writes, late, max_lateness)
+
+
+async def play_segments(segments: Sequence[WaveformSegment], write: Callable[[WaveformSegment], Awaitable[None]]) -> PlayStats:
+    """Play ramp segments on absolute deadlines (see ``play_timed``).
+    Each segment is written when the previous one is due to end. When a write is late, its ramp is shortened to keep the following deadlines.
+
+    Args:
+        segments (Sequence[WaveformSegment]): The segments to play.
+        write (Callable[[WaveformSegment], Awaitable[None]]): The coroutine function writing one segment.
+
+    Returns:
+        PlayStats: The playback statistics.
+    """
+    def step(segment: WaveformSegment) -> Callable[[int], Awaitable[int]]:
+        async def write_segment(shorten: int) -> int:
+            await write(WaveformSegment(segment.value, max(segment.duration-shorten, 0)))
+            return 1
+        return write_segment
+    steps = []
+    t = 0
+    for segment in segments:
+        steps.append((t, step(segment)))
+        t += segment.duration
+    return await play_timed(steps, end=t)
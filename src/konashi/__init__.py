@@ -22,6 +22,9 @@ from .Io.AIO import IDACRange
 from .Io.AIO import AIOPinDirection
 from .Io.AIO import AIOPinConfig
 from .Io.AIO import AIOPinControl
+from .Io.AIO import AIOAcquisition
+from .Io.AIO import AIOAcquisitionStats
+from .Io.AIO import AIOAdaptivePeriod
 
 from .Io.GPIO import GPIOPinFunction
 from .Io.GPIO import GPIOPinDirection
@@ -29,16 +32,24 @@ from .Io.GPIO import GPIOPinPull
 from .Io.GPIO import GPIOPinConfig
 from .Io.GPIO import GPIOPinControl
 from .Io.GPIO import GPIOPinLevel
+from .Io.GPIO import GPIOInputFilterStats
+from .Io.GPIO import GPIOPulseStats
 
 from .Io.HardPWM import HardPWMClock
 from .Io.HardPWM import HardPWMPrescale
 from .Io.HardPWM import HardPWMConfig
 from .Io.HardPWM import HardPWMPinControl
+from .Io.HardPWM import HardPWMSolution
 
 from .Io.I2C import I2CMode
 from .Io.I2C import I2CConfig
 from .Io.I2C import I2COperation
 from .Io.I2C import I2CResult
+from .Io.I2C import I2CScanResult
+from .Io.I2C import I2CRegisterCache
+from .Io.I2C import I2CPoller
+from .Io.I2C import I2CPollResult
+from .Io.I2C import I2CPollStats
 
 from .Io.SoftPWM import SoftPWMControlType
 from .Io.SoftPWM import SoftPWMPinConfig
@@ -47,7 +58,31 @@ from .Io.SoftPWM import SoftPWMPinControl
 from .Io.SPI import SPIMode
 from .Io.SPI import SPIEndian
 from .Io.SPI import SPIConfig
+from .Io.SPIFlash import SPIFlash
+from .Io.SPIFlash import SPIFlashDumpStats
 
 from .Io.UART import UARTParity
 from .Io.UART import UARTStopBits
 from .Io.UART import UARTConfig
+from .Io.UART import UARTStreamReader
+from .Io.UART import UARTStreamWriter
+
+from .Io.Reflex import ReflexEdge
+
+from .Io.Framebuffer import Framebuffer
+from .Io.Framebuffer import FramebufferStats
+from .Io.Framebuffer import I2CDisplayTransport
+from .Io.Framebuffer import SPIDisplayTransport
+from .Io.Framebuffer import ssd1306_window
+
+from .Waveform import WaveformSegment
+from .Waveform import PlayStats
+
+from .Animation import Animation
+from .Animation import Keyframe
+from .Animation import HardPWMChannel
+from .Animation import SoftPWMChannel
+from .Animation import RGBLedChannel
+
+from .ControlLoop import ControlLoop
+from .ControlLoop import PIDController
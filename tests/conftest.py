@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+
+class FakeClient:
+    # BLE client double: records the writes and keeps the notification callbacks
+    def __init__(self):
+        self.writes = []
+        self.on_write = None
+        self.notify = {}
+
+    async def write_gatt_char(self, uuid, data, response):
+        self.writes.append((uuid, bytes(data)))
+        if self.on_write is not None:
+            res = self.on_write(uuid, bytes(data))
+            if asyncio.iscoroutine(res):
+                await res
+
+    async def read_gatt_char(self, uuid):
+        return bytearray()
+
+    async def start_notify(self, uuid, callback):
+        self.notify[uuid] = callback
+
+    async def stop_notify(self, uuid):
+        self.notify.pop(uuid, None)
+
+    async def disconnect(self):
+        return True
+
+
+@pytest.fixture
+def connect():
+    # coroutine function returning a Konashi connected through a FakeClient
+    pytest.importorskip("bleak")
+    import konashi
+    async def connect():
+        device = konashi.Konashi("test")
+        device._ble_client = FakeClient()
+        await device._settings._on_connect()
+        await device._io._on_connect()
+        await device._builtin._on_connect()
+        return device
+    return connect
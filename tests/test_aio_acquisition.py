@@ -0,0 +1,55 @@
+import math
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("bleak")
+
+from konashi.Io import AIO
+
+
+def _pins_in(values, valid=True, ref=AIO.ADCRef.REF_2V5):
+    pins_in = AIO._AIOPinsIn()
+    pins_in.adc_voltage_reference = ref
+    for i, value in enumerate(values):
+        pins_in.pin[i].valid = valid
+        pins_in.pin[i].value = value
+    return pins_in
+
+
+class _Analog:
+    _input_listeners = []
+
+
+def test_stats_empty_buffer_is_nan():
+    acquisition = AIO.AIOAcquisition(_Analog(), 8)
+    stats = acquisition.get_stats()
+    assert list(stats.samples) == [0]*AIO.KONASHI_AIO_COUNT
+    for values in (stats.mean, stats.rms, stats.min, stats.max):
+        assert len(values) == AIO.KONASHI_AIO_COUNT
+        assert all(math.isnan(v) for v in values)
+
+
+def test_stats_zero_count_is_nan():
+    acquisition = AIO.AIOAcquisition(_Analog(), 8)
+    acquisition._on_input(_pins_in([100]*AIO.KONASHI_AIO_COUNT), 1.0)
+    stats = acquisition.get_stats(count=0)
+    assert list(stats.samples) == [0]*AIO.KONASHI_AIO_COUNT
+    assert all(math.isnan(v) for v in stats.min)
+    stats = acquisition.get_stats()
+    assert list(stats.samples) == [1]*AIO.KONASHI_AIO_COUNT
+    assert not any(math.isnan(v) for v in stats.min)
+
+
+def test_samples_use_the_notified_reference():
+    acquisition = AIO.AIOAcquisition(_Analog(), 8)
+    acquisition._on_input(_pins_in([65535, 0, 13107]), 1.0)
+    acquisition._on_input(_pins_in([65535, 0, 13107], ref=AIO.ADCRef.REF_1V25), 2.0)
+    acquisition._on_input(_pins_in([65535, 0, 13107], valid=False), 3.0)
+    acquisition._on_input(_pins_in([65535, 0, 13107], ref=AIO.ADCRef.DISABLE), 4.0)
+    times, volts = acquisition.get_samples()
+    assert list(times) == [1.0, 2.0, 3.0, 4.0]
+    assert volts[0] == pytest.approx([2.5, 0.0, 0.5])
+    assert volts[1] == pytest.approx([1.25, 0.0, 0.25])
+    assert np.isnan(volts[2]).all()
+    assert np.isnan(volts[3]).all()
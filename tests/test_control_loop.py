@@ -0,0 +1,87 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("bleak")
+
+from konashi.ControlLoop import ControlLoop
+
+
+class _Analog:
+    def __init__(self):
+        self._input_listeners = []
+
+    def _calc_voltage_for_value(self, value):
+        return value
+
+    def notify(self, value, timestamp):
+        pin = SimpleNamespace(valid=True, value=value)
+        for listener in self._input_listeners:
+            listener(SimpleNamespace(pin=[pin]*3), timestamp)
+
+
+class _HardPWM:
+    def __init__(self, fail=None):
+        self.values = []
+        self.fail = fail
+
+    def calc_control_value_for_duty(self, duty):
+        return int(duty*10)
+
+    async def control_pins(self, controls):
+        if self.fail is not None:
+            raise self.fail
+        self.values.append(controls[0][1])
+
+
+class _Controller:
+    def __init__(self, fail=None):
+        self.updates = []
+        self.fail = fail
+
+    def update(self, measurement, dt):
+        if self.fail is not None:
+            raise self.fail
+        self.updates.append(measurement)
+        return measurement
+
+
+def test_stale_samples_hold_the_output():
+    async def main():
+        analog = _Analog()
+        controller = _Controller()
+        loop = ControlLoop(controller, 200, analog, 0, _HardPWM(), 0)
+        loop.start()
+        analog.notify(10.0, 0.0)
+        await asyncio.sleep(0.05)
+        analog.notify(20.0, 1.0)
+        await asyncio.sleep(0.05)
+        await loop.stop()
+        return loop, controller
+    loop, controller = asyncio.run(main())
+    # one update per sample, the periods in between are stale
+    assert controller.updates == [10.0, 20.0]
+    assert loop.stale > 0
+    assert loop.writes == 2
+
+
+@pytest.mark.parametrize("controller, hardpwm", [
+    (_Controller(ZeroDivisionError()), _HardPWM()),
+    (_Controller(), _HardPWM(ZeroDivisionError())),
+])
+def test_failure_stops_the_loop(controller, hardpwm):
+    async def main():
+        analog = _Analog()
+        loop = ControlLoop(controller, 200, analog, 0, hardpwm, 0)
+        loop.start()
+        analog.notify(10.0, 0.0)
+        await asyncio.sleep(0.02)
+        running = loop.is_running
+        with pytest.raises(ZeroDivisionError):
+            await loop.stop()
+        return loop, analog, running
+    loop, analog, running = asyncio.run(main())
+    assert not running
+    assert isinstance(loop.error, ZeroDivisionError)
+    assert analog._input_listeners == []
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("bleak")
+
+from konashi.Io import Framebuffer
+
+
+class _Transport:
+    def __init__(self, fail=False):
+        self.commands = []
+        self.sent = []
+        self.fail = fail
+        self.resets = 0
+
+    def reset(self):
+        self.resets += 1
+
+    async def command(self, data):
+        self.commands.append(bytes(data))
+
+    async def data(self, data):
+        if self.fail:
+            raise Framebuffer.KonashiError("Display write failed")
+        self.sent.append(bytes(data))
+
+
+def _flushed(width=32, pages=4, merge_gap=None):
+    transport = _Transport()
+    framebuffer = Framebuffer.Framebuffer(transport, width, pages, merge_gap)
+    asyncio.run(framebuffer.flush())
+    transport.commands.clear()
+    transport.sent.clear()
+    return transport, framebuffer
+
+
+def test_first_flush_sends_the_whole_frame():
+    transport = _Transport()
+    framebuffer = Framebuffer.Framebuffer(transport, 32, 4)
+    stats = asyncio.run(framebuffer.flush())
+    assert stats == (1, 128, 128)
+    assert transport.commands == [Framebuffer.ssd1306_window(0, 3, 0, 31)]
+    assert asyncio.run(framebuffer.flush()) == (0, 0, 128)
+
+
+def test_same_columns_on_consecutive_pages_are_one_region():
+    transport, framebuffer = _flushed()
+    framebuffer.buffer[1:3, 4:8] = 0xFF
+    framebuffer.buffer[3, 20] = 0x01
+    assert framebuffer.dirty_regions() == [(1, 2, 4, 7), (3, 3, 20, 20)]
+    stats = asyncio.run(framebuffer.flush())
+    assert stats == (2, 9, 128)
+    assert transport.sent == [b'\xff'*8, b'\x01']
+
+
+def test_gaps_up_to_the_window_command_length_are_merged():
+    # the default gap is the 6 bytes of the SSD1306 window command
+    transport, framebuffer = _flushed()
+    framebuffer.buffer[0, [0, 7, 15]] = 1
+    assert framebuffer.dirty_regions() == [(0, 0, 0, 7), (0, 0, 15, 15)]
+    transport, framebuffer = _flushed(merge_gap=0)
+    framebuffer.buffer[0, [0, 1, 3]] = 1
+    assert framebuffer.dirty_regions() == [(0, 0, 0, 1), (0, 0, 3, 3)]
+
+
+def test_failed_flush_sends_everything_next_time():
+    transport, framebuffer = _flushed()
+    framebuffer.buffer[0, 0] = 1
+    transport.fail = True
+    with pytest.raises(Framebuffer.KonashiError):
+        asyncio.run(framebuffer.flush())
+    assert framebuffer.dirty_regions() == [(0, 3, 0, 31)]
+    framebuffer.invalidate()
+    assert transport.resets == 1
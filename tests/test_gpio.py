@@ -0,0 +1,186 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("bleak")
+
+from konashi.Io import GPIO
+
+
+def _input(gpio, level):
+    gpio._ntf_cb_input(None, bytes([0x10|level]+[0]*(GPIO.KONASHI_GPIO_COUNT-1)))
+
+
+def _filtered(device, debounce=0.0, min_pulse=0.0):
+    gpio = device.io.gpio
+    reported = []
+    gpio.set_input_cb(lambda pin, level: reported.append((pin, level)))
+    gpio.config_input_filter(0x01, debounce, min_pulse)
+    return gpio, reported
+
+
+def test_first_input_seeds_the_filter(connect):
+    async def main():
+        gpio, reported = _filtered(await connect(), debounce=0.02)
+        _input(gpio, 1)
+        _input(gpio, 0)
+        return reported, gpio.get_input_filter_stats(0x01)[0]
+    reported, stats = asyncio.run(main())
+    assert reported == [(0, 0)]
+    assert stats == (1, 0, 0)
+
+
+def test_debounce_reports_the_settled_level(connect):
+    async def main():
+        gpio, reported = _filtered(await connect(), debounce=0.03)
+        _input(gpio, 0)
+        _input(gpio, 1)
+        # bounces inside the window, ending on the reported level
+        for level in (0, 1, 0, 1):
+            _input(gpio, level)
+        await asyncio.sleep(0.05)
+        first = list(reported)
+        _input(gpio, 0)
+        # the bounce ends on the other level, reported when the window closes
+        for level in (1, 0, 1):
+            _input(gpio, level)
+        await asyncio.sleep(0.05)
+        return first, reported, gpio.get_input_filter_stats(0x01)[0]
+    first, reported, stats = asyncio.run(main())
+    assert first == [(0, 1)]
+    assert reported == [(0, 1), (0, 0), (0, 1)]
+    assert stats == (3, 7, 0)
+
+
+def test_short_pulses_are_glitches(connect):
+    async def main():
+        gpio, reported = _filtered(await connect(), min_pulse=0.02)
+        _input(gpio, 0)
+        _input(gpio, 1)
+        _input(gpio, 0)
+        await asyncio.sleep(0.03)
+        glitched = list(reported)
+        _input(gpio, 1)
+        await asyncio.sleep(0.03)
+        return glitched, reported, gpio.get_input_filter_stats(0x01)[0]
+    glitched, reported, stats = asyncio.run(main())
+    assert glitched == []
+    assert reported == [(0, 1)]
+    assert stats == (1, 0, 1)
+
+
+def test_removed_filter_reports_every_edge(connect):
+    async def main():
+        gpio, reported = _filtered(await connect(), debounce=1.0)
+        gpio.config_input_filter(0x01)
+        _input(gpio, 0)
+        for level in (1, 0, 1):
+            _input(gpio, level)
+        return reported, gpio.get_input_filter_stats(0x01)
+    reported, stats = asyncio.run(main())
+    assert reported == [(0, 1), (0, 0), (0, 1)]
+    assert stats == [None]
+
+
+def _config(*functions):
+    functions = list(functions)+[GPIO.GPIOPinFunction.DISABLED]*(GPIO.KONASHI_GPIO_COUNT-len(functions))
+    return GPIO._PinsConfig.from_buffer_copy(bytes(b for f in functions for b in (f, 0)))
+
+
+def test_reserved_pins_block_other_functions():
+    registry = GPIO._PinRegistry()
+    registry._update(_config(GPIO.GPIOPinFunction.GPIO))
+    registry.reserve(0x06, GPIO.GPIOPinFunction.PWM)
+    with pytest.raises(GPIO.PinUnavailableError, match="Pin 0 is already configured as GPIO"):
+        registry.reserve(0x01, GPIO.GPIOPinFunction.I2C)
+    with pytest.raises(GPIO.PinUnavailableError, match="Pin 1 is already being configured as PWM"):
+        registry.reserve(0x02, GPIO.GPIOPinFunction.I2C)
+    # the same function can share the pins
+    registry.check_available(0x04, GPIO.GPIOPinFunction.PWM)
+    registry.release(0x06, GPIO.GPIOPinFunction.PWM)
+    registry.reserve(0x06, GPIO.GPIOPinFunction.I2C)
+
+
+def test_reservation_settles_on_the_configuration_notification():
+    async def main():
+        registry = GPIO._PinRegistry()
+        async def write():
+            await asyncio.sleep(0)
+        await registry.configure(0x06, GPIO.GPIOPinFunction.PWM, 0x02, write)
+        # still reserved after the write, until the notification shows it
+        with pytest.raises(GPIO.PinUnavailableError):
+            registry.check_available(0x04, GPIO.GPIOPinFunction.SPI)
+        registry._update(_config(GPIO.GPIOPinFunction.DISABLED, GPIO.GPIOPinFunction.PWM, GPIO.GPIOPinFunction.GPIO))
+        pending = len(registry._settling)
+        registry._update(_config(GPIO.GPIOPinFunction.DISABLED, GPIO.GPIOPinFunction.PWM))
+        registry.check_available(0x04, GPIO.GPIOPinFunction.SPI)
+        return pending, registry._settling, registry.owned(GPIO.GPIOPinFunction.PWM)
+    pending, settling, owned = asyncio.run(main())
+    # pin 2 is not disabled yet by the first notification
+    assert pending == 1
+    assert settling == []
+    assert owned == 0x02
+
+
+def test_failed_write_releases_and_timeout_settles(monkeypatch):
+    monkeypatch.setattr(GPIO, "_PIN_SETTLE_TIMEOUT", 0.01)
+    async def main():
+        registry = GPIO._PinRegistry()
+        async def fail():
+            raise GPIO.KonashiError("write failed")
+        with pytest.raises(GPIO.KonashiError):
+            await registry.configure(0x01, GPIO.GPIOPinFunction.PWM, 0x01, fail)
+        registry.reserve(0x01, GPIO.GPIOPinFunction.I2C)
+        registry.settle(0x01, GPIO.GPIOPinFunction.I2C, 0x01)
+        await asyncio.sleep(0.03)
+        registry.reserve(0x01, GPIO.GPIOPinFunction.SPI)
+    asyncio.run(main())
+
+
+def _expected_pulse_stats(edges, window):
+    # brute force over the edges kept in the window
+    kept = edges[-window:]
+    widths = ([], [])
+    for (t0, level), (t1, _) in zip(kept, kept[1:]):
+        widths[level].append(t1-t0)
+    periods = []
+    first = len(edges)-len(kept)
+    for i in range(first, len(edges)):
+        previous = [t for t, level in edges[:i] if level == edges[i][1]]
+        if previous:
+            periods.append(edges[i][0]-previous[-1])
+    mean = lambda values: sum(values)/len(values) if values else None
+    return len(kept), mean(periods), mean(widths[1]), mean(widths[0])
+
+
+def test_pulse_meter_evicts_the_oldest_edges():
+    meter = GPIO._GPIOPulseMeter(5, 0.0)
+    edges = []
+    t = 0.0
+    # 30% duty at a 10ms period, then 60% at 20ms
+    for high, low in [(0.003, 0.007)]*6+[(0.012, 0.008)]*4:
+        for level, width in ((1, high), (0, low)):
+            edges.append((t, level))
+            meter.add(level, t)
+            t += width
+            stats = meter.stats()
+            count, period, high_width, low_width = _expected_pulse_stats(edges, 5)
+            assert stats.edges == count
+            if stats.period is not None:
+                assert stats.period == pytest.approx(period)
+            if stats.high_width is not None and stats.low_width is not None:
+                assert (stats.high_width, stats.low_width) == pytest.approx((high_width, low_width))
+    # only the last edges remain in the window
+    assert stats.duty == pytest.approx(60.0)
+    assert stats.period == pytest.approx(0.020)
+
+
+def test_pulse_meter_restarts_on_a_lost_edge():
+    meter = GPIO._GPIOPulseMeter(8, 0.0)
+    for i, level in enumerate((1, 0, 1, 0)):
+        meter.add(level, i*0.01)
+    meter.add(0, 0.05)
+    stats = meter.stats()
+    assert stats.edges == 1
+    assert stats.period is None
+    assert stats.duty is None
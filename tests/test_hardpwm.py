@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("bleak")
+
+from konashi.Io import HardPWM
+
+
+def _first_fitting(period):
+    # the configuration the prescale search is expected to give
+    freq = HardPWM.KONASHI_HARDPWM_CLOCK_FREQ[HardPWM.HardPWMClock.HFCLK]
+    for div in HardPWM.HardPWMPrescale:
+        top = round(period*freq/(1<<div.value))
+        if top <= 65535:
+            return (HardPWM.HardPWMClock.HFCLK, div, top)
+    return (HardPWM.HardPWMClock.CASCADE, HardPWM.HardPWMPrescale.DIV1, round(period*HardPWM.KONASHI_HARDPWM_CLOCK_FREQ[HardPWM.HardPWMClock.CASCADE]))
+
+
+@pytest.mark.parametrize("period", [1e-6, 1e-3, 1.7e-3, 65535/38400000, 65536/38400000, 0.02, 1.0, 1.7476, 3.2])
+def test_solve_pwm_period(connect, period):
+    hardpwm = asyncio.run(connect()).io.hardpwm
+    solution = hardpwm.solve_pwm_period(period)
+    config = solution.config
+    assert (config.clock, config.prescale, config.top) == _first_fitting(period)
+    freq = HardPWM.KONASHI_HARDPWM_CLOCK_FREQ[config.clock]/(1<<config.prescale)
+    assert solution.period == pytest.approx(config.top/freq)
+    assert solution.error == pytest.approx(solution.period-period)
+    assert solution.resolution == pytest.approx(100.0/config.top)
+    # a faster count frequency would overflow the top
+    if config.clock == HardPWM.HardPWMClock.HFCLK and config.prescale > 0:
+        assert round(period*freq*2) > 65535
+
+
+@pytest.mark.parametrize("period", [1e-8, 4.0])
+def test_solve_pwm_period_out_of_range(connect, period):
+    hardpwm = asyncio.run(connect()).io.hardpwm
+    with pytest.raises(ValueError):
+        hardpwm.solve_pwm_period(period)
@@ -0,0 +1,189 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("bleak")
+
+from konashi.Errors import KonashiError
+from konashi.Io import I2C
+
+
+class _Bus:
+    # I2C slaves behind the fake BLE client, answering with the firmware response format
+    def __init__(self, device, reg_width=1):
+        self.i2c = device.io.i2c
+        self.reg_width = reg_width
+        self.memory = {}
+        self.busy = {}
+        self.busy_after_write = 0
+        self.lost = set()
+        self.results = {}
+        self.frames = []
+        device._ble_client.on_write = self.on_write
+
+    def on_write(self, uuid, data):
+        if uuid != I2C.KONASHI_UUID_CONTROL_CMD or data[0] != I2C.KONASHI_CTL_CMD_I2C_DATA:
+            return
+        self.frames.append(data)
+        operation, read_len, address, payload = data[1], data[2], data[3], data[4:]
+        if address in self.lost:
+            self.lost.discard(address)
+            return
+        if address in self.results:
+            return self.respond(self.results[address], address)
+        if address not in self.memory or self.busy.get(address, 0) > 0:
+            if address in self.busy:
+                self.busy[address] -= 1
+            return self.respond(I2C.I2CResult.NACK, address)
+        memory = self.memory[address]
+        reg = int.from_bytes(payload[:self.reg_width], 'big')
+        if operation == I2C.I2COperation.WRITE:
+            if len(payload) > self.reg_width:
+                memory[reg:reg+len(payload)-self.reg_width] = payload[self.reg_width:]
+                self.busy[address] = self.busy_after_write
+            return self.respond(I2C.I2CResult.DONE, address)
+        if operation == I2C.I2COperation.READ:
+            reg = 0
+        self.respond(I2C.I2CResult.DONE, address, memory[reg:reg+read_len])
+
+    def respond(self, result, address, data=b''):
+        asyncio.get_event_loop().call_soon(self.i2c._ntf_cb_data_in, None, bytes([result, address])+bytes(data))
+
+
+def test_read_registers_in_page_chunks(connect):
+    async def main():
+        device = await connect()
+        bus = _Bus(device, reg_width=2)
+        bus.memory[0x50] = bytearray(i&0xFF for i in range(1024))
+        data = await device.io.i2c.read_registers(0x50, 0x10, 300, reg_width=2, page_size=128)
+        return bus, data
+    bus, data = asyncio.run(main())
+    assert data == bytearray(i&0xFF for i in range(0x10, 0x10+300))
+    # (register, length) of each write-read, cut at the 126 bytes limit and the page boundaries
+    assert [(int.from_bytes(f[4:6], 'big'), f[2]) for f in bus.frames] == [(0x10, 112), (0x80, 126), (0xFE, 2), (0x100, 60)]
+
+
+def test_write_registers_polls_the_ack(connect):
+    async def main():
+        device = await connect()
+        bus = _Bus(device)
+        bus.memory[0x50] = bytearray(256)
+        bus.busy_after_write = 2
+        await device.io.i2c.write_registers(0x50, 0x00, bytes(range(40)), page_size=16, poll_ack=1.0)
+        probes = sum(1 for f in bus.frames if len(f) == 4)
+        bus.busy_after_write = 1000
+        with pytest.raises(KonashiError, match="did not acknowledge after the write of register 0x0"):
+            await device.io.i2c.write_registers(0x50, 0x00, b'\x01', poll_ack=0.02)
+        return bus, probes
+    bus, probes = asyncio.run(main())
+    assert bus.memory[0x50][1:40] == bytes(range(1, 40))
+    # 3 page writes, each answered after 2 NACKs
+    assert probes == 9
+
+
+def test_lost_response_fails_only_its_transaction(connect):
+    async def main():
+        device = await connect()
+        bus = _Bus(device)
+        bus.memory[0x50] = bytearray(b'\x50'*16)
+        bus.memory[0x51] = bytearray(b'\x51'*16)
+        bus.lost.add(0x50)
+        i2c = device.io.i2c
+        return await asyncio.gather(
+            i2c.transaction(I2C.I2COperation.WRITE_READ, 0x50, 1, b'\x00'),
+            i2c.transaction(I2C.I2COperation.WRITE_READ, 0x51, 1, b'\x00'),
+            return_exceptions=True), i2c.queue_depth
+    (first, second), depth = asyncio.run(main())
+    assert isinstance(first, KonashiError)
+    assert second == (I2C.I2CResult.DONE, 0x51, b'\x51')
+    assert depth == 0
+
+
+def test_register_cache(connect):
+    async def main():
+        device = await connect()
+        bus = _Bus(device)
+        bus.memory[0x40] = bytearray(range(16))
+        i2c = device.io.i2c
+        cache = i2c.get_register_cache(0x40, volatile=[0x03])
+        assert await cache.read(0x00, 3) == b'\x00\x01\x02'
+        assert await cache.read(0x01, 2) == b'\x01\x02'
+        # the volatile register is always read from the device
+        bus.memory[0x40][0x03] = 0xAA
+        assert await cache.read(0x02, 2) == b'\x02\xaa'
+        bus.memory[0x40][0x03] = 0xBB
+        assert await cache.read(0x03) == b'\xbb'
+        frames = len(bus.frames)
+        # nothing is written when the bits already hold the value
+        assert await cache.update_bits(0x01, 0x0F, 0x01) == 0x01
+        assert len(bus.frames) == frames
+        assert await cache.update_bits(0x01, 0xF0, 0x50) == 0x51
+        assert bus.memory[0x40][0x01] == 0x51
+        # a failed write invalidates the written registers
+        bus.results[0x40] = I2C.I2CResult.NACK
+        with pytest.raises(KonashiError):
+            await cache.write(0x00, b'\x10\x11')
+        del bus.results[0x40]
+        bus.memory[0x40][0x00:0x02] = b'\x20\x21'
+        assert await cache.read(0x00, 3) == b'\x20\x21\x02'
+        stats = (cache.hits, cache.misses)
+        await device.io._on_connect()
+        bus.memory[0x40][0x02] = 0x30
+        assert await cache.read(0x02) == b'\x30'
+        assert i2c.get_register_cache(0x40, volatile=[0x03]) is cache
+        with pytest.raises(ValueError):
+            i2c.get_register_cache(0x40)
+        return stats
+    assert asyncio.run(main()) == (3, 4)
+
+
+def test_scan_reports_lost_and_unknown_results(connect):
+    async def main():
+        device = await connect()
+        bus = _Bus(device)
+        bus.memory[0x20] = bytearray(1)
+        bus.memory[0x2C] = bytearray(b'\x7f')
+        bus.results[0x25] = 0x09
+        bus.lost.add(0x28)
+        scan = await device.io.i2c.scan(0x1E, 0x2F, window=4)
+        read_scan = await device.io.i2c.scan(0x2C, 0x2C, read=True)
+        return bus, scan, read_scan
+    bus, scan, read_scan = asyncio.run(main())
+    assert scan.found == [0x20, 0x2C]
+    assert scan.failed[0x25] == 0x09
+    assert scan.failed[0x28] is None
+    assert scan.failed[0x1E] == I2C.I2CResult.NACK
+    assert sorted(scan.failed) == [a for a in range(0x1E, 0x30) if a not in (0x20, 0x2C)]
+    assert read_scan == ([0x2C], {})
+    assert bus.frames[-1] == bytes([I2C.KONASHI_CTL_CMD_I2C_DATA, I2C.I2COperation.READ, 1, 0x2C])
+
+
+def test_poller_counts_decoder_errors(connect):
+    async def main():
+        device = await connect()
+        bus = _Bus(device)
+        bus.memory[0x48] = bytearray(b'\x01\x02')
+        poller = device.io.i2c.create_poller()
+        def decode(data):
+            return int.from_bytes(data, 'big')
+        def broken(data):
+            raise ValueError("bad data")
+        good = poller.add_job(0x48, 0x00, 2, 0.01, decode)
+        bad = poller.add_job(0x48, 0x00, 2, 0.01, broken)
+        nack = poller.add_job(0x49, 0x00, 2, 0.01)
+        poller.start()
+        results = []
+        async for result in poller:
+            results.append(result)
+            if len(results) == 6:
+                break
+        await poller.stop()
+        return results, poller.get_job_stats(good), poller.get_job_stats(bad), poller.get_job_stats(nack)
+    results, good, bad, nack = asyncio.run(main())
+    # no result is delivered for a read whose decoder failed
+    assert {r.job for r in results} == {0, 2}
+    assert all(r.value == 0x0102 for r in results if r.job == 0)
+    assert all(r.result == I2C.I2CResult.NACK and r.value is None for r in results if r.job == 2)
+    assert good.reads > 0 and good.errors == 0
+    assert bad.reads == 0 and bad.errors > 0
+    assert nack.reads == 0 and nack.errors > 0
@@ -0,0 +1,83 @@
+import asyncio
+import math
+import time
+
+import pytest
+
+pytest.importorskip("bleak")
+
+from konashi import Waveform
+
+
+def test_play_segments_on_absolute_deadlines():
+    async def main():
+        written = []
+        async def write(segment):
+            written.append((time.monotonic(), segment))
+            await asyncio.sleep(0)
+        start = time.monotonic()
+        segments = [Waveform.WaveformSegment(0, 0), Waveform.WaveformSegment(100, 30), Waveform.WaveformSegment(0, 30)]
+        stats = await Waveform.play_segments(segments, write)
+        return start, time.monotonic(), written, stats
+    start, end, written, stats = asyncio.run(main())
+    assert [segment.value for t, segment in written] == [0, 100, 0]
+    # a late segment is shortened by its lateness
+    assert all(25 <= segment.duration <= 30 for t, segment in written[1:])
+    # late only by the scheduling delay
+    assert 0.029 <= written[2][0]-start < 0.050
+    assert end-start >= 0.060
+    assert stats.writes == 3
+
+
+def test_late_steps_are_shortened():
+    async def main():
+        shortened = []
+        async def blocking(shorten):
+            time.sleep(0.030)
+            return 1
+        async def record(shorten):
+            shortened.append(shorten)
+            return 2
+        stats = await Waveform.play_timed([(0, blocking), (10, record)])
+        return shortened, stats
+    shortened, stats = asyncio.run(main())
+    assert shortened[0] >= 15
+    assert stats.writes == 3
+    assert stats.late == 1
+    assert stats.max_lateness >= 0.015
+
+
+def _played(segments, t):
+    # the output of the segments at t ms, the last value set at t when several are
+    value = segments[0].value
+    elapsed = 0
+    for segment in segments[1:]:
+        if elapsed+segment.duration > t:
+            return value+(segment.value-value)*(t-elapsed)/segment.duration
+        value = segment.value
+        elapsed += segment.duration
+    return value
+
+
+@pytest.mark.parametrize("interval", [0.001, 0.0015, 0.0004, 0.01])
+def test_fit_ramps_stays_within_the_tolerance(interval):
+    samples = [500+400*math.sin(i/7)+30*((i%5) == 0) for i in range(300)]
+    segments = Waveform.fit_ramps(samples, interval, 2.0, 0, 1000)
+    assert segments[0].duration == 0
+    assert sum(s.duration for s in segments) == round((len(samples)-1)*interval*1000)
+    times = [round(i*interval*1000) for i in range(len(samples))]
+    for i, (t, sample) in enumerate(zip(times, samples)):
+        if i+1 < len(times) and times[i+1] == t:
+            # overwritten on the same millisecond
+            continue
+        assert abs(_played(segments, t)-sample) <= 2.0
+    assert len(segments) < len(samples)
+
+
+def test_fit_ramps_line_and_clamp():
+    assert Waveform.fit_ramps([i*10 for i in range(11)], 0.001, 0.5, 0, 1000) == [(0, 0), (100, 10)]
+    assert Waveform.fit_ramps([-5, 50, 105], 0.001, 0.5, 0, 100) == [(0, 0), (50, 1), (100, 1)]
+    with pytest.raises(ValueError):
+        Waveform.fit_ramps([1], 0.001, 0.4, 0, 100)
+    with pytest.raises(ValueError):
+        Waveform.fit_ramps([], 0.001, 1.0, 0, 100)
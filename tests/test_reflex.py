@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("bleak")
+
+from konashi.Io import AIO
+from konashi.Io import GPIO
+from konashi.Io import Reflex
+
+
+def test_threshold_crossing_with_hysteresis():
+    crossing = AIO._ThresholdCrossing(1.0, True, 0.1, False)
+    # not armed until the input is seen below the threshold minus the hysteresis
+    assert [crossing.update(v) for v in (1.5, 0.95, 1.5, 0.8, 1.2, 0.95, 1.1, 0.85, 1.0)] == \
+        [False, False, False, False, True, False, False, False, True]
+    falling = AIO._ThresholdCrossing(1.0, False, 0.0, True)
+    assert [falling.update(v) for v in (1.0, 1.0, 1.2, 0.9)] == [True, False, False, True]
+
+
+def _gpio_rule(device):
+    io = device.io
+    # pin 0 input, pins 1 and 2 outputs
+    io.gpio._ntf_cb_config(None, bytes([1, 0, 1, 0, 1, 0, 2, 0, 2, 0, 0, 0, 0, 0, 0, 0]))
+    return io.reflex.add_gpio_rule(0, Reflex.ReflexEdge.RISING, io.gpio, [(0x06, GPIO.GPIOPinControl.HIGH)])
+
+
+def _control_writes(device):
+    return [data for uuid, data in device._ble_client.writes if uuid == Reflex.KONASHI_UUID_CONTROL_CMD]
+
+
+def test_writer_follows_the_connection(connect):
+    device = asyncio.run(connect())
+    rule_id = _gpio_rule(device)
+    async def reconnect_and_trigger():
+        # a new event loop: the writer is started again by the connection
+        await device._io._on_connect()
+        device._ble_client.writes.clear()
+        device.io.reflex._on_gpio_input(0, 1, 0.0)
+        await asyncio.sleep(0.01)
+        return _control_writes(device)
+    writes = asyncio.run(reconnect_and_trigger())
+    assert len(writes) == 1
+    assert device.io.reflex.get_rule_stats(rule_id)[0] == 1
+
+
+def test_disconnection_stops_the_writer(connect):
+    async def main():
+        device = await connect()
+        _gpio_rule(device)
+        device._ble_client.writes.clear()
+        await device.disconnect()
+        device.io.reflex._on_gpio_input(0, 1, 0.0)
+        await asyncio.sleep(0.01)
+        return device
+    device = asyncio.run(main())
+    assert device.io.reflex._writer is None
+    assert len(device.io.reflex._pending) == 0
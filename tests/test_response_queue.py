@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("bleak")
+
+from konashi.Errors import KonashiConnectionError
+from konashi.Io import I2C
+from konashi.Io import SPI
+
+
+def _respond_later(delay, callback, data):
+    asyncio.get_event_loop().call_later(delay, callback, None, data)
+
+
+def test_disconnect_fails_pending_requests(connect):
+    async def main():
+        device = await connect()
+        i2c_task = asyncio.ensure_future(device.io.i2c.transaction(I2C.I2COperation.READ, 0x10, 1, b''))
+        spi_task = asyncio.ensure_future(device.io.spi.transaction(b'\x01'))
+        uart_task = asyncio.ensure_future(device.io.uart.send(b'\x01'))
+        await asyncio.sleep(0.01)
+        await device.disconnect()
+        return await asyncio.gather(i2c_task, spi_task, uart_task, return_exceptions=True)
+    results = asyncio.run(main())
+    assert all(isinstance(r, KonashiConnectionError) for r in results)
+
+
+def test_timed_out_request_absorbs_its_late_response(connect):
+    async def main():
+        device = await connect()
+        spi = device.io.spi
+        # answered in order, the first one after the timeout
+        delays = [0.05, 0.06, 0.001]
+        def on_write(uuid, data):
+            if data[0] == SPI.KONASHI_CTL_CMD_SPI_DATA:
+                _respond_later(delays.pop(0), spi._ntf_cb_data_in, data[1:])
+        device._ble_client.on_write = on_write
+        with pytest.raises(asyncio.TimeoutError):
+            await spi.transaction(b'\x01', timeout=0.01)
+        second = await spi.transaction(b'\x02', timeout=1.0)
+        third = await spi.transaction(b'\x03')
+        return second, third
+    second, third = asyncio.run(main())
+    assert second == bytearray(b'\x02')
+    assert third == bytearray(b'\x03')
+
+
+def test_request_cancelled_before_the_write_is_removed(connect):
+    async def main():
+        device = await connect()
+        i2c = device.io.i2c
+        gate = asyncio.Event()
+        async def on_write(uuid, data):
+            if data[0] != I2C.KONASHI_CTL_CMD_I2C_DATA:
+                return
+            if data[4:] == b'\x01':
+                # the first write never completes
+                await gate.wait()
+            _respond_later(0.001, i2c._ntf_cb_data_in, bytes([I2C.I2CResult.DONE, data[3]]) + data[4:])
+        device._ble_client.on_write = on_write
+        stuck = asyncio.ensure_future(i2c.transaction(I2C.I2COperation.WRITE, 0x10, 0, b'\x01'))
+        await asyncio.sleep(0.01)
+        stuck.cancel()
+        res = await asyncio.wait_for(i2c.transaction(I2C.I2COperation.WRITE, 0x10, 0, b'\x02'), 1.0)
+        return res, i2c.queue_depth
+    res, depth = asyncio.run(main())
+    assert res == (I2C.I2CResult.DONE, 0x10, b'\x02')
+    assert depth == 0
+
+
+def test_concurrent_requests_get_their_own_responses(connect):
+    async def main():
+        device = await connect()
+        spi = device.io.spi
+        def on_write(uuid, data):
+            if data[0] == SPI.KONASHI_CTL_CMD_SPI_DATA:
+                _respond_later(0.002, spi._ntf_cb_data_in, data[1:])
+        device._ble_client.on_write = on_write
+        return await asyncio.gather(*(spi.transaction(bytes([i])) for i in range(8)))
+    results = asyncio.run(main())
+    assert [r[0] for r in results] == list(range(8))
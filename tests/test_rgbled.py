@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("bleak")
+
+from konashi.Builtin import RGBLed
+
+
+def _notify_color(rgbled, color):
+    rgbled._ntf_cb(None, RGBLed._RGB_STRUCT.pack(*color, 0))
+
+
+def test_replaced_command_ends_with_the_merged_one(connect):
+    async def main():
+        device = await connect()
+        rgbled = device.builtin.rgbled
+        gate = asyncio.Event()
+        written = []
+        async def on_write(uuid, data):
+            if uuid == RGBLed.KONASHI_UUID_BUILTIN_RGB_SET:
+                written.append(RGBLed._RGB_STRUCT.unpack(data)[0:4])
+                if len(written) == 1:
+                    await gate.wait()
+        device._ble_client.on_write = on_write
+        first = asyncio.ensure_future(rgbled.set(255, 0, 0, 255, 0))
+        await asyncio.sleep(0)
+        # queued behind the first write, the second is replaced by the third
+        second = asyncio.ensure_future(rgbled.set(0, 255, 0, 255, 0))
+        await asyncio.sleep(0)
+        third = asyncio.ensure_future(rgbled.set(0, 0, 255, 255, 0))
+        await asyncio.sleep(0)
+        gate.set()
+        first_future = await first
+        second_future = await second
+        third_future = await third
+        _notify_color(rgbled, (0, 0, 255, 255))
+        colors = await asyncio.wait_for(asyncio.gather(second_future, third_future), 1.0)
+        return written, first_future.cancelled(), colors
+    written, first_cancelled, colors = asyncio.run(main())
+    assert written == [(255, 0, 0, 255), (0, 0, 255, 255)]
+    # the transition in progress is superseded by the written command
+    assert first_cancelled
+    assert colors == [(0, 0, 255, 255), (0, 0, 255, 255)]
+
+
+def test_transition_ends_on_the_commanded_color(connect):
+    async def main():
+        device = await connect()
+        rgbled = device.builtin.rgbled
+        future = await rgbled.set(10, 20, 30, 255, 100)
+        # a notification of another color does not end the transition
+        _notify_color(rgbled, (5, 10, 15, 255))
+        await asyncio.sleep(0)
+        pending = not future.done()
+        _notify_color(rgbled, (10, 20, 30, 255))
+        return pending, await asyncio.wait_for(future, 1.0)
+    pending, color = asyncio.run(main())
+    assert pending
+    assert color == (10, 20, 30, 255)
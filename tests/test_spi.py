@@ -0,0 +1,81 @@
+import array
+import asyncio
+
+import pytest
+
+pytest.importorskip("bleak")
+
+from konashi.Errors import KonashiError
+from konashi.Io import SPI
+
+
+class _Slave:
+    # answers each transaction with the inverted data, after a short delay
+    def __init__(self, device, short=False):
+        self.spi = device.io.spi
+        self.short = short
+        self.sizes = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        device._ble_client.on_write = self.on_write
+
+    def on_write(self, uuid, data):
+        if uuid != SPI.KONASHI_UUID_CONTROL_CMD or data[0] != SPI.KONASHI_CTL_CMD_SPI_DATA:
+            return
+        self.sizes.append(len(data)-1)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        res = bytes(b^0xFF for b in data[1:])
+        if self.short:
+            res = res[:-1]
+        asyncio.get_event_loop().call_later(0.002, self.respond, res)
+
+    def respond(self, res):
+        self.in_flight -= 1
+        self.spi._ntf_cb_data_in(None, res)
+
+
+def test_transaction_into_a_buffer(connect):
+    async def main():
+        device = await connect()
+        _Slave(device)
+        out = bytearray(8)
+        res = await device.io.spi.transaction(b'\x00\x0f', out=memoryview(out)[2:])
+        with pytest.raises(ValueError):
+            await device.io.spi.transaction(b'\x00\x0f', out=bytearray(1))
+        return out, res, await device.io.spi.transaction(b'\x01')
+    out, res, allocated = asyncio.run(main())
+    assert out == bytearray(b'\x00\x00\xff\xf0\x00\x00\x00\x00')
+    assert bytes(res[:2]) == b'\xff\xf0'
+    assert allocated == bytearray(b'\xfe')
+
+
+def test_transfer_in_chunks_with_a_window(connect):
+    data = bytes(i&0xFF for i in range(300))
+    async def main():
+        device = await connect()
+        slave = _Slave(device)
+        res = await device.io.spi.transfer(data, window=2)
+        in_flight = slave.max_in_flight
+        out = array.array('H', [0]*150)
+        returned = await device.io.spi.transfer(array.array('H', [0x00FF]*150), out=out)
+        return slave, in_flight, res, out, returned
+    slave, in_flight, res, out, returned = asyncio.run(main())
+    assert res == bytearray(b^0xFF for b in data)
+    assert slave.sizes == [127, 127, 46, 127, 127, 46]
+    assert in_flight == 2
+    assert returned is out
+    assert list(out) == [0xFF00]*150
+
+
+def test_transfer_short_response(connect):
+    async def main():
+        device = await connect()
+        _Slave(device, short=True)
+        with pytest.raises(KonashiError, match="at offset 0 returned 126 bytes instead of 127"):
+            await device.io.spi.transfer(bytes(200))
+        with pytest.raises(ValueError):
+            await device.io.spi.transfer(b'')
+        with pytest.raises(ValueError):
+            await device.io.spi.transfer(b'\x00\x00', out=bytearray(1))
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("bleak")
+
+from konashi.Errors import TransferInterruptedError
+from konashi.Io import SPI
+from konashi.Io import SPIFlash
+
+
+class _Flash:
+    # 3-byte address flash behind the fake BLE client, a transaction can be made to answer short
+    def __init__(self, device, size=4096):
+        self.spi = device.io.spi
+        self.memory = bytes((i*7)&0xFF for i in range(size))
+        self.fail_at = None
+        self.transactions = 0
+        device._ble_client.on_write = self.on_write
+
+    def on_write(self, uuid, data):
+        if uuid != SPI.KONASHI_UUID_CONTROL_CMD or data[0] != SPI.KONASHI_CTL_CMD_SPI_DATA:
+            return
+        self.transactions += 1
+        frame = data[1:]
+        address = int.from_bytes(frame[1:4], 'big')
+        res = bytes(4)+self.memory[address:address+len(frame)-4]
+        if self.transactions == self.fail_at:
+            res = res[:-1]
+        asyncio.get_event_loop().call_soon(self.spi._ntf_cb_data_in, None, res)
+
+
+def test_read_resumes_after_an_interruption(connect):
+    async def main():
+        device = await connect()
+        flash = _Flash(device)
+        reader = SPIFlash.SPIFlash(device.io.spi)
+        out = bytearray(1000)
+        flash.fail_at = 4
+        with pytest.raises(TransferInterruptedError) as e:
+            await reader.read(0x100, 1000, out)
+        offset = e.value.offset
+        await reader.read(0x100+offset, 1000-offset, memoryview(out)[offset:])
+        return flash, offset, out
+    flash, offset, out = asyncio.run(main())
+    # the 3 chunks before the short one were read
+    assert offset == 3*123
+    assert out == flash.memory[0x100:0x100+1000]
+
+
+def test_dump_resumes_and_verifies(connect, tmp_path):
+    path = str(tmp_path/"dump.bin")
+    reference = tmp_path/"reference.bin"
+    async def main():
+        device = await connect()
+        flash = _Flash(device)
+        image = bytearray(flash.memory[0x200:0x200+2000])
+        image[1500] ^= 0x01
+        image[1700:1702] = b'\x00\x00'
+        reference.write_bytes(image)
+        dumper = SPIFlash.SPIFlash(device.io.spi)
+        flash.fail_at = 6
+        with pytest.raises(TransferInterruptedError) as e:
+            await dumper.dump(path, 2000, address=0x200, reference=str(reference))
+        offset = e.value.offset
+        stats = await dumper.dump(path, 2000, address=0x200, offset=offset, reference=str(reference))
+        return flash, offset, stats
+    flash, offset, stats = asyncio.run(main())
+    assert offset == 5*123
+    with open(path, "rb") as f:
+        assert f.read() == flash.memory[0x200:0x200+2000]
+    assert stats.length == 2000-offset
+    assert stats.mismatches == 1+sum(1 for i in (1700, 1701) if flash.memory[0x200+i] != 0)
+    assert stats.first_mismatch == 1500
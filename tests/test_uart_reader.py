@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("bleak")
+
+from konashi.Errors import KonashiConnectionError
+from konashi.Io import UART
+
+
+class _Konashi:
+    _ble_client = None
+
+
+def _make_reader(capacity):
+    uart = UART._UART(_Konashi())
+    return uart, uart.create_reader(capacity)
+
+
+def test_interleaved_reads_do_not_drop():
+    # the space of the last read is reclaimed when the next notification needs it
+    uart, reader = _make_reader(16)
+    async def main():
+        received = bytearray()
+        for i in range(50):
+            uart._ntf_cb_data_in(None, bytes([i])*10)
+            await asyncio.sleep(0)
+            received += await reader.readexactly(10)
+        return received
+    received = asyncio.run(main())
+    assert received == b''.join(bytes([i])*10 for i in range(50))
+    assert reader.dropped == 0
+
+
+def test_reclaimed_view_is_released():
+    uart, reader = _make_reader(16)
+    async def main():
+        reader.feed_data(b'0123456789')
+        view = await reader.readexactly(10)
+        assert bytes(view) == b'0123456789'
+        reader.feed_data(b'abcdefghij')
+        with pytest.raises(ValueError):
+            bytes(view)
+        return bytes(await reader.readexactly(10))
+    assert asyncio.run(main()) == b'abcdefghij'
+
+
+def test_full_buffer_drops_and_counts():
+    uart, reader = _make_reader(8)
+    async def main():
+        reader.feed_data(b'01234')
+        reader.feed_data(b'56789')
+        return bytes(await reader.read(8))
+    assert asyncio.run(main()) == b'01234567'
+    assert reader.dropped == 2
+    assert reader.overflows == 1
+
+
+def test_readuntil_across_the_wrap():
+    uart, reader = _make_reader(8)
+    async def main():
+        reader.feed_data(b'abcdef')
+        assert bytes(await reader.readexactly(5)) == b'abcde'
+        reader.feed_data(b'gh\r\nij')
+        return bytes(await reader.readuntil(b'\r\n')), bytes(await reader.read(8))
+    line, rest = asyncio.run(main())
+    assert line == b'fgh\r\n'
+    assert rest == b'ij'
+
+
+def test_eof_returns_the_remaining_data():
+    uart, reader = _make_reader(16)
+    async def main():
+        reader.feed_data(b'one\ntwo')
+        reader.feed_eof()
+        lines = [bytes(line) async for line in reader]
+        with pytest.raises(asyncio.IncompleteReadError):
+            await reader.readexactly(1)
+        return lines
+    assert asyncio.run(main()) == [b'one\n', b'two']
+
+
+def test_reader_created_outside_a_loop_is_bound_lazily():
+    uart, reader = _make_reader(16)
+    async def read_line(data):
+        uart._ntf_cb_data_in(None, data)
+        return bytes(await reader.readline())
+    assert asyncio.run(read_line(b'first\n')) == b'first\n'
+    # a new event loop
+    assert asyncio.run(read_line(b'second\n')) == b'second\n'
+
+
+def test_concurrent_waiters_are_rejected():
+    uart, reader = _make_reader(16)
+    async def main():
+        waiting = asyncio.ensure_future(reader.readline())
+        await asyncio.sleep(0)
+        with pytest.raises(RuntimeError):
+            await reader.read(1)
+        uart._ntf_cb_data_in(None, b'ok\n')
+        return bytes(await waiting)
+    assert asyncio.run(main()) == b'ok\n'
+
+
+def test_readers_fail_on_disconnection_and_reconnection():
+    uart, reader = _make_reader(16)
+    async def main():
+        waiting = asyncio.ensure_future(reader.read(1))
+        await asyncio.sleep(0)
+        uart._on_disconnect()
+        with pytest.raises(KonashiConnectionError):
+            await waiting
+        other = uart.create_reader(16)
+        uart._fail_readers("The connection was reset")
+        with pytest.raises(KonashiConnectionError):
+            await other.read(1)
+        # the failed readers do not receive anymore
+        uart._ntf_cb_data_in(None, b'late')
+        return reader.received, other.received
+    assert asyncio.run(main()) == (0, 0)
@@ -0,0 +1,80 @@
+import asyncio
+import random
+
+import pytest
+
+pytest.importorskip("bleak")
+
+from konashi.Io import UART
+
+
+class _Client:
+    # sends the send done notification of each write after a random delay
+    def __init__(self, seed=0, write_delay=(0, 0.002), done_delay=(0, 0.005)):
+        self.uart = None
+        self._write_delay = write_delay
+        self._done_delay = done_delay
+        self.sent = bytearray()
+        self.max_in_flight = 0
+        self._random = random.Random(seed)
+
+    async def write_gatt_char(self, uuid, data, response):
+        await asyncio.sleep(self._random.uniform(*self._write_delay))
+        if data[0] == UART.KONASHI_CTL_CMD_UART_DATA:
+            self.sent += data[1:]
+            self.max_in_flight = max(self.max_in_flight, self.uart.queue_depth)
+            asyncio.get_event_loop().call_later(self._random.uniform(*self._done_delay), self.uart._ntf_cb_send_done, None, b'\x01')
+
+
+class _Konashi:
+    def __init__(self, client):
+        self._ble_client = client
+
+
+def _make_uart(**kwargs):
+    client = _Client(**kwargs)
+    uart = UART._UART(_Konashi(client))
+    client.uart = uart
+    return uart, client
+
+
+def test_concurrent_writes_keep_byte_order():
+    async def main():
+        uart, client = _make_uart()
+        writer = uart.create_writer(window=4, high_water=256)
+        expected = bytearray()
+        async def produce(tag):
+            for i in range(40):
+                data = bytes([tag])*(1+(i*37)%200)
+                writer.write(data)
+                expected.extend(data)
+                await writer.drain()
+                await asyncio.sleep(0)
+        await asyncio.gather(*(produce(tag) for tag in range(3)))
+        await writer.wait_closed()
+        return uart, client, writer, expected
+    uart, client, writer, expected = asyncio.run(main())
+    assert client.sent == expected
+    assert writer.bytes_sent == len(expected)
+    assert writer.get_write_buffer_size() == 0
+    assert client.max_in_flight > 1
+
+
+def test_write_during_flight_is_sent_without_waiting():
+    async def main():
+        uart, client = _make_uart(write_delay=(0, 0), done_delay=(0.05, 0.05))
+        writer = uart.create_writer(window=4)
+        writer.write(b'a'*10)
+        while len(client.sent) < 10:
+            await asyncio.sleep(0)
+        # the first chunk is still waiting for its send done notification
+        assert uart.queue_depth == 1
+        writer.write(b'b'*10)
+        while len(client.sent) < 20:
+            await asyncio.sleep(0)
+        depth = uart.queue_depth
+        await writer.wait_closed()
+        return client, depth
+    client, depth = asyncio.run(main())
+    assert depth == 2
+    assert client.sent == b'a'*10+b'b'*10